@@ -0,0 +1,227 @@
+"""
+Потоковая выгрузка transactions / exchange_orders / users в CSV или NDJSON со сжатием gzip.
+Строки читаются именованным (серверным) курсором и кодируются порциями,
+поэтому память не зависит от размера выгрузки. Продолжение — по keyset-токену (created_at, id);
+строки без created_at идут в конце выгрузки. Ответ функции — одно тело, поэтому страница
+обрезается по EXPORT_MAX_BYTES сжатых данных и продолжается по токену.
+
+Запуск из консоли:
+    python export.py transactions --from 2024-01-01 --to 2024-02-01 --format csv > tx.csv.gz
+"""
+import base64
+import csv
+import io
+import json
+import os
+import re
+import sys
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+EXPORT_COLUMNS: Dict[str, List[str]] = {
+    'transactions': [
+        'id', 'user_id', 'type', 'currency', 'amount', 'status', 'related_order_id',
+        'recipient_user_id', 'card_number', 'crypto_address', 'tx_hash', 'created_at', 'updated_at'
+    ],
+    'exchange_orders': [
+        'id', 'user_id', 'from_currency', 'to_currency', 'from_amount', 'to_amount',
+        'exchange_rate', 'fee', 'status', 'crypto_bot_invoice_id', 'completed_at', 'created_at'
+    ],
+    'users': [
+        'id', 'telegram_id', 'username', 'first_name', 'referral_code', 'referred_by_id',
+        'balance_rub', 'referral_earnings', 'is_admin', 'is_blocked', 'created_at', 'updated_at'
+    ],
+}
+
+CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+FETCH_SIZE = 5000
+CHUNK_SIZE = 256 * 1024
+EXPORT_MAX_BYTES = int(os.environ.get('EXPORT_MAX_BYTES', str(2 * 1024 * 1024)))
+
+# created_at в текстовом виде Postgres (TIMESTAMP без часового пояса)
+TIMESTAMP_TEXT = re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(\.\d{1,6})?')
+
+
+def encode_token(created_at: Any, row_id: int) -> str:
+    """Keyset-токен для продолжения выгрузки после строки (created_at, id)"""
+    raw = json.dumps({'created_at': None if created_at is None else str(created_at), 'id': row_id}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_token(token: str) -> Tuple[Optional[str], int]:
+    """(created_at или None, id); ValueError — токен испорчен"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        created_at, row_id = data['created_at'], data['id']
+    except (ValueError, TypeError, KeyError):
+        raise ValueError('Invalid export token') from None
+    if not isinstance(row_id, int) or isinstance(row_id, bool):
+        raise ValueError('Invalid export token')
+    if created_at is not None and not (isinstance(created_at, str) and TIMESTAMP_TEXT.fullmatch(created_at)):
+        raise ValueError('Invalid export token')
+    return created_at, row_id
+
+
+def build_query(entity: str, date_from: Optional[str], date_to: Optional[str],
+                token: Optional[str], limit: Optional[int]) -> Tuple[str, List[Any]]:
+    if entity not in EXPORT_COLUMNS:
+        raise ValueError(f'Unknown export entity: {entity}')
+
+    conditions = []
+    values: List[Any] = []
+
+    if date_from:
+        conditions.append('created_at >= %s')
+        values.append(date_from)
+    if date_to:
+        conditions.append('created_at < %s')
+        values.append(date_to)
+    if token:
+        created_at, row_id = decode_token(token)
+        # ORDER BY created_at ставит NULL в конец: после строки с датой идут и все строки без нее
+        if created_at is None:
+            conditions.append('(created_at IS NULL AND id > %s)')
+            values.append(row_id)
+        else:
+            conditions.append('((created_at, id) > (%s::timestamp, %s) OR created_at IS NULL)')
+            values.extend([created_at, row_id])
+
+    sql = f"SELECT {', '.join(EXPORT_COLUMNS[entity])} FROM {entity}"
+    if conditions:
+        sql += f" WHERE {' AND '.join(conditions)}"
+    sql += ' ORDER BY created_at, id'
+    if limit:
+        sql += ' LIMIT %s'
+        values.append(limit)
+
+    return sql, values
+
+
+class ExportStream:
+    """
+    Итератор по gzip-чанкам выгрузки.
+    После исчерпания next_token указывает на последнюю выгруженную строку.
+    """
+
+    def __init__(self, conn, entity: str, fmt: str = 'csv', date_from: Optional[str] = None,
+                 date_to: Optional[str] = None, token: Optional[str] = None,
+                 limit: Optional[int] = None, chunk_size: int = CHUNK_SIZE):
+        if fmt not in CONTENT_TYPES:
+            raise ValueError(f'Unknown export format: {fmt}')
+        self.conn = conn
+        self.entity = entity
+        self.fmt = fmt
+        self.columns = EXPORT_COLUMNS[entity]
+        self.sql, self.values = build_query(entity, date_from, date_to, token, limit)
+        # Заголовок CSV пишем только в начале выгрузки, а не при продолжении
+        self.header = token is None
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.next_token: Optional[str] = None
+        self.complete = False
+
+    def _encode_rows(self, rows: List[tuple]) -> str:
+        if self.fmt == 'csv':
+            buf = io.StringIO()
+            writer = csv.writer(buf, lineterminator='\n')
+            if self.header:
+                writer.writerow(self.columns)
+                self.header = False
+            writer.writerows(['' if v is None else v for v in row] for row in rows)
+            return buf.getvalue()
+
+        columns = self.columns
+        return ''.join(
+            json.dumps(dict(zip(columns, row)), default=str, ensure_ascii=False) + '\n'
+            for row in rows
+        )
+
+    def __iter__(self) -> Iterator[bytes]:
+        # Каждый чанк — законченный gzip-член: склейка чанков остается валидным gzip,
+        # а токен после отданного чанка точно соответствует записанным строкам
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        pending: List[bytes] = []
+        pending_size = 0
+        id_idx = self.columns.index('id')
+        created_idx = self.columns.index('created_at')
+
+        cur = self.conn.cursor(name=f'export_{self.entity}')
+        cur.itersize = FETCH_SIZE
+        try:
+            cur.execute(self.sql, self.values)
+            while True:
+                rows = cur.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                data = compressor.compress(self._encode_rows(rows).encode('utf-8'))
+                if data:
+                    pending.append(data)
+                    pending_size += len(data)
+
+                self.rows += len(rows)
+                last = rows[-1]
+                self.next_token = encode_token(last[created_idx], last[id_idx])
+
+                if pending_size >= self.chunk_size:
+                    pending.append(compressor.flush())
+                    yield b''.join(pending)
+                    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+                    pending, pending_size = [], 0
+
+            if self.header and self.fmt == 'csv':
+                pending.append(compressor.compress(self._encode_rows([]).encode('utf-8')))
+            pending.append(compressor.flush())
+            yield b''.join(pending)
+        finally:
+            cur.close()
+
+    def read(self, max_bytes: int = EXPORT_MAX_BYTES) -> bytes:
+        """
+        Чанки выгрузки одним телом, пока оно не достигнет max_bytes. complete — выгрузка дошла до конца;
+        иначе next_token указывает на последнюю строку последнего отданного чанка
+        """
+        chunks = iter(self)
+        body: List[bytes] = []
+        size = 0
+        try:
+            for chunk in chunks:
+                body.append(chunk)
+                size += len(chunk)
+                if size >= max_bytes:
+                    break
+            else:
+                self.complete = True
+        finally:
+            chunks.close()
+        return b''.join(body)
+
+
+def main(argv: List[str]) -> int:
+    import argparse
+    import psycopg2
+
+    parser = argparse.ArgumentParser(description='Потоковая выгрузка в gzip CSV / NDJSON')
+    parser.add_argument('entity', choices=sorted(EXPORT_COLUMNS))
+    parser.add_argument('--from', dest='date_from')
+    parser.add_argument('--to', dest='date_to')
+    parser.add_argument('--format', dest='fmt', choices=sorted(CONTENT_TYPES), default='csv')
+    parser.add_argument('--token', help='продолжить выгрузку с токена из прошлого запуска')
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    stream = ExportStream(conn, args.entity, args.fmt, args.date_from, args.date_to, args.token)
+    out = sys.stdout.buffer
+    try:
+        for chunk in stream:
+            out.write(chunk)
+            # Gzip допускает склейку потоков, поэтому при обрыве можно дописать в тот же файл
+            print(f'rows={stream.rows} token={stream.next_token}', file=sys.stderr)
+        out.flush()
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,137 @@
+"""
+Кэш соответствия telegram_id → (user_id, is_admin, is_blocked).
+
+Ограниченный LRU с TTL; неизвестные telegram_id тоже кэшируются, но на короткое время,
+чтобы только что зарегистрированный пользователь быстро становился виден в других контейнерах.
+Внутри процесса auth и admin сбрасывают записи сразу при регистрации, блокировке или смене прав.
+
+Модуль одинаковый во всех функциях backend/ — при правке обновляйте все копии.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from statements import prepared
+
+USER_BY_TELEGRAM_ID = prepared(
+    'user_by_telegram_id', 'SELECT id, is_admin, is_blocked FROM users WHERE telegram_id = $1'
+)
+
+
+class UserIdentity(NamedTuple):
+    user_id: int
+    is_admin: bool
+    is_blocked: bool
+
+
+class IdentityCache:
+    def __init__(self, maxsize: int = 10000, ttl: float = 60.0, negative_ttl: float = 5.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.entries: 'OrderedDict[int, Tuple[float, Optional[UserIdentity]]]' = OrderedDict()
+        self.by_user_id: Dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, telegram_id: int) -> Tuple[bool, Optional[UserIdentity]]:
+        """(найдено в кэше, identity или None для неизвестного пользователя)"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(telegram_id)
+            if entry is None or entry[0] < now:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(telegram_id)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, telegram_id: int, identity: Optional[UserIdentity]) -> None:
+        expires = time.monotonic() + (self.ttl if identity is not None else self.negative_ttl)
+        with self.lock:
+            self.entries[telegram_id] = (expires, identity)
+            self.entries.move_to_end(telegram_id)
+            if identity is not None:
+                self.by_user_id[identity.user_id] = telegram_id
+            while len(self.entries) > self.maxsize:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                if evicted is not None:
+                    self.by_user_id.pop(evicted.user_id, None)
+
+    def invalidate(self, telegram_id: Optional[int] = None, user_id: Optional[int] = None) -> None:
+        with self.lock:
+            if telegram_id is None and user_id is not None:
+                telegram_id = self.by_user_id.get(user_id)
+            if telegram_id is None:
+                return
+            entry = self.entries.pop(telegram_id, None)
+            if entry is not None and entry[1] is not None:
+                self.by_user_id.pop(entry[1].user_id, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.by_user_id.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+
+CACHE = IdentityCache(
+    maxsize=int(os.environ.get('IDENTITY_CACHE_SIZE', '10000')),
+    ttl=float(os.environ.get('IDENTITY_CACHE_TTL', '60')),
+    negative_ttl=float(os.environ.get('IDENTITY_CACHE_NEGATIVE_TTL', '5')),
+)
+
+
+def parse_telegram_id(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def resolve_user(conn, telegram_id: Any) -> Optional[UserIdentity]:
+    """Пользователь по telegram_id: из кэша или одним запросом к users"""
+    key = parse_telegram_id(telegram_id)
+    if key is None:
+        return None
+
+    found, identity = CACHE.get(key)
+    if found:
+        return identity
+
+    cur = conn.cursor()
+    try:
+        USER_BY_TELEGRAM_ID.execute(cur, (key,))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+
+    identity = UserIdentity(row[0], bool(row[1]), bool(row[2])) if row else None
+    CACHE.put(key, identity)
+    return identity
+
+
+def remember_user(telegram_id: Any, user_id: int, is_admin: bool = False, is_blocked: bool = False) -> None:
+    """Кладет в кэш только что созданного или обновленного пользователя"""
+    key = parse_telegram_id(telegram_id)
+    if key is not None:
+        CACHE.put(key, UserIdentity(int(user_id), bool(is_admin), bool(is_blocked)))
+
+
+def current_user(conn, session: Any, telegram_id: Any) -> Any:
+    """
+    Пользователь для операций, двигающих деньги. Флаг блокировки в сессионном токене выставлен при входе,
+    поэтому при сессии is_blocked берется из кэша identity (его сбрасывает блокировка) или из users
+    """
+    if session is None:
+        return resolve_user(conn, telegram_id)
+    identity = resolve_user(conn, session.telegram_id)
+    if identity is None:
+        return None
+    return session._replace(is_blocked=identity.is_blocked)
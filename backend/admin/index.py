@@ -1,12 +1,50 @@
 """
 API для админ-панели: управление пользователями, транзакциями и статистикой
 """
+import base64
 import json
 import os
-from typing import Dict, Any
-import psycopg2
+from typing import Dict, Any, Optional, Tuple
 from psycopg2.extras import RealDictCursor
+from db import after_commit, get_db_connection, note_write
+from instrumentation import instrument
+from batch import batchable
+from encoding import list_response, negotiated
+from export import ExportStream, CONTENT_TYPES, TIMESTAMP_TEXT
+from identity import CACHE
+from liquidity import LIQUIDITY, OPEN_ORDER_STATUSES, SET_HOLDINGS_SQL
+from rows import fetch_all, fetch_one, text_cursor
 
+# Заголовки ответов собираются один раз при загрузке модуля
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Key',
+    'Access-Control-Max-Age': '86400'
+}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+def parse_users_cursor(cursor: str) -> Optional[Tuple[Optional[str], int]]:
+    """
+    Курсор списка пользователей "created_at|id" → (created_at, id); пустой created_at — строка с NULL.
+    None — курсор испорчен
+    """
+    created_at, separator, row_id = cursor.rpartition('|')
+    if not separator or not row_id.isdigit():
+        return None
+    if created_at and not TIMESTAMP_TEXT.fullmatch(created_at):
+        return None
+    return created_at or None, int(row_id)
+
+
+def users_cursor(created_at: Optional[str], row_id: Any) -> str:
+    return f"{created_at or ''}|{row_id}"
+
+
+@instrument('admin')
+@negotiated
+@batchable
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Админ-панель для управления платформой
@@ -19,12 +57,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Key',
-                'Access-Control-Max-Age': '86400'
-            },
+            'headers': CORS_HEADERS,
             'body': '',
             'isBase64Encoded': False
         }
@@ -36,16 +69,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if admin_key != os.environ.get('ADMIN_SECRET_KEY', 'admin123'):
         return {
             'statusCode': 403,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': JSON_HEADERS,
             'body': json.dumps({'error': 'Unauthorized'}),
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    # Все GET-действия админки только читают — их можно отдать реплике
+    conn = get_db_connection(readonly=method == 'GET')
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     params = event.get('queryStringParameters') or {}
-    action = params.get('action', 'stats')
+    body_data = json.loads(event.get('body') or '{}') if method == 'POST' else {}
+    action = body_data.get('action') or params.get('action', 'stats')
     
     try:
         # Общая статистика
@@ -71,7 +106,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({
                     'users': users_count,
                     'transactions': dict(tx_stats),
@@ -82,49 +117,88 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         # Список пользователей
         elif action == 'users':
-            limit = int(params.get('limit', 50))
+            limit = min(int(params.get('limit', 50)), 500)
             offset = int(params.get('offset', 0))
-            
-            cur.execute("""
-                SELECT u.*, 
-                       COUNT(DISTINCT w.id) as wallets_count,
-                       COUNT(DISTINCT t.id) as transactions_count
-                FROM users u
-                LEFT JOIN wallets w ON u.id = w.user_id
-                LEFT JOIN transactions t ON u.id = t.user_id
-                GROUP BY u.id
-                ORDER BY u.created_at DESC
-                LIMIT %s OFFSET %s
-            """, (limit, offset))
-            users = cur.fetchall()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps([dict(u) for u in users], default=str),
-                'isBase64Encoded': False
-            }
+            search = (params.get('search') or '').strip()
+            cursor = params.get('cursor')
+
+            # Сначала выбираем страницу пользователей по индексу (created_at, id),
+            # затем обогащаем только ее счетчиками из user_stats
+            conditions = []
+            values = []
+
+            if search:
+                pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                conditions.append("(username ILIKE %s OR telegram_id::text LIKE %s OR referral_code ILIKE %s)")
+                values.extend([pattern, pattern, pattern])
+
+            if cursor:
+                # Keyset-пагинация: курсор "created_at|id" из заголовка X-Next-Cursor
+                position = parse_users_cursor(cursor)
+                if position is None:
+                    return {
+                        'statusCode': 400,
+                        'headers': JSON_HEADERS,
+                        'body': json.dumps({'error': 'Invalid cursor'}),
+                        'isBase64Encoded': False
+                    }
+                cursor_created_at, cursor_id = position
+                if cursor_created_at is None:
+                    # При ORDER BY created_at DESC строки с NULL идут первыми: дальше — остаток NULL по id
+                    # и все строки с датой
+                    conditions.append("(created_at IS NOT NULL OR id < %s)")
+                    values.append(cursor_id)
+                else:
+                    conditions.append("(created_at, id) < (%s::timestamp, %s)")
+                    values.extend([cursor_created_at, cursor_id])
+                offset = 0
+
+            where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+            values.extend([limit, offset])
+
+            users_cur = text_cursor(conn)
+            users_cur.execute(f"""
+                SELECT u.*,
+                       COALESCE(s.wallets_count, 0) as wallets_count,
+                       COALESCE(s.transactions_count, 0) as transactions_count,
+                       s.last_activity_at
+                FROM (
+                    SELECT * FROM users
+                    {where_sql}
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s OFFSET %s
+                ) u
+                LEFT JOIN user_stats s ON s.user_id = u.id
+                ORDER BY u.created_at DESC, u.id DESC
+            """, tuple(values))
+            users = fetch_all(users_cur, 'users')
+            users_cur.close()
+
+            response_headers = {}
+            if len(users) == limit:
+                last = users[-1]
+                response_headers['X-Next-Cursor'] = users_cursor(last.created_at, last.id)
+                response_headers['Access-Control-Expose-Headers'] = 'X-Next-Cursor'
+
+            return list_response(event, users, headers=response_headers)
         
         # Список транзакций
         elif action == 'transactions':
             limit = int(params.get('limit', 50))
             offset = int(params.get('offset', 0))
             
-            cur.execute("""
+            tx_cur = text_cursor(conn)
+            tx_cur.execute("""
                 SELECT t.*, u.telegram_id, u.username
                 FROM transactions t
                 JOIN users u ON t.user_id = u.id
                 ORDER BY t.created_at DESC
                 LIMIT %s OFFSET %s
             """, (limit, offset))
-            transactions = cur.fetchall()
+            transactions = fetch_all(tx_cur, 'transactions')
+            tx_cur.close()
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps([dict(tx) for tx in transactions], default=str),
-                'isBase64Encoded': False
-            }
+            return list_response(event, transactions)
         
         # Детали пользователя
         elif action == 'user_details':
@@ -133,7 +207,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             if not user_id:
                 return {
                     'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': JSON_HEADERS,
                     'body': json.dumps({'error': 'user_id required'}),
                     'isBase64Encoded': False
                 }
@@ -144,7 +218,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             if not user:
                 return {
                     'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': JSON_HEADERS,
                     'body': json.dumps({'error': 'User not found'}),
                     'isBase64Encoded': False
                 }
@@ -167,7 +241,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({
                     'user': dict(user),
                     'wallets': [dict(w) for w in wallets],
@@ -176,10 +250,336 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
+        # Реферальное поддерево пользователя: число рефералов на каждом уровне из referral_closure
+        elif action == 'referral_tree':
+            user_id = params.get('user_id')
+            if not user_id:
+                return {
+                    'statusCode': 400,
+                    'headers': JSON_HEADERS,
+                    'body': json.dumps({'error': 'user_id required'}),
+                    'isBase64Encoded': False
+                }
+            max_depth = min(int(params.get('max_depth', 10)), 1000)
+
+            tree_cur = text_cursor(conn)
+            tree_cur.execute("""
+                SELECT direct_count, descendants_count, max_depth
+                FROM referral_subtree_stats
+                WHERE user_id = %s
+            """, (user_id,))
+            totals = fetch_one(tree_cur, 'referral_subtree_stats')
+            tree_cur.execute("""
+                SELECT depth, COUNT(*) AS users
+                FROM referral_closure
+                WHERE ancestor_id = %s AND depth <= %s
+                GROUP BY depth
+                ORDER BY depth
+            """, (user_id, max_depth))
+            levels = fetch_all(tree_cur, 'referral_levels')
+            tree_cur.close()
+
+            summary = totals._asdict() if totals else {'direct_count': 0, 'descendants_count': 0, 'max_depth': 0}
+            return list_response(event, levels, key='levels', extra={'user_id': int(user_id), **summary})
+
+        # Объем завершенных заявок поддерева по уровням, в рублях по текущему курсу
+        elif action == 'referral_volume':
+            user_id = params.get('user_id')
+            if not user_id:
+                return {
+                    'statusCode': 400,
+                    'headers': JSON_HEADERS,
+                    'body': json.dumps({'error': 'user_id required'}),
+                    'isBase64Encoded': False
+                }
+            max_depth = min(int(params.get('max_depth', 10)), 1000)
+            days = int(params.get('days', 0))
+
+            period_sql = 'AND eo.completed_at >= CURRENT_TIMESTAMP - make_interval(days => %s)' if days else ''
+            values = [days] if days else []
+            values.extend([user_id, max_depth])
+
+            volume_cur = text_cursor(conn)
+            volume_cur.execute(f"""
+                SELECT c.depth,
+                       COUNT(DISTINCT c.descendant_id) AS users,
+                       COUNT(DISTINCT eo.user_id) AS active_users,
+                       COUNT(eo.user_id) AS orders,
+                       COALESCE(SUM(eo.from_amount * CASE WHEN eo.from_currency = 'RUB' THEN 1 ELSE r.rate END), 0)
+                           AS volume_rub
+                FROM referral_closure c
+                LEFT JOIN exchange_orders eo
+                       ON eo.user_id = c.descendant_id AND eo.status = 'completed' {period_sql}
+                LEFT JOIN exchange_rates r ON r.from_currency = eo.from_currency AND r.to_currency = 'RUB'
+                WHERE c.ancestor_id = %s AND c.depth <= %s
+                GROUP BY c.depth
+                ORDER BY c.depth
+            """, tuple(values))
+            levels = fetch_all(volume_cur, 'referral_volume')
+            volume_cur.close()
+
+            return list_response(event, levels, key='levels', extra={'user_id': int(user_id), 'days': days})
+
+        # Рейтинг рефереров: по размеру поддерева из счетчиков или по объему заявок за период
+        elif action == 'top_referrers':
+            limit = min(int(params.get('limit', 50)), 500)
+            sort = params.get('sort', 'size')
+
+            top_cur = text_cursor(conn)
+            if sort == 'volume':
+                days = min(int(params.get('days', 30)), 3660)
+                max_depth = min(int(params.get('max_depth', 10)), 1000)
+                # Заявки периода берутся по индексу завершения, их предки — по индексу descendant_id
+                top_cur.execute("""
+                    WITH orders AS (
+                        SELECT eo.user_id,
+                               eo.from_amount * CASE WHEN eo.from_currency = 'RUB' THEN 1 ELSE r.rate END AS volume_rub
+                        FROM exchange_orders eo
+                        LEFT JOIN exchange_rates r ON r.from_currency = eo.from_currency AND r.to_currency = 'RUB'
+                        WHERE eo.status = 'completed'
+                          AND eo.completed_at >= CURRENT_TIMESTAMP - make_interval(days => %s)
+                    ),
+                    ranked AS (
+                        SELECT c.ancestor_id,
+                               COUNT(*) AS orders,
+                               COUNT(DISTINCT c.descendant_id) AS active_users,
+                               COALESCE(SUM(o.volume_rub), 0) AS volume_rub
+                        FROM orders o
+                        JOIN referral_closure c ON c.descendant_id = o.user_id AND c.depth <= %s
+                        GROUP BY c.ancestor_id
+                        ORDER BY volume_rub DESC, c.ancestor_id
+                        LIMIT %s
+                    )
+                    SELECT r.ancestor_id AS user_id, u.telegram_id, u.username,
+                           r.orders, r.active_users, r.volume_rub
+                    FROM ranked r
+                    JOIN users u ON u.id = r.ancestor_id
+                    ORDER BY r.volume_rub DESC, r.ancestor_id
+                """, (days, max_depth, limit))
+            else:
+                top_cur.execute("""
+                    SELECT s.user_id, u.telegram_id, u.username,
+                           s.direct_count, s.descendants_count, s.max_depth
+                    FROM referral_subtree_stats s
+                    JOIN users u ON u.id = s.user_id
+                    ORDER BY s.descendants_count DESC, s.user_id
+                    LIMIT %s
+                """, (limit,))
+            referrers = fetch_all(top_cur, 'top_referrers')
+            top_cur.close()
+
+            return list_response(event, referrers)
+
+        # Выгрузка в gzip CSV / NDJSON постранично по keyset-токену
+        elif action == 'export':
+            entity = params.get('entity', 'transactions')
+            fmt = params.get('format', 'csv')
+            limit = min(int(params.get('limit', 50000)), 200000)
+
+            try:
+                stream = ExportStream(
+                    conn, entity, fmt,
+                    date_from=params.get('from'),
+                    date_to=params.get('to'),
+                    token=params.get('token'),
+                    limit=limit
+                )
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': JSON_HEADERS,
+                    'body': json.dumps({'error': str(e)}),
+                    'isBase64Encoded': False
+                }
+
+            # Тело ограничено EXPORT_MAX_BYTES; остаток страницы — по X-Export-Token
+            body = stream.read()
+
+            response_headers = {
+                'Content-Type': 'application/gzip',
+                'Content-Disposition': f'attachment; filename="{entity}.{fmt}.gz"',
+                'X-Export-Format': CONTENT_TYPES[fmt],
+                'X-Export-Rows': str(stream.rows),
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': 'X-Export-Rows, X-Export-Token, X-Export-Format'
+            }
+            # Токен продолжения отдаем, если страница заполнена целиком или обрезана по размеру
+            if stream.rows == limit or not stream.complete:
+                response_headers['X-Export-Token'] = stream.next_token
+
+            return {
+                'statusCode': 200,
+                'headers': response_headers,
+                'body': base64.b64encode(body).decode('ascii'),
+                'isBase64Encoded': True
+            }
+
+        # Ликвидность по валютам: активы, обязательства, обещанное и свободный остаток — всегда по свежей сверке
+        elif action == 'liquidity':
+            LIQUIDITY.reconcile(conn)
+            reserves = LIQUIDITY.exposure()
+            
+            cur.execute(
+                """
+                SELECT to_currency, COUNT(*) AS flagged_orders
+                FROM exchange_orders
+                WHERE liquidity_flagged AND status = ANY(%s)
+                GROUP BY to_currency
+                """,
+                (OPEN_ORDER_STATUSES,)
+            )
+            flagged = {row['to_currency']: row['flagged_orders'] for row in cur.fetchall()}
+            for reserve in reserves:
+                reserve['flagged_orders'] = flagged.get(reserve['currency'], 0)
+            
+            return {
+                'statusCode': 200,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'mode': LIQUIDITY.mode, 'reserves': reserves}),
+                'isBase64Encoded': False
+            }
+        
+        # Срабатывания оценщика риска: flag, hold и block по пополнениям, заявкам и переводам
+        elif action == 'risk_events':
+            limit = int(params.get('limit', 100))
+            
+            risk_cur = text_cursor(conn)
+            risk_cur.execute("""
+                SELECT r.*, u.telegram_id, u.username, u.is_blocked
+                FROM risk_events r
+                JOIN users u ON r.user_id = u.id
+                ORDER BY r.created_at DESC
+                LIMIT %s
+            """, (limit,))
+            events = fetch_all(risk_cur, 'risk_events')
+            risk_cur.close()
+            
+            return list_response(event, events)
+        
+        # Активы на хранении по валюте (например, по балансу приложения в Crypto Bot)
+        elif action == 'set_reserve' and method == 'POST':
+            currency = body_data.get('currency')
+            holdings = body_data.get('holdings')
+            
+            if not currency or holdings is None:
+                return {
+                    'statusCode': 400,
+                    'headers': JSON_HEADERS,
+                    'body': json.dumps({'error': 'currency and holdings required'}),
+                    'isBase64Encoded': False
+                }
+            
+            cur.execute(SET_HOLDINGS_SQL, (currency, str(holdings)))
+            reserve = cur.fetchone()
+            conn.commit()
+            
+            return {
+                'statusCode': 200,
+                'headers': JSON_HEADERS,
+                'body': json.dumps(dict(reserve), default=str),
+                'isBase64Encoded': False
+            }
+        
+        # Зачисление пополнения, задержанного оценщиком риска
+        elif action == 'release_deposit' and method == 'POST':
+            transaction_id = body_data.get('transaction_id')
+            
+            if not transaction_id:
+                return {
+                    'statusCode': 400,
+                    'headers': JSON_HEADERS,
+                    'body': json.dumps({'error': 'transaction_id required'}),
+                    'isBase64Encoded': False
+                }
+            
+            cur.execute(
+                """
+                WITH released AS (
+                    UPDATE transactions SET status = 'completed', updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND type = 'deposit' AND status = 'held'
+                    RETURNING id, user_id, currency, amount
+                ),
+                credited AS (
+                    INSERT INTO wallets (user_id, currency, balance)
+                    SELECT user_id, currency, amount FROM released
+                    ON CONFLICT (user_id, currency)
+                    DO UPDATE SET balance = wallets.balance + EXCLUDED.balance, updated_at = CURRENT_TIMESTAMP
+                    RETURNING balance
+                ),
+                notified AS (
+                    INSERT INTO notifications (user_id, type, title, message)
+                    SELECT user_id, 'info', 'Пополнение зачислено',
+                           'Проверка завершена, на ваш счет зачислено ' || amount || ' ' || currency
+                    FROM released
+                )
+                SELECT r.id, r.currency, r.amount, u.telegram_id, (SELECT balance FROM credited) AS balance
+                FROM released r JOIN users u ON u.id = r.user_id
+                """,
+                (transaction_id,)
+            )
+            released = cur.fetchone()
+            conn.commit()
+            
+            if not released:
+                return {
+                    'statusCode': 404,
+                    'headers': JSON_HEADERS,
+                    'body': json.dumps({'error': 'Held deposit not found'}),
+                    'isBase64Encoded': False
+                }
+            
+            note_write(released['telegram_id'])
+            
+            return {
+                'statusCode': 200,
+                'headers': JSON_HEADERS,
+                'body': json.dumps(dict(released), default=str),
+                'isBase64Encoded': False
+            }
+        
+        # Блокировка / права администратора
+        elif action == 'update_user' and method == 'POST':
+            user_id = body_data.get('user_id')
+            updates = {k: bool(body_data[k]) for k in ('is_blocked', 'is_admin') if k in body_data}
+            
+            if not user_id or not updates:
+                return {
+                    'statusCode': 400,
+                    'headers': JSON_HEADERS,
+                    'body': json.dumps({'error': 'user_id and is_blocked or is_admin required'}),
+                    'isBase64Encoded': False
+                }
+            
+            set_sql = ', '.join(f"{column} = %s" for column in updates)
+            cur.execute(
+                f"UPDATE users SET {set_sql} WHERE id = %s RETURNING id, telegram_id, is_admin, is_blocked",
+                (*updates.values(), user_id)
+            )
+            user = cur.fetchone()
+            conn.commit()
+            
+            if not user:
+                return {
+                    'statusCode': 404,
+                    'headers': JSON_HEADERS,
+                    'body': json.dumps({'error': 'User not found'}),
+                    'isBase64Encoded': False
+                }
+            
+            # Остальные функции процесса сразу увидят новые флаги, другие контейнеры — по истечении TTL
+            after_commit(CACHE.invalidate, telegram_id=user['telegram_id'])
+            
+            return {
+                'statusCode': 200,
+                'headers': JSON_HEADERS,
+                'body': json.dumps(dict(user), default=str),
+                'isBase64Encoded': False
+            }
+
         else:
             return {
                 'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'error': 'Invalid action'}),
                 'isBase64Encoded': False
             }
@@ -187,7 +587,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     except Exception as e:
         return {
             'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': JSON_HEADERS,
             'body': json.dumps({'error': str(e)}),
             'isBase64Encoded': False
         }
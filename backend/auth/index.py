@@ -6,44 +6,91 @@ import os
 import random
 import string
 from typing import Dict, Any
-import psycopg2
 from psycopg2.extras import RealDictCursor
+from db import get_db_connection, note_write
+from instrumentation import instrument
+from identity import remember_user
+from ratelimit import LIMITER
+from session import issue_token, session_required, validate_init_data
 
 def generate_referral_code(length: int = 8) -> str:
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
 
+def with_session(user: Dict[str, Any]) -> Dict[str, Any]:
+    """Строка пользователя + сессионный токен для остальных функций"""
+    result = dict(user)
+    session = issue_token(user['id'], user['telegram_id'], user.get('is_admin'), user.get('is_blocked'))
+    if session:
+        result['session_token'] = session['token']
+        result['session_expires_at'] = session['expires_at']
+    return result
+
+# Заголовки ответов собираются один раз при загрузке модуля
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Telegram-User-Id, X-Session-Token, Authorization',
+    'Access-Control-Max-Age': '86400'
+}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+@instrument('auth')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Telegram-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
+            'headers': CORS_HEADERS,
             'body': '',
             'isBase64Encoded': False
         }
     
     if method == 'POST':
         body_data = json.loads(event.get('body', '{}'))
-        telegram_id = body_data.get('telegram_id')
-        username = body_data.get('username', '')
-        first_name = body_data.get('first_name', '')
+        init_data = body_data.get('init_data')
         referral_code_used = body_data.get('referral_code')
         
+        if init_data:
+            # Данные пользователя берем только из подписанного Telegram initData
+            fields = validate_init_data(init_data, os.environ.get('TELEGRAM_BOT_TOKEN', ''))
+            if not fields or not fields.get('user'):
+                return {
+                    'statusCode': 401,
+                    'headers': JSON_HEADERS,
+                    'body': json.dumps({'error': 'Invalid initData'}),
+                    'isBase64Encoded': False
+                }
+            telegram_user = fields['user']
+            telegram_id = telegram_user.get('id')
+            username = telegram_user.get('username', '')
+            first_name = telegram_user.get('first_name', '')
+            referral_code_used = referral_code_used or fields.get('start_param')
+        elif session_required():
+            return {
+                'statusCode': 401,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'init_data is required'}),
+                'isBase64Encoded': False
+            }
+        else:
+            telegram_id = body_data.get('telegram_id')
+            username = body_data.get('username', '')
+            first_name = body_data.get('first_name', '')
+        
         if not telegram_id:
             return {
                 'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'error': 'telegram_id is required'}),
                 'isBase64Encoded': False
             }
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        limited = LIMITER.check(event, 'auth.login', telegram_id)
+        if limited:
+            return limited
+        
+        conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         cur.execute(
@@ -53,13 +100,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         user = cur.fetchone()
         
         if user:
+            cur.close()
+            conn.close()
+            remember_user(user['telegram_id'], user['id'], user.get('is_admin'), user.get('is_blocked'))
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(dict(user), default=str),
+                'headers': JSON_HEADERS,
+                'body': json.dumps(with_session(user), default=str),
                 'isBase64Encoded': False
             }
         
+        # Регистрации ограничены отдельно: каждая — это пользователь и четыре кошелька
+        limited = LIMITER.check(event, 'auth.signup', telegram_id)
+        if limited:
+            cur.close()
+            conn.close()
+            return limited
+        
         referral_code = generate_referral_code()
         referred_by_id = None
         
@@ -89,6 +146,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             )
         
         if referred_by_id:
+            # Новый пользователь становится потомком реферера и всех его предков в referral_closure
+            cur.execute(
+                """
+                INSERT INTO referral_closure (ancestor_id, descendant_id, depth)
+                SELECT %s, %s, 1
+                UNION ALL
+                SELECT ancestor_id, %s, depth + 1 FROM referral_closure WHERE descendant_id = %s
+                """,
+                (referred_by_id, new_user['id'], new_user['id'], referred_by_id)
+            )
             cur.execute(
                 """
                 INSERT INTO notifications (user_id, type, title, message)
@@ -101,16 +168,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         cur.close()
         conn.close()
         
+        note_write(telegram_id)
+        # Сбрасывает закэшированный "пользователь не найден" и избавляет следующий запрос от поиска в users
+        remember_user(telegram_id, new_user['id'], new_user.get('is_admin'), new_user.get('is_blocked'))
+        
         return {
             'statusCode': 201,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps(dict(new_user), default=str),
+            'headers': JSON_HEADERS,
+            'body': json.dumps(with_session(new_user), default=str),
             'isBase64Encoded': False
         }
     
     return {
         'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'headers': JSON_HEADERS,
         'body': json.dumps({'error': 'Method not allowed'}),
         'isBase64Encoded': False
     }
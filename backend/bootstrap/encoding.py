@@ -0,0 +1,207 @@
+"""
+Согласование формата и сжатия ответа.
+
+@negotiated сжимает тело ответа gzip или brotli (если установлен модуль brotli), когда клиент
+прислал подходящий Accept-Encoding, а тело длиннее COMPRESS_MIN_BYTES; сжатое тело уходит
+в base64 с isBase64Encoded=True. list_response() отдает списки в одном из форматов:
+обычный JSON, колоночный JSON ({"columns": [...], "rows": [[...]]}) или MessagePack
+(если установлен msgpack). Формат выбирается параметром format=json|columnar|msgpack
+или заголовком Accept.
+
+Модуль одинаковый во всех функциях backend/ — при правке обновляйте все копии.
+"""
+import base64
+import functools
+import gzip
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from instrumentation import REGISTRY
+from serializer import dumps
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '5'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '4'))
+
+COLUMNAR_TYPE = 'application/vnd.columnar+json'
+MSGPACK_TYPE = 'application/x-msgpack'
+
+# Уже сжатые тела (выгрузка admin?action=export в gzip) повторно не сжимаются
+COMPRESSIBLE_TYPES = ('application/json', COLUMNAR_TYPE, MSGPACK_TYPE, 'application/x-ndjson', 'text/')
+
+FORMATS = {
+    'json': 'application/json',
+    'columnar': COLUMNAR_TYPE,
+    'msgpack': MSGPACK_TYPE,
+}
+
+
+def _header(event: Dict[str, Any], name: str) -> str:
+    headers = event.get('headers') or {}
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value or ''
+    return ''
+
+
+def _accepted(value: str) -> Dict[str, float]:
+    """Разбор Accept / Accept-Encoding в {значение: q}"""
+    result: Dict[str, float] = {}
+    for part in value.split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        result[token] = q
+    return result
+
+
+def response_format(event: Dict[str, Any]) -> str:
+    """json, columnar или msgpack; недоступный msgpack заменяется на json"""
+    params = event.get('queryStringParameters') or {}
+    fmt = (params.get('format') or '').lower()
+    if fmt not in FORMATS:
+        accept = _accepted(_header(event, 'accept'))
+        fmt = 'json'
+        for name in ('msgpack', 'columnar'):
+            if accept.get(FORMATS[name], 0) > 0:
+                fmt = name
+                break
+    if fmt == 'msgpack' and msgpack is None:
+        return 'json'
+    return fmt
+
+
+def content_encoding(event: Dict[str, Any]) -> Optional[str]:
+    """br или gzip по Accept-Encoding клиента; None — без сжатия"""
+    accept = _accepted(_header(event, 'accept-encoding'))
+    if brotli is not None and accept.get('br', 0) > 0:
+        return 'br'
+    if accept.get('gzip', 0) > 0 or (accept.get('*', 0) > 0 and 'gzip' not in accept):
+        return 'gzip'
+    return None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def columnar(rows: List[Any]) -> Dict[str, Any]:
+    """Имена колонок один раз, значения — массивами без ключей"""
+    if not rows:
+        return {'columns': [], 'rows': []}
+    return {'columns': list(rows[0]._fields), 'rows': [list(row) for row in rows]}
+
+
+def encode_rows(rows: Iterable[Any], fmt: str, key: Optional[str] = None,
+                extra: Optional[Dict[str, Any]] = None) -> Tuple[Any, str]:
+    """Тело списка и его Content-Type; для msgpack тело — bytes"""
+    rows = list(rows)
+    if fmt == 'json':
+        value: Any = [row._asdict() for row in rows]
+    else:
+        value = columnar(rows)
+    if key is not None:
+        value = {key: value, **(extra or {})}
+    if fmt == 'msgpack':
+        return msgpack.packb(value, use_bin_type=True), MSGPACK_TYPE
+    return dumps(value), FORMATS[fmt]
+
+
+def list_response(event: Dict[str, Any], rows: Iterable[Any], key: Optional[str] = None,
+                  extra: Optional[Dict[str, Any]] = None,
+                  headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Ответ 200 со списком строк rows.py в формате, который запросил клиент"""
+    body, content_type = encode_rows(rows, response_format(event), key, extra)
+    response_headers = {'Access-Control-Allow-Origin': '*', **(headers or {})}
+    response_headers['Content-Type'] = content_type
+    response_headers['Vary'] = 'Accept, Accept-Encoding'
+    if isinstance(body, bytes):
+        return {
+            'statusCode': 200,
+            'headers': response_headers,
+            'body': base64.b64encode(body).decode('ascii'),
+            'isBase64Encoded': True
+        }
+    return {
+        'statusCode': 200,
+        'headers': response_headers,
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+def _compress_response(response: Dict[str, Any], encoding: str) -> Dict[str, Any]:
+    body = response.get('body')
+    if not body or not isinstance(body, str):
+        return response
+    headers = response.get('headers') or {}
+    if any(key.lower() == 'content-encoding' for key in headers):
+        return response
+    content_type = next((v for k, v in headers.items() if k.lower() == 'content-type'), '')
+    if not content_type.startswith(COMPRESSIBLE_TYPES):
+        return response
+
+    is_base64 = bool(response.get('isBase64Encoded'))
+    raw = base64.b64decode(body) if is_base64 else body.encode('utf-8')
+    if len(raw) < COMPRESS_MIN_BYTES:
+        return response
+
+    started = time.perf_counter()
+    compressed = compress(raw, encoding)
+    labels = {'encoding': encoding}
+    REGISTRY.observe('response_encode_seconds', labels, time.perf_counter() - started,
+                     help_text='Time spent compressing response bodies')
+    REGISTRY.inc('response_raw_bytes_total', labels, len(raw),
+                 help_text='Response bytes before compression')
+    REGISTRY.inc('response_wire_bytes_total', labels, len(compressed),
+                 help_text='Response bytes after compression')
+    if len(compressed) >= len(raw):
+        return response
+
+    # Заголовки могут быть общим словарем модуля — меняем копию
+    headers = dict(headers)
+    headers['Content-Encoding'] = encoding
+    vary = headers.get('Vary')
+    if not vary:
+        headers['Vary'] = 'Accept-Encoding'
+    elif 'accept-encoding' not in vary.lower():
+        headers['Vary'] = f'{vary}, Accept-Encoding'
+
+    result = dict(response)
+    result['headers'] = headers
+    result['body'] = base64.b64encode(compressed).decode('ascii')
+    result['isBase64Encoded'] = True
+    return result
+
+
+def negotiated(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable:
+    """Декоратор для handler(event, context): сжимает ответ по Accept-Encoding клиента"""
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        response = handler(event, context)
+        encoding = content_encoding(event)
+        if encoding is None or not isinstance(response, dict):
+            return response
+        return _compress_response(response, encoding)
+    return wrapper
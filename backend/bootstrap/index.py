@@ -0,0 +1,160 @@
+"""
+Стартовые данные мини-приложения одним запросом: профиль, кошельки, активные курсы
+и страница непрочитанных уведомлений
+"""
+import json
+import os
+from typing import Dict, Any
+from db import get_db_connection
+from instrumentation import instrument
+from encoding import negotiated
+from rate_cache import RATES
+from session import issue_token, session_from_event, session_required, validate_init_data
+from statements import prepared
+
+# Профиль, кошельки и уведомления собираются в JSON на стороне Postgres за один round trip
+BOOTSTRAP_SQL = """
+    SELECT u.id, u.telegram_id, u.is_admin, u.is_blocked,
+           row_to_json(u)::text AS user_json,
+           COALESCE(
+               (SELECT json_agg(w ORDER BY w.currency) FROM wallets w WHERE w.user_id = u.id),
+               '[]'
+           )::text AS wallets_json,
+           COALESCE(
+               (SELECT json_agg(n) FROM (
+                   SELECT * FROM notifications
+                   WHERE user_id = u.id AND is_read = FALSE
+                   ORDER BY created_at DESC
+                   LIMIT {limit}
+               ) n),
+               '[]'
+           )::text AS notifications_json,
+           (SELECT COUNT(*) FROM notifications WHERE user_id = u.id AND is_read = FALSE) AS unread_count
+    FROM users u
+    WHERE {condition}
+"""
+
+BOOTSTRAP_BY_ID = prepared('bootstrap_by_id', BOOTSTRAP_SQL.format(limit='$1', condition='u.id = $2'))
+BOOTSTRAP_BY_TELEGRAM_ID = prepared(
+    'bootstrap_by_telegram_id', BOOTSTRAP_SQL.format(limit='$1', condition='u.telegram_id = $2')
+)
+
+# Заголовки ответов собираются один раз при загрузке модуля
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Session-Token, Authorization',
+    'Access-Control-Max-Age': '86400'
+}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+@instrument('bootstrap')
+@negotiated
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Все, что нужно мини-приложению при открытии, вместо отдельных вызовов auth, wallets, rates и notifications
+    Args: event - dict с httpMethod, headers (X-Session-Token), queryStringParameters (telegram_id, limit)
+                  или body с init_data Telegram WebApp
+          context - object с атрибутами request_id и др.
+    Returns: HTTP response dict
+    """
+    method: str = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': CORS_HEADERS,
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method not in ('GET', 'POST'):
+        return {
+            'statusCode': 405,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    params = event.get('queryStringParameters') or {}
+    body_data = json.loads(event.get('body') or '{}') if method == 'POST' else {}
+    limit = min(int(params.get('limit') or body_data.get('limit') or 20), 50)
+
+    session = session_from_event(event)
+    init_data = body_data.get('init_data')
+    issue_session = False
+
+    if session:
+        statement, value, subject = BOOTSTRAP_BY_ID, session.user_id, session.telegram_id
+    elif init_data:
+        fields = validate_init_data(init_data, os.environ.get('TELEGRAM_BOT_TOKEN', ''))
+        if not fields or not fields.get('user'):
+            return {
+                'statusCode': 401,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'Invalid initData'}),
+                'isBase64Encoded': False
+            }
+        statement, value = BOOTSTRAP_BY_TELEGRAM_ID, fields['user'].get('id')
+        subject = value
+        issue_session = True
+    elif session_required():
+        return {
+            'statusCode': 401,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'Session token required'}),
+            'isBase64Encoded': False
+        }
+    else:
+        statement, value = BOOTSTRAP_BY_TELEGRAM_ID, params.get('telegram_id') or body_data.get('telegram_id')
+        subject = value
+
+    if not value:
+        return {
+            'statusCode': 400,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'telegram_id is required'}),
+            'isBase64Encoded': False
+        }
+
+    conn = get_db_connection(readonly=True, subject=subject)
+    try:
+        cur = conn.cursor()
+        statement.execute(cur, (limit, value))
+        row = cur.fetchone()
+        cur.close()
+
+        if not row:
+            # Новый пользователь сначала регистрируется через auth
+            return {
+                'statusCode': 404,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'User not found'}),
+                'isBase64Encoded': False
+            }
+
+        # При промахе кэша курсы читаются на этом же соединении
+        rates_json = RATES.active_rates_json(conn)
+    finally:
+        conn.close()
+
+    user_id, telegram_id, is_admin, is_blocked, user_json, wallets_json, notifications_json, unread_count = row
+
+    extra = ''
+    if issue_session:
+        issued = issue_token(user_id, telegram_id, is_admin, is_blocked)
+        if issued:
+            extra = f',"session_token":{json.dumps(issued["token"])},"session_expires_at":{issued["expires_at"]}'
+
+    # Части ответа уже сериализованы — склеиваем их без повторного разбора
+    body = (
+        f'{{"user":{user_json},"wallets":{wallets_json},"rates":{rates_json},'
+        f'"notifications":{notifications_json},"unread_count":{int(unread_count)}{extra}}}'
+    )
+
+    return {
+        'statusCode': 200,
+        'headers': JSON_HEADERS,
+        'body': body,
+        'isBase64Encoded': False
+    }
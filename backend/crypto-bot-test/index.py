@@ -4,7 +4,12 @@
 import os
 import json
 from typing import Dict, Any
+from instrumentation import instrument
 
+# Заголовки ответов собираются один раз при загрузке модуля
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+@instrument('crypto-bot-test')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """Проверяет наличие и валидность API токена"""
     
@@ -12,7 +17,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     return {
         'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'headers': JSON_HEADERS,
         'body': json.dumps({
             'token_present': bool(token),
             'token_length': len(token) if token else 0,
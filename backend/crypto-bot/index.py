@@ -6,33 +6,50 @@
 import json
 import os
 from typing import Dict, Any
-from urllib.request import Request, urlopen
-from urllib.error import HTTPError
+from instrumentation import instrument, on_warmup, upstream
+from session import session_from_event
 
 API_TOKEN = os.environ.get('CRYPTO_BOT_API_TOKEN', '')
-BASE_URL = 'https://pay.crypt.bot/api'
+BASE_URL = os.environ.get('CRYPTO_BOT_API_URL', 'https://pay.crypt.bot/api')
+API_HEADERS = {
+    'Crypto-Pay-API-Token': API_TOKEN,
+    'Content-Type': 'application/json'
+}
 
 # Force redeploy v2
 
 def make_request(method: str, endpoint: str, data: Dict = None) -> Dict:
     """Выполняет запрос к Crypto Bot API"""
+    # urllib.request тянет http.client, email и ssl — импортируем при первом обращении, а не на холодном старте
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+
     url = f"{BASE_URL}/{endpoint}"
-    headers = {
-        'Crypto-Pay-API-Token': API_TOKEN,
-        'Content-Type': 'application/json'
-    }
-    
     req_data = json.dumps(data).encode() if data else None
-    request = Request(url, data=req_data, headers=headers, method=method)
+    request = Request(url, data=req_data, headers=API_HEADERS, method=method)
     
     try:
-        with urlopen(request) as response:
+        with upstream('crypto_bot'), urlopen(request) as response:
             result = json.loads(response.read().decode())
             return result
     except HTTPError as e:
         error_body = e.read().decode()
         raise Exception(f"Crypto Bot API error: {error_body}")
 
+@on_warmup('urllib')
+def _preload_urllib() -> None:
+    import urllib.request  # noqa: F401
+
+# Заголовки ответов собираются один раз при загрузке модуля
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Session-Token, Authorization',
+    'Access-Control-Max-Age': '86400'
+}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+@instrument('crypto-bot')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Работа с Crypto Bot API: создание счетов, проверка платежей, получение кошельков
@@ -42,20 +59,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     method: str = event.get('httpMethod', 'GET')
     
-    # Debug: check if token is available
-    token_status = 'present' if API_TOKEN and len(API_TOKEN) > 10 else 'missing'
-    print(f"[DEBUG] API_TOKEN status: {token_status}, length: {len(API_TOKEN) if API_TOKEN else 0}")
-    
     # CORS OPTIONS
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
+            'headers': CORS_HEADERS,
             'body': ''
         }
     
@@ -71,7 +79,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             result = make_request('GET', 'getMe')
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps(result)
             }
         
@@ -79,7 +87,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             result = make_request('GET', 'getCurrencies')
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps(result)
             }
         
@@ -87,7 +95,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             result = make_request('GET', 'getBalance')
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps(result)
             }
         
@@ -95,7 +103,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             result = make_request('GET', 'getExchangeRates')
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps(result)
             }
         
@@ -104,20 +112,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             if not invoice_id:
                 return {
                     'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': JSON_HEADERS,
                     'body': json.dumps({'error': 'invoice_id required'})
                 }
             
             result = make_request('GET', f'getInvoices?invoice_ids={invoice_id}')
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps(result)
             }
         
         return {
             'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': JSON_HEADERS,
             'body': json.dumps({'error': 'Invalid action'})
         }
     
@@ -135,10 +143,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if not asset or not amount:
             return {
                 'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'error': 'asset and amount required'})
             }
         
+        # С сессионным токеном payload для crypto-webhook формируем сами, а не доверяем клиенту
+        session = session_from_event(event)
+        payload = f'user_{session.telegram_id}' if session else body_data.get('payload', '')
+        
         # Создаем счет на оплату
         invoice_data = {
             'asset': asset,
@@ -146,7 +158,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'description': body_data.get('description', 'Пополнение баланса'),
             'paid_btn_name': body_data.get('paid_btn_name', 'callback'),
             'paid_btn_url': body_data.get('paid_btn_url'),
-            'payload': body_data.get('payload', '')  # Можно передать user_id для идентификации
+            'payload': payload  # user_<telegram_id> для зачисления в crypto-webhook
         }
         
         # Убираем None значения
@@ -156,12 +168,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': JSON_HEADERS,
             'body': json.dumps(result)
         }
     
     return {
         'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'headers': JSON_HEADERS,
         'body': json.dumps({'error': 'Method not allowed'})
     }
\ No newline at end of file
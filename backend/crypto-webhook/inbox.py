@@ -0,0 +1,411 @@
+"""
+Очередь входящих webhook Crypto Bot: проверка подписи и пакетное зачисление пополнений.
+
+Обработчик HTTP только проверяет подпись crypto-pay-api-signature и одним INSERT кладет событие в webhook_inbox
+(повторная доставка с тем же update_id ничего не добавляет), поэтому сбой зачисления не заставляет Crypto Bot
+ждать ответа и повторять доставку. Зачисляет process_inbox: таймер с payload "inbox" или
+
+    python inbox.py --max-batches 10
+
+Каждый проход захватывает пачку необработанных событий (FOR UPDATE SKIP LOCKED — несколько обработчиков
+не мешают друг другу), одним запросом находит пользователей и уже зачисленные счета и применяет всю пачку
+одним запросом: строки transactions и notifications вставляются списком, кошельки пополняются по сумме
+на (пользователя, валюту), активы на хранении — по сумме на валюту. Повторное зачисление счета исключает
+уникальный индекс: строка пополнения вставляется с ON CONFLICT DO NOTHING, и все суммы считаются только по
+вставленным строкам, поэтому две параллельные пачки с одним счетом зачисляют его один раз. Если пачка
+не применилась, ее события повторяются по одному, чтобы одно испорченное событие не задерживало остальные;
+событие, не применившееся INBOX_MAX_ATTEMPTS раз, остается в таблице с текстом ошибки. Решения оценщика риска по пачке запоминаются
+до ее фиксации: повтор по одному берет их, а не оценивает события еще раз, иначе скользящие окна учли бы
+каждое пополнение дважды.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from db import note_write
+from identity import CACHE
+from instrumentation import REGISTRY, log_event, upstream
+from liquidity import LIQUIDITY
+from risk import RISK, Decision
+
+INBOX_BATCH_SIZE = int(os.environ.get('INBOX_BATCH_SIZE', '500'))
+INBOX_MAX_ATTEMPTS = int(os.environ.get('INBOX_MAX_ATTEMPTS', '5'))
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+ACCEPT_SQL = """
+    INSERT INTO webhook_inbox (update_id, update_type, payload) VALUES (%s, %s, %s)
+    ON CONFLICT (update_id) DO NOTHING
+"""
+
+CLAIM_SQL = """
+    SELECT id, update_type, payload FROM webhook_inbox
+    WHERE processed_at IS NULL AND attempts < %(max_attempts)s
+      AND (%(ids)s::bigint[] IS NULL OR id = ANY(%(ids)s))
+    ORDER BY id
+    LIMIT %(batch_size)s
+    FOR UPDATE SKIP LOCKED
+"""
+
+USERS_SQL = 'SELECT telegram_id, id, is_blocked FROM users WHERE telegram_id = ANY(%s)'
+
+CREDITED_INVOICES_SQL = """
+    SELECT crypto_bot_invoice_id FROM transactions
+    WHERE type = 'deposit' AND crypto_bot_invoice_id = ANY(%s)
+"""
+
+# Вся пачка одним запросом. Задержанные оценщиком риска пополнения (held) не зачисляются на кошелек,
+# но, как и зачисленные, увеличивают активы на хранении. Счет, который успела зачислить параллельная пачка,
+# уникальный индекс не пропускает: кошельки, активы и уведомления считаются только по вставленным строкам,
+# а событие такого счета получает ошибку
+APPLY_SQL = """
+    WITH d AS (
+        SELECT * FROM unnest(%(user_ids)s::bigint[], %(currencies)s::text[], %(amounts)s::numeric[],
+                             %(statuses)s::text[], %(invoices)s::text[])
+            AS d(user_id, currency, amount, status, invoice_id)
+    ),
+    tx AS (
+        INSERT INTO transactions (user_id, type, currency, amount, status, crypto_bot_invoice_id)
+        SELECT user_id, 'deposit', currency, amount, status, invoice_id FROM d
+        ON CONFLICT (crypto_bot_invoice_id) WHERE type = 'deposit' DO NOTHING
+        RETURNING user_id, currency, amount, status, crypto_bot_invoice_id
+    ),
+    credited AS (
+        INSERT INTO wallets (user_id, currency, balance)
+        SELECT user_id, currency, SUM(amount) FROM tx WHERE status = 'completed' GROUP BY user_id, currency
+        -- Кошельки блокируются в одном порядке у всех обработчиков — без взаимоблокировок
+        ORDER BY user_id, currency
+        ON CONFLICT (user_id, currency)
+        DO UPDATE SET balance = wallets.balance + EXCLUDED.balance, updated_at = CURRENT_TIMESTAMP
+    ),
+    reserves AS (
+        UPDATE liquidity_reserves r
+        SET holdings = r.holdings + s.total, updated_at = CURRENT_TIMESTAMP
+        FROM (SELECT currency, SUM(amount) AS total FROM tx GROUP BY currency) s
+        WHERE r.currency = s.currency
+    ),
+    notified AS (
+        INSERT INTO notifications (user_id, type, title, message, is_read)
+        SELECT user_id, 'info',
+               CASE WHEN status = 'held' THEN 'Пополнение на проверке' ELSE 'Пополнение успешно' END,
+               CASE WHEN status = 'held'
+                    THEN 'Пополнение на ' || amount || ' ' || currency || ' будет зачислено после проверки'
+                    ELSE 'На ваш счет зачислено ' || amount || ' ' || currency END,
+               false
+        FROM tx
+    )
+    UPDATE webhook_inbox i
+    SET processed_at = CURRENT_TIMESTAMP, attempts = i.attempts + 1,
+        error = COALESCE(r.error, CASE
+            WHEN r.invoice_id IS NOT NULL
+                 AND NOT EXISTS (SELECT 1 FROM tx WHERE tx.crypto_bot_invoice_id = r.invoice_id)
+            THEN 'Invoice already credited' END)
+    FROM unnest(%(inbox_ids)s::bigint[], %(errors)s::text[], %(inbox_invoices)s::text[]) AS r(id, error, invoice_id)
+    WHERE i.id = r.id
+    RETURNING i.id, i.error
+"""
+
+FAIL_SQL = 'UPDATE webhook_inbox SET attempts = attempts + 1, error = %s WHERE id = ANY(%s)'
+
+
+class Deposit(NamedTuple):
+    inbox_id: int
+    telegram_id: int
+    asset: str
+    amount: Decimal
+    invoice_id: str
+
+
+def signature_secret(token: str) -> bytes:
+    """Ключ подписи webhook Crypto Bot — SHA-256 от токена приложения"""
+    return hashlib.sha256(token.encode()).digest()
+
+
+def sign(body: str, token: str) -> str:
+    return hmac.new(signature_secret(token), body.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def verify_signature(body: str, headers: Optional[Dict[str, str]]) -> bool:
+    """HMAC-SHA-256 тела запроса в заголовке crypto-pay-api-signature; без токена приложения проверка не проходит"""
+    token = os.environ.get('CRYPTO_BOT_API_TOKEN', '')
+    signature = next(
+        (value for key, value in (headers or {}).items() if key.lower() == 'crypto-pay-api-signature'), ''
+    )
+    if not token or not signature:
+        return False
+    return hmac.compare_digest(sign(body, token), signature)
+
+
+def accept(conn, update_id: int, update_type: str, body: str) -> None:
+    """Кладет событие в очередь; повтор того же update_id игнорируется"""
+    cur = conn.cursor()
+    try:
+        cur.execute(ACCEPT_SQL, (update_id, update_type, body))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def parse_deposit(inbox_id: int, payload: Dict[str, Any]) -> Tuple[Optional[Deposit], Optional[str]]:
+    """(пополнение, None) или (None, ошибка) для события invoice_paid"""
+    invoice = payload.get('payload') or {}
+    user_payload = str(invoice.get('payload') or '')
+    # Формат payload счета: "user_<telegram_id>"
+    if not user_payload.startswith('user_'):
+        return None, 'Invalid user payload'
+    try:
+        telegram_id = int(user_payload[len('user_'):])
+    except ValueError:
+        return None, 'Invalid user payload'
+    try:
+        amount = Decimal(str(invoice.get('amount')))
+    except InvalidOperation:
+        return None, 'Invalid amount'
+    if not amount.is_finite() or amount <= 0 or not invoice.get('asset'):
+        return None, 'Invalid amount'
+    return Deposit(inbox_id, telegram_id, invoice['asset'], amount, str(invoice.get('invoice_id') or '')), None
+
+
+def _telegram_message(deposit: Deposit, held: bool) -> str:
+    amount_text = f"{deposit.amount:.8f}" if deposit.asset in ['BTC', 'ETH', 'LTC'] else f"{deposit.amount:.2f}"
+    if held:
+        return f"""
+💰 <b>Платеж получен</b>
+
+Сумма: <code>{amount_text} {deposit.asset}</code>
+Статус: ⏳ На проверке
+
+Средства будут зачислены после проверки.
+"""
+    return f"""
+💰 <b>Платеж получен!</b>
+
+Сумма: <code>{amount_text} {deposit.asset}</code>
+Статус: ✅ Оплачен
+
+Ваш баланс обновлен.
+"""
+
+
+def _notify(message: Tuple[int, str]) -> None:
+    import urllib.request
+
+    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+    if not bot_token:
+        return
+    telegram_id, text = message
+    try:
+        req = urllib.request.Request(
+            f"{TELEGRAM_API_URL}/bot{bot_token}/sendMessage",
+            data=json.dumps({'chat_id': telegram_id, 'text': text, 'parse_mode': 'HTML'}).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        with upstream('telegram'):
+            urllib.request.urlopen(req, timeout=5)
+    except Exception as e:
+        log_event('telegram_send_failed', error=str(e))
+
+
+def _apply(conn, ids: Optional[List[int]], batch_size: int,
+           decisions: Dict[int, Decision]) -> Optional[Dict[str, Any]]:
+    """
+    Захватывает и применяет одну пачку в одной транзакции. None — очередь пуста.
+    applied — примененные пополнения, blocked — telegram_id заблокированных оценщиком риска.
+    decisions — решения оценщика по inbox_id: уже оцененные события не учитываются в окнах повторно
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(CLAIM_SQL, {'max_attempts': INBOX_MAX_ATTEMPTS, 'ids': ids, 'batch_size': batch_size})
+        claimed = cur.fetchall()
+        if not claimed:
+            conn.commit()
+            return None
+
+        errors: Dict[int, Optional[str]] = {}
+        deposits: List[Deposit] = []
+        for inbox_id, update_type, payload in claimed:
+            errors[inbox_id] = None
+            if update_type != 'invoice_paid':
+                continue
+            deposit, error = parse_deposit(inbox_id, payload)
+            if deposit:
+                deposits.append(deposit)
+            else:
+                errors[inbox_id] = error
+
+        users: Dict[int, Tuple[int, bool]] = {}
+        credited: Set[str] = set()
+        if deposits:
+            cur.execute(USERS_SQL, (list({d.telegram_id for d in deposits}),))
+            users = {telegram_id: (user_id, is_blocked) for telegram_id, user_id, is_blocked in cur.fetchall()}
+            invoices = [d.invoice_id for d in deposits if d.invoice_id]
+            if invoices:
+                cur.execute(CREDITED_INVOICES_SQL, (invoices,))
+                credited = {row[0] for row in cur.fetchall()}
+
+        applied: List[Tuple[Deposit, int, str]] = []
+        blocked: List[int] = []
+        for deposit in deposits:
+            user = users.get(deposit.telegram_id)
+            if user is None:
+                errors[deposit.inbox_id] = 'User not found'
+                continue
+            if deposit.invoice_id and deposit.invoice_id in credited:
+                errors[deposit.inbox_id] = 'Invoice already credited'
+                continue
+            credited.add(deposit.invoice_id)
+            user_id, is_blocked = user
+            # Платеж уже получен, поэтому подозрительное пополнение не отклоняется, а задерживается
+            decision = decisions.get(deposit.inbox_id)
+            if decision is None:
+                decision = decisions[deposit.inbox_id] = RISK.score(
+                    user_id, 'deposit', deposit.asset, deposit.amount, conn
+                )
+            RISK.record(conn, user_id, 'deposit', deposit.asset, deposit.amount, decision)
+            held = is_blocked or decision.action in ('hold', 'block')
+            if decision.action == 'block':
+                blocked.append(deposit.telegram_id)
+            applied.append((deposit, user_id, 'held' if held else 'completed'))
+
+        applied_invoices = {d.inbox_id: d.invoice_id or None for d, _, _ in applied}
+        cur.execute(APPLY_SQL, {
+            'user_ids': [user_id for _, user_id, _ in applied],
+            'currencies': [d.asset for d, _, _ in applied],
+            'amounts': [str(d.amount) for d, _, _ in applied],
+            'statuses': [status for _, _, status in applied],
+            'invoices': list(applied_invoices.values()),
+            'inbox_ids': list(errors),
+            'errors': list(errors.values()),
+            'inbox_invoices': [applied_invoices.get(inbox_id) for inbox_id in errors],
+        })
+        errors.update(cur.fetchall())
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    return {
+        'claimed': len(claimed),
+        # Счета, зачисленные параллельной пачкой, не применены
+        'applied': [item for item in applied if not errors[item[0].inbox_id]],
+        'blocked': blocked,
+        'rejected': sum(1 for error in errors.values() if error),
+    }
+
+
+def _after_commit(conn, batch: Dict[str, Any], pool) -> None:
+    messages: List[Tuple[int, str]] = []
+    for deposit, _, status in batch['applied']:
+        LIQUIDITY.deposit(deposit.asset, deposit.amount)
+        note_write(deposit.telegram_id)
+        messages.append((deposit.telegram_id, _telegram_message(deposit, status == 'held')))
+    for telegram_id in batch['blocked']:
+        CACHE.invalidate(telegram_id=telegram_id)
+    RISK.checkpoint(conn)
+    list(pool.map(_notify, messages))
+
+
+def process_inbox(conn, batch_size: int = INBOX_BATCH_SIZE, max_batches: int = 0,
+                  concurrency: int = 8) -> Dict[str, Any]:
+    """Проходы захват → применение → уведомления, пока очередь не опустеет; max_batches=0 — без ограничения"""
+    # Пул потоков нужен только обработчику очереди — прием webhook его не загружает
+    from concurrent.futures import ThreadPoolExecutor
+
+    summary: Dict[str, Any] = {'batches': 0, 'events': 0, 'credited': 0, 'held': 0, 'rejected': 0, 'failed': 0}
+    started = time.perf_counter()
+
+    def account(batch: Dict[str, Any]) -> None:
+        summary['events'] += batch['claimed']
+        summary['rejected'] += batch['rejected']
+        for _, _, status in batch['applied']:
+            summary['held' if status == 'held' else 'credited'] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while not max_batches or summary['batches'] < max_batches:
+            decisions: Dict[int, Decision] = {}
+            try:
+                batch = _apply(conn, None, batch_size, decisions)
+            except Exception as e:
+                log_event('inbox_batch_failed', error=f'{type(e).__name__}: {e}')
+                failed = _retry_one_by_one(conn, batch_size, pool, account, decisions)
+                summary['failed'] += failed
+                summary['batches'] += 1
+                if failed:
+                    break
+                continue
+            if batch is None:
+                break
+            summary['batches'] += 1
+            account(batch)
+            _after_commit(conn, batch, pool)
+            if batch['claimed'] < batch_size:
+                break
+
+    for outcome in ('credited', 'held', 'rejected', 'failed'):
+        REGISTRY.inc('webhook_inbox_events_total', {'outcome': outcome}, summary[outcome],
+                     help_text='Webhook inbox events by outcome')
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    summary['events_per_sec'] = round(summary['events'] / summary['seconds']) if summary['seconds'] else 0
+    return summary
+
+
+def _retry_one_by_one(conn, batch_size: int, pool, account, decisions: Dict[int, Decision]) -> int:
+    """
+    Пачка не применилась: те же события по одному с решениями оценщика из неудачной пачки;
+    не применившиеся получают попытку и текст ошибки
+    """
+    cur = conn.cursor()
+    cur.execute(
+        'SELECT id FROM webhook_inbox WHERE processed_at IS NULL AND attempts < %s ORDER BY id LIMIT %s',
+        (INBOX_MAX_ATTEMPTS, batch_size)
+    )
+    ids = [row[0] for row in cur.fetchall()]
+    cur.close()
+    conn.commit()
+
+    failed = 0
+    for inbox_id in ids:
+        try:
+            batch = _apply(conn, [inbox_id], 1, decisions)
+        except Exception as e:
+            failed += 1
+            cur = conn.cursor()
+            cur.execute(FAIL_SQL, (f'{type(e).__name__}: {e}', [inbox_id]))
+            cur.close()
+            conn.commit()
+            continue
+        if batch is not None:
+            account(batch)
+            _after_commit(conn, batch, pool)
+    return failed
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Зачисление пополнений из очереди webhook Crypto Bot')
+    parser.add_argument('--batch-size', type=int, default=INBOX_BATCH_SIZE)
+    parser.add_argument('--max-batches', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from db import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        summary = process_inbox(conn, args.batch_size, args.max_batches)
+    finally:
+        conn.close()
+    print(summary, file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,19 +1,28 @@
 '''
 Webhook для обработки платежей от Crypto Bot
-Автоматически зачисляет средства на баланс пользователя после оплаты
+Проверяет подпись и кладет событие в очередь webhook_inbox одним INSERT; средства на баланс зачисляет
+обработчик очереди (inbox.py) по таймеру с payload "inbox".
+Пополнение, на которое оценщик риска ответил hold или block, и пополнение заблокированного пользователя
+не зачисляются: транзакция пишется со статусом held до решения администратора (release_deposit)
 '''
 
+import base64
 import json
-import os
-import psycopg2
 from typing import Dict, Any
+from db import get_db_connection
+from instrumentation import instrument, log_event, timer_payload
+from inbox import accept, process_inbox, verify_signature
 
-DSN = os.environ.get('DATABASE_URL', '')
-
-def get_db_connection():
-    """Создает подключение к базе данных"""
-    return psycopg2.connect(DSN)
+# Заголовки ответов собираются один раз при загрузке модуля
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Crypto-Pay-API-Signature',
+    'Access-Control-Max-Age': '86400'
+}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
 
+@instrument('crypto-webhook')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Webhook для обработки уведомлений от Crypto Bot о платежах
@@ -21,28 +30,43 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
           context - object с атрибутами request_id, function_name и др.
     Returns: HTTP response dict
     '''
+    # Таймер-триггер с payload "inbox" зачисляет накопившиеся пополнения
+    if timer_payload(event) == 'inbox':
+        conn = get_db_connection()
+        try:
+            summary = process_inbox(conn)
+        finally:
+            conn.close()
+        return {
+            'statusCode': 200,
+            'headers': JSON_HEADERS,
+            'body': json.dumps(summary)
+        }
+    
     method: str = event.get('httpMethod', 'POST')
     
     # CORS OPTIONS
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
+            'headers': CORS_HEADERS,
             'body': ''
         }
     
-    # POST - обработка webhook от Crypto Bot
+    # POST - прием webhook от Crypto Bot
     if method == 'POST':
-        body_str = event.get('body', '{}')
-        if not body_str:
-            body_str = '{}'
+        body_str = event.get('body') or '{}'
+        if event.get('isBase64Encoded'):
+            body_str = base64.b64decode(body_str).decode('utf-8')
         
-        webhook_data = json.loads(body_str)
+        # Подпись — HMAC-SHA-256 исходного тела, поэтому проверяется до разбора JSON
+        if not verify_signature(body_str, event.get('headers')):
+            log_event('webhook_signature_invalid')
+            return {
+                'statusCode': 401,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'Invalid signature'})
+            }
         
         # Структура webhook от Crypto Bot:
         # {
@@ -58,138 +82,32 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         #     "payload": "user_123"
         #   }
         # }
+        try:
+            webhook_data = json.loads(body_str)
+            update_id = int(webhook_data['update_id'])
+            update_type = str(webhook_data['update_type'])
+        except (ValueError, TypeError, KeyError):
+            return {
+                'statusCode': 400,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'Invalid webhook body'})
+            }
         
-        update_type = webhook_data.get('update_type')
-        
-        if update_type == 'invoice_paid':
-            payload = webhook_data.get('payload', {})
-            invoice_id = payload.get('invoice_id')
-            asset = payload.get('asset')
-            amount = payload.get('amount')
-            user_payload = payload.get('payload', '')
-            
-            # Извлекаем telegram_id из payload (формат: "user_123")
-            telegram_id = None
-            if user_payload.startswith('user_'):
-                try:
-                    telegram_id = int(user_payload.replace('user_', ''))
-                except ValueError:
-                    pass
-            
-            if not telegram_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Invalid user payload'})
-                }
-            
-            conn = get_db_connection()
-            cur = conn.cursor()
-            
-            try:
-                # Получаем user_id по telegram_id
-                cur.execute(
-                    "SELECT id FROM users WHERE telegram_id = %s",
-                    (telegram_id,)
-                )
-                user = cur.fetchone()
-                
-                if not user:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'User not found'})
-                    }
-                
-                user_id = user[0]
-                
-                # Зачисляем средства на кошелек пользователя
-                cur.execute(
-                    "UPDATE wallets SET balance = balance + %s, updated_at = NOW() WHERE user_id = %s AND currency = %s",
-                    (float(amount), user_id, asset)
-                )
-                
-                # Создаем запись о транзакции
-                cur.execute(
-                    """INSERT INTO transactions 
-                       (user_id, type, currency, amount, status, crypto_bot_invoice_id, created_at)
-                       VALUES (%s, 'deposit', %s, %s, 'completed', %s, NOW())
-                       RETURNING id""",
-                    (user_id, asset, float(amount), invoice_id)
-                )
-                transaction_id = cur.fetchone()[0]
-                
-                # Создаем уведомление
-                cur.execute(
-                    """INSERT INTO notifications 
-                       (user_id, type, title, message, is_read, created_at)
-                       VALUES (%s, 'info', 'Пополнение успешно', %s, false, NOW())""",
-                    (user_id, f'На ваш счет зачислено {amount} {asset}')
-                )
-                
-                conn.commit()
-                
-                # Отправляем уведомление в Telegram
-                try:
-                    import urllib.request
-                    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN', '')
-                    if bot_token:
-                        amount_text = f"{float(amount):.8f}" if asset in ['BTC', 'ETH', 'LTC'] else f"{float(amount):.2f}"
-                        message_text = f"""
-💰 <b>Платеж получен!</b>
-
-Сумма: <code>{amount_text} {asset}</code>
-Статус: ✅ Оплачен
-
-Ваш баланс обновлен.
-"""
-                        
-                        url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-                        data = json.dumps({
-                            'chat_id': telegram_id,
-                            'text': message_text,
-                            'parse_mode': 'HTML'
-                        }).encode('utf-8')
-                        
-                        req = urllib.request.Request(
-                            url,
-                            data=data,
-                            headers={'Content-Type': 'application/json'}
-                        )
-                        urllib.request.urlopen(req, timeout=5)
-                except Exception as e:
-                    print(f"Failed to send telegram notification: {e}")
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'transaction_id': transaction_id,
-                        'message': 'Payment processed successfully'
-                    })
-                }
-                
-            except Exception as e:
-                conn.rollback()
-                return {
-                    'statusCode': 500,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': str(e)})
-                }
-            finally:
-                cur.close()
-                conn.close()
+        # Один INSERT: ответ Crypto Bot не ждет зачисления, повторная доставка того же update_id игнорируется
+        conn = get_db_connection()
+        try:
+            accept(conn, update_id, update_type, body_str)
+        finally:
+            conn.close()
         
-        # Для других типов webhook просто возвращаем OK
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': JSON_HEADERS,
             'body': json.dumps({'success': True, 'message': 'Webhook received'})
         }
     
     return {
         'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'headers': JSON_HEADERS,
         'body': json.dumps({'error': 'Method not allowed'})
     }
\ No newline at end of file
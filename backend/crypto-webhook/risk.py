@@ -0,0 +1,337 @@
+"""
+Потоковая оценка риска пополнений, заявок и переводов по скользящим окнам.
+
+На каждого пользователя и валюту — профиль из трех кольцевых буферов (array) счетчиков и сумм всех событий:
+1 минута по секундам, 1 час по минутам, 24 часа по часам. Событие сдвигает окна и добавляется в текущие
+корзины; сдвиг очищает не больше размера буфера корзин, так что оценка — O(1) на событие и без запросов к базе.
+Базовый уровень пользователя — EWMA суммы события и суммы за активный час.
+
+Правила (первое — самое строгое):
+    block     — событий за минуту не меньше RISK_BLOCK_PER_MINUTE (60): users.is_blocked = TRUE
+    hold      — событий за минуту не меньше RISK_HOLD_PER_MINUTE (20) или сумма за час больше
+                RISK_VELOCITY_MULTIPLIER (10) базовых часовых сумм
+    flag      — сумма события больше RISK_SIZE_MULTIPLIER (20) базовых или событий за сутки
+                не меньше RISK_FLAG_PER_DAY (500)
+Базовые правила включаются после RISK_BASELINE_EVENTS (5) событий и RISK_BASELINE_HOURS (2) активных часов.
+
+RISK_MODE: enforce (по умолчанию) — hold и block применяются, monitor — только записываются в risk_events,
+off — оценки нет. Состояние хранится в памяти процесса; профиль пользователя при первом событии подгружается
+из risk_state, а изменившиеся профили раз в RISK_SNAPSHOT_SECONDS (60) пишутся туда одним запросом.
+Контейнеры оценивают независимо: в общий снимок попадает последнее записанное состояние пользователя.
+
+Модуль одинаковый в exchange, crypto-webhook и transfers — при правке обновляйте все копии.
+"""
+import json
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from instrumentation import REGISTRY, log_event
+
+# (название, ширина корзины в секундах, число корзин)
+WINDOWS = (('1m', 1, 60), ('1h', 60, 60), ('24h', 3600, 24))
+ACTIONS = ('allow', 'flag', 'hold', 'block')
+EWMA_ALPHA = 0.2
+
+LOAD_STATE_SQL = 'SELECT state FROM risk_state WHERE user_id = %s'
+
+SAVE_STATE_SQL = """
+    INSERT INTO risk_state (user_id, state)
+    SELECT * FROM unnest(%s::bigint[], %s::jsonb[])
+    ON CONFLICT (user_id) DO UPDATE SET state = EXCLUDED.state, updated_at = CURRENT_TIMESTAMP
+"""
+
+RECORD_SQL = """
+    INSERT INTO risk_events (user_id, kind, currency, amount, action, reasons)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+BLOCK_USER_SQL = 'UPDATE users SET is_blocked = TRUE, updated_at = CURRENT_TIMESTAMP WHERE id = %s'
+
+
+class Decision(NamedTuple):
+    action: str
+    reasons: Tuple[str, ...]
+
+
+ALLOW = Decision('allow', ())
+
+
+class Window:
+    """Кольцевой буфер корзин: счетчики и суммы плюс итоги по всему окну"""
+    __slots__ = ('width', 'counts', 'sums', 'last', 'count', 'total')
+
+    def __init__(self, width: int, size: int):
+        self.width = width
+        self.counts = array('l', bytes(8 * size))
+        self.sums = array('d', bytes(8 * size))
+        self.last = 0
+        self.count = 0
+        self.total = 0.0
+
+    def advance(self, bucket: int) -> None:
+        """Очищает корзины, выпавшие из окна к корзине bucket"""
+        gap = bucket - self.last
+        if gap <= 0:
+            return
+        size = len(self.counts)
+        if gap >= size:
+            for i in range(size):
+                self.counts[i] = 0
+                self.sums[i] = 0.0
+            self.count = 0
+            self.total = 0.0
+        else:
+            for b in range(self.last + 1, bucket + 1):
+                i = b % size
+                self.count -= self.counts[i]
+                self.total -= self.sums[i]
+                self.counts[i] = 0
+                self.sums[i] = 0.0
+            if not self.count:
+                self.total = 0.0
+        self.last = bucket
+
+    def add(self, now: float, amount: float) -> None:
+        bucket = int(now // self.width)
+        self.advance(bucket)
+        if bucket <= self.last - len(self.counts):
+            return
+        i = bucket % len(self.counts)
+        self.counts[i] += 1
+        self.sums[i] += amount
+        self.count += 1
+        self.total += amount
+
+    def dump(self) -> List[Any]:
+        return [self.last, [[i, self.counts[i], self.sums[i]] for i in range(len(self.counts)) if self.counts[i]]]
+
+    def load(self, data: List[Any]) -> None:
+        self.last = data[0]
+        for i, count, amount in data[1]:
+            self.counts[i] = count
+            self.sums[i] = amount
+            self.count += count
+            self.total += amount
+
+
+class Profile:
+    __slots__ = ('windows', 'events', 'ewma_amount', 'ewma_hourly', 'active_hours', 'hour', 'hour_sum')
+
+    def __init__(self):
+        self.windows = [Window(width, size) for _, width, size in WINDOWS]
+        self.events = 0
+        self.ewma_amount = 0.0
+        self.ewma_hourly = 0.0
+        self.active_hours = 0
+        self.hour = -1
+        self.hour_sum = 0.0
+
+    def observe(self, now: float, amount: float) -> None:
+        hour = int(now // 3600)
+        if hour != self.hour:
+            # Завершенный активный час уходит в базовый уровень; часы без событий не учитываются
+            if self.hour >= 0:
+                self.ewma_hourly = self._ewma(self.ewma_hourly, self.hour_sum, self.active_hours)
+                self.active_hours += 1
+            self.hour = hour
+            self.hour_sum = 0.0
+        self.ewma_amount = self._ewma(self.ewma_amount, amount, self.events)
+        self.events += 1
+        self.hour_sum += amount
+        for window in self.windows:
+            window.add(now, amount)
+
+    @staticmethod
+    def _ewma(current: float, value: float, seen: int) -> float:
+        return value if not seen else current + EWMA_ALPHA * (value - current)
+
+    def dump(self) -> Dict[str, Any]:
+        return {
+            'e': self.events, 'a': self.ewma_amount, 'h': self.ewma_hourly, 'ah': self.active_hours,
+            'hr': self.hour, 'hs': self.hour_sum, 'w': [window.dump() for window in self.windows],
+        }
+
+    @classmethod
+    def load(cls, data: Dict[str, Any]) -> 'Profile':
+        profile = cls()
+        profile.events = data['e']
+        profile.ewma_amount = data['a']
+        profile.ewma_hourly = data['h']
+        profile.active_hours = data['ah']
+        profile.hour = data['hr']
+        profile.hour_sum = data['hs']
+        for window, window_data in zip(profile.windows, data['w']):
+            window.load(window_data)
+        return profile
+
+
+class RiskScorer:
+    def __init__(self, mode: str = 'enforce', hold_per_minute: int = 20, block_per_minute: int = 60,
+                 flag_per_day: int = 500, velocity_multiplier: float = 10.0, size_multiplier: float = 20.0,
+                 baseline_events: int = 5, baseline_hours: int = 2, snapshot_seconds: float = 60.0,
+                 max_users: int = 100000):
+        self.mode = mode
+        self.hold_per_minute = hold_per_minute
+        self.block_per_minute = block_per_minute
+        self.flag_per_day = flag_per_day
+        self.velocity_multiplier = velocity_multiplier
+        self.size_multiplier = size_multiplier
+        self.baseline_events = baseline_events
+        self.baseline_hours = baseline_hours
+        self.snapshot_seconds = snapshot_seconds
+        self.max_users = max_users
+        self.lock = threading.Lock()
+        self.users: 'OrderedDict[int, Dict[str, Profile]]' = OrderedDict()
+        self.dirty: Dict[int, Dict[str, Profile]] = {}
+        self.next_snapshot = time.monotonic() + snapshot_seconds
+
+    def score(self, user_id: int, kind: str, currency: str, amount: Any, conn=None,
+              now: Optional[float] = None) -> Decision:
+        """Учитывает событие и возвращает решение; conn нужен только для первой загрузки профиля"""
+        if self.mode == 'off':
+            return ALLOW
+        now = time.time() if now is None else now
+        amount = float(amount)
+        user_id = int(user_id)
+        if conn is not None and user_id not in self.users:
+            self._load(conn, user_id)
+
+        with self.lock:
+            profiles = self.users.get(user_id)
+            if profiles is None:
+                profiles = self._remember(user_id, {})
+            else:
+                self.users.move_to_end(user_id)
+            profile = profiles.get(currency)
+            if profile is None:
+                profile = profiles[currency] = Profile()
+            # Базовые уровни — до учета самого события
+            ewma_amount, ewma_hourly = profile.ewma_amount, profile.ewma_hourly
+            baseline_ready = profile.events >= self.baseline_events
+            hourly_ready = profile.active_hours >= self.baseline_hours
+            profile.observe(now, amount)
+            self.dirty[user_id] = profiles
+            minute, hour, day = (window.count for window in profile.windows)
+            hour_total = profile.windows[1].total
+
+        reasons: List[str] = []
+        action = 'allow'
+        if minute >= self.block_per_minute:
+            action = 'block'
+            reasons.append(f'{minute} {currency} events in 1m')
+        elif minute >= self.hold_per_minute:
+            action = 'hold'
+            reasons.append(f'{minute} {currency} events in 1m')
+        if hourly_ready and hour_total > self.velocity_multiplier * ewma_hourly:
+            action = max(action, 'hold', key=ACTIONS.index)
+            reasons.append(f'1h {currency} volume {hour_total:g} vs baseline {ewma_hourly:g}')
+        if baseline_ready and amount > self.size_multiplier * ewma_amount:
+            action = max(action, 'flag', key=ACTIONS.index)
+            reasons.append(f'{kind} amount {amount:g} vs baseline {ewma_amount:g}')
+        if day >= self.flag_per_day:
+            action = max(action, 'flag', key=ACTIONS.index)
+            reasons.append(f'{day} {currency} events in 24h')
+
+        if action == 'allow':
+            return ALLOW
+        REGISTRY.inc('risk_decisions_total', {'kind': kind, 'action': action},
+                     help_text='Risk rules triggered by event kind and action')
+        if self.mode != 'enforce':
+            return Decision('flag', tuple(reasons))
+        return Decision(action, tuple(reasons))
+
+    def screen(self, conn, user_id: int, kind: str, currency: str, amount: Any) -> Decision:
+        """
+        Оценивает событие и пишет сработавшее правило в risk_events в транзакции conn, при block — еще и
+        users.is_blocked. Фиксирует транзакцию вызывающий; после фиксации block нужно сбросить кэш identity
+        """
+        decision = self.score(user_id, kind, currency, amount, conn)
+        self.record(conn, user_id, kind, currency, amount, decision)
+        return decision
+
+    def record(self, conn, user_id: int, kind: str, currency: str, amount: Any, decision: Decision) -> None:
+        """
+        Пишет уже принятое решение без повторного учета события в окнах — для повтора транзакции,
+        откатившейся после оценки
+        """
+        if decision.action == 'allow':
+            return
+        cur = conn.cursor()
+        try:
+            cur.execute(RECORD_SQL, (user_id, kind, currency, amount, decision.action, list(decision.reasons)))
+            if decision.action == 'block':
+                cur.execute(BLOCK_USER_SQL, (user_id,))
+        finally:
+            cur.close()
+        log_event('risk_' + decision.action, user_id=user_id, kind=kind, reasons=list(decision.reasons))
+
+    def checkpoint(self, conn, force: bool = False) -> int:
+        """
+        Раз в snapshot_seconds пишет изменившиеся профили в risk_state отдельной транзакцией; возвращает их число.
+        Вызывается после фиксации основной транзакции запроса
+        """
+        if not force and time.monotonic() < self.next_snapshot:
+            return 0
+        with self.lock:
+            if not force and time.monotonic() < self.next_snapshot:
+                return 0
+            self.next_snapshot = time.monotonic() + self.snapshot_seconds
+            dirty, self.dirty = self.dirty, {}
+            user_ids = list(dirty)
+            states = [json.dumps({key: profile.dump() for key, profile in profiles.items()})
+                      for profiles in dirty.values()]
+        if not user_ids:
+            return 0
+        cur = conn.cursor()
+        try:
+            cur.execute(SAVE_STATE_SQL, (user_ids, states))
+            conn.commit()
+        except Exception as e:
+            # Снимок не должен ронять запрос: не записанные профили попадут в следующий
+            conn.rollback()
+            with self.lock:
+                for user_id, profiles in dirty.items():
+                    self.dirty.setdefault(user_id, profiles)
+            log_event('risk_snapshot_failed', error=f'{type(e).__name__}: {e}')
+            return 0
+        finally:
+            cur.close()
+        return len(user_ids)
+
+    def _load(self, conn, user_id: int) -> None:
+        cur = conn.cursor()
+        cur.execute(LOAD_STATE_SQL, (user_id,))
+        row = cur.fetchone()
+        cur.close()
+        state = row[0] if row else {}
+        if isinstance(state, str):
+            state = json.loads(state)
+        profiles = {key: Profile.load(data) for key, data in state.items()}
+        with self.lock:
+            if user_id not in self.users:
+                self._remember(user_id, profiles)
+
+    def _remember(self, user_id: int, profiles: Dict[str, Profile]) -> Dict[str, Profile]:
+        self.users[user_id] = profiles
+        while len(self.users) > self.max_users:
+            # Вытесненный профиль остается в dirty до ближайшего снимка
+            self.users.popitem(last=False)
+        return profiles
+
+
+RISK = RiskScorer(
+    mode=os.environ.get('RISK_MODE', 'enforce'),
+    hold_per_minute=int(os.environ.get('RISK_HOLD_PER_MINUTE', '20')),
+    block_per_minute=int(os.environ.get('RISK_BLOCK_PER_MINUTE', '60')),
+    flag_per_day=int(os.environ.get('RISK_FLAG_PER_DAY', '500')),
+    velocity_multiplier=float(os.environ.get('RISK_VELOCITY_MULTIPLIER', '10')),
+    size_multiplier=float(os.environ.get('RISK_SIZE_MULTIPLIER', '20')),
+    baseline_events=int(os.environ.get('RISK_BASELINE_EVENTS', '5')),
+    baseline_hours=int(os.environ.get('RISK_BASELINE_HOURS', '2')),
+    snapshot_seconds=float(os.environ.get('RISK_SNAPSHOT_SECONDS', '60')),
+    max_users=int(os.environ.get('RISK_MAX_USERS', '100000')),
+)
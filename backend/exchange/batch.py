@@ -0,0 +1,144 @@
+"""
+Пакетные вызовы обработчика: POST {"batch": [{"method", "action", "args"}, ...], "atomic": true}.
+
+Каждый элемент превращается в обычный event и проходит через тот же handler, что и одиночный
+запрос, — новой API-поверхности на каждую функцию не нужно. Все элементы выполняются на одном
+соединении; при atomic=true все изменения фиксируются одним COMMIT, а первая ошибка откатывает пакет.
+Побочные эффекты элементов в памяти процесса (db.after_commit) в атомарном пакете выполняются только после
+общего COMMIT; действия, которые меняют такое состояние до фиксации (резерв ликвидности, окна оценщика риска),
+в атомарном пакете отклоняются самим обработчиком (db.in_atomic_batch).
+
+Модуль одинаковый во всех функциях backend/ — при правке обновляйте все копии.
+"""
+import functools
+import json
+import os
+from typing import Any, Callable, Dict, List
+
+from db import shared_connection
+
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '100'))
+
+HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+def _parse_envelope(event: Dict[str, Any]) -> Any:
+    if event.get('httpMethod') != 'POST':
+        return None
+    body = event.get('body')
+    if not body or '"batch"' not in body:
+        return None
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    if isinstance(data, dict) and isinstance(data.get('batch'), list):
+        return data
+    return None
+
+
+def _item_event(event: Dict[str, Any], item: Dict[str, Any]) -> Dict[str, Any]:
+    """Event одиночного вызова: заголовки и контекст запроса берутся из пакета"""
+    method = str(item.get('method') or 'POST').upper()
+    action = item.get('action')
+    args = item.get('args') or {}
+
+    sub_event = dict(event)
+    sub_event['httpMethod'] = method
+    # Результаты элементов вкладываются в JSON пакета — формат списков всегда JSON
+    sub_event['headers'] = {k: v for k, v in (event.get('headers') or {}).items() if k.lower() != 'accept'}
+    sub_event['isBase64Encoded'] = False
+    if method == 'GET':
+        params = {k: str(v) for k, v in args.items()}
+        if action:
+            params['action'] = action
+        sub_event['queryStringParameters'] = params
+        sub_event['body'] = ''
+    else:
+        body = dict(args)
+        if action:
+            body['action'] = action
+        sub_event['queryStringParameters'] = {'action': action} if action else {}
+        sub_event['body'] = json.dumps(body)
+    return sub_event
+
+
+def _item_result(response: Dict[str, Any]) -> Dict[str, Any]:
+    status = int(response.get('statusCode', 200))
+    body = response.get('body')
+    if body and not response.get('isBase64Encoded'):
+        try:
+            body = json.loads(body)
+        except ValueError:
+            pass
+    return {'status': status, 'body': body}
+
+
+def _in_transaction(conn) -> bool:
+    import psycopg2.extensions
+    return conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+def run_batch(handler: Callable, event: Dict[str, Any], context: Any, envelope: Dict[str, Any]) -> Dict[str, Any]:
+    items = envelope['batch']
+    atomic = bool(envelope.get('atomic'))
+
+    if not items or len(items) > BATCH_MAX_ITEMS or not all(isinstance(i, dict) for i in items):
+        return {
+            'statusCode': 400,
+            'headers': HEADERS,
+            'body': json.dumps({'error': f'batch must contain 1..{BATCH_MAX_ITEMS} objects'}),
+            'isBase64Encoded': False
+        }
+
+    results: List[Dict[str, Any]] = []
+    committed = True
+
+    with shared_connection(atomic) as shared:
+        for item in items:
+            try:
+                result = _item_result(handler(_item_event(event, item), context))
+            except Exception as e:
+                result = {'status': 500, 'body': {'error': str(e)}}
+            results.append(result)
+
+            failed = result['status'] >= 400 or shared.failed
+            if atomic and failed:
+                committed = False
+                break
+            if not atomic and shared.conn is not None and (failed or _in_transaction(shared.conn)):
+                # Незафиксированное элементом не должно попасть в следующий
+                shared.conn.rollback()
+
+        if shared.conn is not None and atomic:
+            if committed:
+                shared.conn.commit()
+            else:
+                shared.conn.rollback()
+        # Эффекты в памяти процесса (кэши, ликвидность, read-your-writes) — только за зафиксированным пакетом
+        if committed:
+            shared.run_deferred()
+
+    if not committed:
+        for result in results:
+            if result['status'] < 400:
+                result['rolled_back'] = True
+        results.extend({'status': 424, 'body': {'error': 'Not executed'}} for _ in items[len(results):])
+
+    return {
+        'statusCode': 200 if committed else 409,
+        'headers': HEADERS,
+        'body': json.dumps({'atomic': atomic, 'committed': committed, 'results': results}, default=str),
+        'isBase64Encoded': False
+    }
+
+
+def batchable(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable:
+    """Декоратор для handler(event, context): распознает пакет и прогоняет его элементы через handler"""
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        envelope = _parse_envelope(event)
+        if envelope is None:
+            return handler(event, context)
+        return run_batch(handler, event, context, envelope)
+    return wrapper
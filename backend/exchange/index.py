@@ -1,37 +1,122 @@
 """
 Функция создания и управления заявками на обмен криптовалюты
 """
+import hmac
 import json
+import math
 import os
 from typing import Dict, Any
 from decimal import Decimal
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from db import after_commit, get_db_connection, in_atomic_batch, note_write
+from instrumentation import instrument, timer_payload
+from batch import batchable
+from encoding import list_response, negotiated
+from identity import CACHE, current_user, parse_telegram_id, resolve_user
+from liquidity import LIQUIDITY
+from orders import TransitionError, normalize, sweep_expired, transition
+from quotes import issue_quote, price, verify_quote
+from rate_cache import RATES
+from risk import RISK
+from ratelimit import LIMITER
+from settlement import InsufficientFunds, settle_batch, settle_order
+from session import session_from_event, session_required
+from rows import fetch_all, text_cursor
+from statements import prepared
 
+USER_ORDERS = prepared('user_orders', '''
+    SELECT eo.*
+    FROM exchange_orders eo
+    WHERE eo.user_id = $1
+    ORDER BY eo.created_at DESC
+    LIMIT 100
+''')
+
+# Заявка по котировке и уведомление о ней — одна запись; повторное использование котировки ничего не вставляет
+CREATE_FROM_QUOTE_SQL = '''
+    WITH new_order AS (
+        INSERT INTO exchange_orders
+        (user_id, from_currency, to_currency, from_amount, to_amount, exchange_rate, fee, status, quote_id,
+         liquidity_flagged)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, 'pending', %s, %s)
+        ON CONFLICT (quote_id) WHERE quote_id IS NOT NULL DO NOTHING
+        RETURNING *
+    ),
+    notified AS (
+        INSERT INTO notifications (user_id, type, title, message, related_order_id)
+        SELECT user_id, 'order_created', 'Заявка создана', 'Ваша заявка на обмен создана и ожидает обработки', id
+        FROM new_order
+    )
+    SELECT * FROM new_order
+'''
+
+ACTIVE_RATE = prepared('active_rate', '''
+    SELECT rate, markup_percent FROM exchange_rates
+    WHERE from_currency = $1 AND to_currency = $2 AND is_active = TRUE
+''')
+
+# Заголовки ответов собираются один раз при загрузке модуля
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Telegram-User-Id, X-Session-Token, Authorization, X-Admin-Key',
+    'Access-Control-Max-Age': '86400'
+}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+@instrument('exchange')
+@negotiated
+@batchable
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    # Таймер-триггер с payload "expire" закрывает просроченные pending-заявки
+    if timer_payload(event) == 'expire':
+        conn = get_db_connection()
+        try:
+            summary = sweep_expired(conn)
+            # Просроченные заявки больше ничего не обещают — снимок резервов сверяется здесь, вне запросов
+            LIQUIDITY.reconcile(conn)
+            conn.commit()
+        finally:
+            conn.close()
+        return {
+            'statusCode': 200,
+            'headers': JSON_HEADERS,
+            'body': json.dumps(summary),
+            'isBase64Encoded': False
+        }
+    
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Telegram-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
+            'headers': CORS_HEADERS,
             'body': '',
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    session = session_from_event(event)
+    
+    if not session and session_required():
+        return {
+            'statusCode': 401,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'Session token required'}),
+            'isBase64Encoded': False
+        }
     
     if method == 'GET':
         params = event.get('queryStringParameters') or {}
-        telegram_id = params.get('telegram_id')
+        telegram_id = session.telegram_id if session else params.get('telegram_id')
         action = params.get('action')
         
+        # Котировка считается по снимку курсов в памяти и соединения не требует
+        if action == 'quote':
+            return quote_response(telegram_id, params)
+        
+        # Чтение уходит на реплику, если она не отстает от последней записи пользователя
+        conn = get_db_connection(readonly=True, subject=telegram_id)
+        cur = text_cursor(conn)
+        
         if action == 'admin_orders':
             cur.execute(
                 """
@@ -42,106 +127,91 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 LIMIT 100
                 """
             )
-            orders = cur.fetchall()
+            orders = fetch_all(cur, 'exchange_orders')
             
             cur.close()
             conn.close()
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'orders': [dict(o) for o in orders]}, default=str),
-                'isBase64Encoded': False
-            }
+            return list_response(event, orders, key='orders')
         
         if not telegram_id:
             return {
                 'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'error': 'telegram_id is required'}),
                 'isBase64Encoded': False
             }
         
-        cur.execute(
-            """
-            SELECT eo.*
-            FROM exchange_orders eo
-            JOIN users u ON eo.user_id = u.id
-            WHERE u.telegram_id = %s
-            ORDER BY eo.created_at DESC
-            LIMIT 100
-            """,
-            (telegram_id,)
-        )
-        orders = cur.fetchall()
+        user = session or resolve_user(conn, telegram_id)
+        orders = []
+        
+        if user:
+            USER_ORDERS.execute(cur, (user.user_id,))
+            orders = fetch_all(cur, 'exchange_orders')
         
         cur.close()
         conn.close()
         
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps([dict(o) for o in orders], default=str),
-            'isBase64Encoded': False
-        }
+        return list_response(event, orders)
+    
+    # psycopg2.extras (и logging за ним) нужен только изменяющим запросам — не грузим его на холодном старте
+    from psycopg2.extras import RealDictCursor
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
     
     if method == 'POST':
         body_data = json.loads(event.get('body', '{}'))
         action = body_data.get('action')
         
         if action == 'update_status':
-            order_id = body_data.get('order_id')
-            status = body_data.get('status')
-            
-            if not all([order_id, status]):
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'order_id and status are required'}),
-                    'isBase64Encoded': False
-                }
-            
-            if status == 'completed':
-                cur.execute(
-                    "UPDATE exchange_orders SET status = %s, completed_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING *",
-                    (status, order_id)
-                )
-            else:
-                cur.execute(
-                    "UPDATE exchange_orders SET status = %s WHERE id = %s RETURNING *",
-                    (status, order_id)
-                )
-            
-            updated_order = cur.fetchone()
-            
-            if not updated_order:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Order not found'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute(
-                """
-                INSERT INTO notifications (user_id, type, title, message, related_order_id)
-                VALUES (%s, 'order_status', 'Статус заявки изменен', %s, %s)
-                """,
-                (updated_order['user_id'], f"Заявка #{order_id} - {status}", order_id)
-            )
-            
-            conn.commit()
+            return update_status(conn, cur, body_data, envelope=True, admin=is_admin_request(event, session))
+        
+        # Пакетный расчет: все заявки пакета одной транзакцией, блокировки в порядке id
+        if action == 'settle':
+            order_ids = body_data.get('order_ids') or []
             cur.close()
-            conn.close()
-            
+            try:
+                # Расчет двигает кошельки пользователей — только администратору
+                if not is_admin_request(event, session):
+                    return {
+                        'statusCode': 403,
+                        'headers': JSON_HEADERS,
+                        'body': json.dumps({'error': 'Admin access required'}),
+                        'isBase64Encoded': False
+                    }
+                if not order_ids:
+                    return {
+                        'statusCode': 400,
+                        'headers': JSON_HEADERS,
+                        'body': json.dumps({'error': 'order_ids are required'}),
+                        'isBase64Encoded': False
+                    }
+                summary = settle_batch(conn, order_ids)
+            finally:
+                conn.close()
+            after_commit(LIQUIDITY.invalidate)
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True, 'order': dict(updated_order)}, default=str),
+                'headers': JSON_HEADERS,
+                'body': json.dumps(summary),
                 'isBase64Encoded': False
             }
         
-        telegram_id = body_data.get('telegram_id')
+        # Резерв ликвидности и окна оценщика риска меняются до фиксации — откат пакета их не вернул бы
+        if in_atomic_batch():
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 400,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'Orders cannot be created in an atomic batch'}),
+                'isBase64Encoded': False
+            }
+        
+        if body_data.get('quote_token'):
+            return create_from_quote(event, conn, cur, session, body_data)
+        
+        telegram_id = session.telegram_id if session else body_data.get('telegram_id')
         from_currency = body_data.get('from_currency')
         to_currency = body_data.get('to_currency')
         from_amount = body_data.get('from_amount')
@@ -149,105 +219,181 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if not all([telegram_id, from_currency, to_currency, from_amount]):
             return {
                 'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'error': 'All fields are required'}),
                 'isBase64Encoded': False
             }
         
-        cur.execute("SELECT id FROM users WHERE telegram_id = %s", (telegram_id,))
-        user = cur.fetchone()
+        invalid = invalid_amount(from_amount)
+        if invalid:
+            cur.close()
+            conn.close()
+            return invalid
+        
+        limited = LIMITER.check(event, 'exchange.create', telegram_id)
+        if limited:
+            cur.close()
+            conn.close()
+            return limited
+        
+        user = current_user(conn, session, telegram_id)
         
         if not user:
             return {
                 'statusCode': 404,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'error': 'User not found'}),
                 'isBase64Encoded': False
             }
         
-        cur.execute(
-            """
-            SELECT rate, markup_percent FROM exchange_rates
-            WHERE from_currency = %s AND to_currency = %s AND is_active = TRUE
-            """,
-            (from_currency, to_currency)
-        )
+        refused = screen_order(conn, user, from_currency, from_amount)
+        if refused:
+            cur.close()
+            conn.close()
+            return refused
+        
+        ACTIVE_RATE.execute(cur, (from_currency, to_currency))
         rate_data = cur.fetchone()
         
         if not rate_data:
             return {
                 'statusCode': 404,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'error': 'Exchange rate not found'}),
                 'isBase64Encoded': False
             }
         
-        rate = float(rate_data['rate'])
-        markup = float(rate_data['markup_percent'])
-        final_rate = rate * (1 + markup / 100)
-        to_amount = float(from_amount) / final_rate
-        fee = to_amount * 0.01
+        final_rate, to_amount, fee = price(rate_data['rate'], rate_data['markup_percent'], from_amount)
         
-        cur.execute(
-            """
-            INSERT INTO exchange_orders 
-            (user_id, from_currency, to_currency, from_amount, to_amount, exchange_rate, fee, status)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, 'pending')
-            RETURNING *
-            """,
-            (user['id'], from_currency, to_currency, from_amount, to_amount, final_rate, fee)
-        )
-        new_order = cur.fetchone()
-        
-        cur.execute(
-            """
-            INSERT INTO notifications (user_id, type, title, message, related_order_id)
-            VALUES (%s, 'order_created', 'Заявка создана', 'Ваша заявка на обмен создана и ожидает обработки', %s)
-            """,
-            (user['id'], new_order['id'])
-        )
+        liquidity = LIQUIDITY.reserve(to_currency, to_amount - fee)
+        if liquidity == 'reject':
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 409,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'Insufficient liquidity'}),
+                'isBase64Encoded': False
+            }
         
-        conn.commit()
+        try:
+            cur.execute(
+                """
+                INSERT INTO exchange_orders 
+                (user_id, from_currency, to_currency, from_amount, to_amount, exchange_rate, fee, status,
+                 liquidity_flagged)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, 'pending', %s)
+                RETURNING *
+                """,
+                (user.user_id, from_currency, to_currency, from_amount, to_amount, final_rate, fee,
+                 liquidity == 'flag')
+            )
+            new_order = cur.fetchone()
+            
+            cur.execute(
+                """
+                INSERT INTO notifications (user_id, type, title, message, related_order_id)
+                VALUES (%s, 'order_created', 'Заявка создана', 'Ваша заявка на обмен создана и ожидает обработки', %s)
+                """,
+                (user.user_id, new_order['id'])
+            )
+            
+            conn.commit()
+        except Exception:
+            LIQUIDITY.release(to_currency, to_amount - fee)
+            raise
         cur.close()
+        RISK.checkpoint(conn)
         conn.close()
+        note_write(telegram_id)
         
         return {
             'statusCode': 201,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': JSON_HEADERS,
             'body': json.dumps(dict(new_order), default=str),
             'isBase64Encoded': False
         }
     
     if method == 'PUT':
         body_data = json.loads(event.get('body', '{}'))
-        order_id = body_data.get('order_id')
-        status = body_data.get('status')
-        
+        return update_status(conn, cur, body_data, envelope=False, admin=is_admin_request(event, session))
+    
+    cur.close()
+    conn.close()
+    
+    return {
+        'statusCode': 405,
+        'headers': JSON_HEADERS,
+        'body': json.dumps({'error': 'Method not allowed'}),
+        'isBase64Encoded': False
+    }
+
+
+def is_admin_request(event: Dict[str, Any], session: Any) -> bool:
+    """Сессия администратора или ключ админки в X-Admin-Key"""
+    if session and session.is_admin:
+        return True
+    headers = event.get('headers') or {}
+    admin_key = next((value for key, value in headers.items() if key.lower() == 'x-admin-key'), None)
+    return bool(admin_key) and hmac.compare_digest(str(admin_key), os.environ.get('ADMIN_SECRET_KEY', 'admin123'))
+
+
+def update_status(conn, cur, body_data: Dict[str, Any], envelope: bool, admin: bool = False) -> Dict[str, Any]:
+    """
+    Смена статуса заявки через машину состояний orders.py; envelope — ответ в виде {"success", "order"}.
+    Завершение двигает кошельки пользователя, поэтому доступно только администратору (admin)
+    """
+    order_id = body_data.get('order_id')
+    status = body_data.get('status')
+    
+    try:
         if not all([order_id, status]):
             return {
                 'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'error': 'order_id and status are required'}),
                 'isBase64Encoded': False
             }
         
-        if status == 'completed':
-            cur.execute(
-                "UPDATE exchange_orders SET status = %s, completed_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING *",
-                (status, order_id)
-            )
-        else:
-            cur.execute(
-                "UPDATE exchange_orders SET status = %s WHERE id = %s RETURNING *",
-                (status, order_id)
-            )
-        
-        updated_order = cur.fetchone()
+        try:
+            # Завершение заявки — это расчет по кошелькам, остальные переходы меняют только статус
+            if normalize(status) == 'completed':
+                if not admin:
+                    return {
+                        'statusCode': 403,
+                        'headers': JSON_HEADERS,
+                        'body': json.dumps({'error': 'Admin access required'}),
+                        'isBase64Encoded': False
+                    }
+                updated_order = settle_order(conn, order_id)
+            else:
+                updated_order = transition(cur, order_id, status)
+        except InsufficientFunds as e:
+            return {
+                'statusCode': 409,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': str(e)}),
+                'isBase64Encoded': False
+            }
+        except TransitionError as e:
+            return {
+                'statusCode': 409,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': str(e), 'current_status': e.current}),
+                'isBase64Encoded': False
+            }
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': str(e)}),
+                'isBase64Encoded': False
+            }
         
         if not updated_order:
             return {
                 'statusCode': 404,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'error': 'Order not found'}),
                 'isBase64Encoded': False
             }
@@ -257,26 +403,200 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             INSERT INTO notifications (user_id, type, title, message, related_order_id)
             VALUES (%s, 'order_status', 'Статус заявки изменен', %s, %s)
             """,
-            (updated_order['user_id'], f"Заявка #{order_id} - {status}", order_id)
+            (updated_order['user_id'], f"Заявка #{order_id} - {updated_order['status']}", order_id)
         )
-        
         conn.commit()
+        
+        if updated_order['status'] == 'completed':
+            after_commit(LIQUIDITY.settled, updated_order)
+        elif updated_order['status'] in ('expired', 'cancelled'):
+            after_commit(LIQUIDITY.release, updated_order['to_currency'],
+                         updated_order['to_amount'] - updated_order['fee'])
+    finally:
         cur.close()
         conn.close()
-        
+    
+    order = dict(updated_order)
+    return {
+        'statusCode': 200,
+        'headers': JSON_HEADERS,
+        'body': json.dumps({'success': True, 'order': order} if envelope else order, default=str),
+        'isBase64Encoded': False
+    }
+
+
+def invalid_amount(from_amount: Any) -> Any:
+    """Ответ 400, если from_amount — не положительное конечное число; иначе None"""
+    try:
+        amount = float(from_amount)
+        amount_ok = math.isfinite(amount) and amount > 0
+    except (TypeError, ValueError):
+        amount_ok = False
+    if amount_ok:
+        return None
+    return {
+        'statusCode': 400,
+        'headers': JSON_HEADERS,
+        'body': json.dumps({'error': 'from_amount must be a positive number'}),
+        'isBase64Encoded': False
+    }
+
+
+def quote_response(telegram_id: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Котировка с подписанным токеном; курс берется из rate_cache"""
+    from_currency = params.get('from_currency')
+    to_currency = params.get('to_currency')
+    from_amount = params.get('from_amount')
+    
+    if not all([telegram_id, from_currency, to_currency, from_amount]):
         return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps(dict(updated_order), default=str),
+            'statusCode': 400,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'telegram_id, from_currency, to_currency and from_amount are required'}),
+            'isBase64Encoded': False
+        }
+    invalid = invalid_amount(from_amount)
+    if invalid:
+        return invalid
+    if parse_telegram_id(telegram_id) is None:
+        return {
+            'statusCode': 400,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'telegram_id must be an integer'}),
             'isBase64Encoded': False
         }
     
-    cur.close()
-    conn.close()
+    rate_row = RATES.active_rate(from_currency, to_currency)
+    if not rate_row:
+        return {
+            'statusCode': 404,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'Exchange rate not found'}),
+            'isBase64Encoded': False
+        }
+    
+    quote = issue_quote(telegram_id, from_currency, to_currency, from_amount, rate_row)
+    if not quote:
+        return {
+            'statusCode': 503,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'Quotes are not configured'}),
+            'isBase64Encoded': False
+        }
     
     return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'}),
+        'statusCode': 200,
+        'headers': JSON_HEADERS,
+        'body': json.dumps(quote),
+        'isBase64Encoded': False
+    }
+
+
+def screen_order(conn, user: Any, currency: str, amount: Any) -> Any:
+    """
+    Проверка заявки оценщиком риска. Возвращает ответ с отказом или None; flag только пишется в risk_events
+    и фиксируется вместе с заявкой
+    """
+    if user.is_blocked:
+        return {
+            'statusCode': 403,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'User is blocked'}),
+            'isBase64Encoded': False
+        }
+    decision = RISK.screen(conn, user.user_id, 'order', currency, amount)
+    if decision.action not in ('hold', 'block'):
+        return None
+    conn.commit()
+    if decision.action == 'block':
+        CACHE.invalidate(user_id=user.user_id)
+    return {
+        'statusCode': 423 if decision.action == 'hold' else 403,
+        'headers': JSON_HEADERS,
+        'body': json.dumps({
+            'error': 'Order held for review' if decision.action == 'hold' else 'User is blocked',
+            'reasons': list(decision.reasons),
+        }),
+        'isBase64Encoded': False
+    }
+
+
+def create_from_quote(event: Dict[str, Any], conn, cur, session: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Заявка по цене из котировки: подпись и срок проверяются без запроса к exchange_rates"""
+    quote, error = verify_quote(body_data.get('quote_token'))
+    telegram_id = session.telegram_id if session else body_data.get('telegram_id')
+    
+    try:
+        if not quote:
+            return {
+                'statusCode': 400,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': error}),
+                'isBase64Encoded': False
+            }
+        if not telegram_id or str(telegram_id) != str(quote['telegram_id']):
+            return {
+                'statusCode': 403,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'Quote was issued to another user'}),
+                'isBase64Encoded': False
+            }
+        
+        limited = LIMITER.check(event, 'exchange.create', telegram_id)
+        if limited:
+            return limited
+        
+        user = current_user(conn, session, telegram_id)
+        if not user:
+            return {
+                'statusCode': 404,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'User not found'}),
+                'isBase64Encoded': False
+            }
+        
+        refused = screen_order(conn, user, quote['from_currency'], quote['from_amount'])
+        if refused:
+            return refused
+        
+        commitment = quote['to_amount'] - quote['fee']
+        liquidity = LIQUIDITY.reserve(quote['to_currency'], commitment)
+        if liquidity == 'reject':
+            return {
+                'statusCode': 409,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'Insufficient liquidity'}),
+                'isBase64Encoded': False
+            }
+        
+        try:
+            cur.execute(CREATE_FROM_QUOTE_SQL, (
+                user.user_id, quote['from_currency'], quote['to_currency'], quote['from_amount'],
+                quote['to_amount'], quote['exchange_rate'], quote['fee'], quote['quote_id'], liquidity == 'flag'
+            ))
+            new_order = cur.fetchone()
+        except Exception:
+            LIQUIDITY.release(quote['to_currency'], commitment)
+            raise
+        if not new_order:
+            LIQUIDITY.release(quote['to_currency'], commitment)
+            conn.rollback()
+            return {
+                'statusCode': 409,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'Quote already used'}),
+                'isBase64Encoded': False
+            }
+        conn.commit()
+        RISK.checkpoint(conn)
+    finally:
+        cur.close()
+        conn.close()
+    
+    note_write(telegram_id)
+    return {
+        'statusCode': 201,
+        'headers': JSON_HEADERS,
+        'body': json.dumps(dict(new_order), default=str),
         'isBase64Encoded': False
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,236 @@
+"""
+Резервы и ликвидность по валютам: сколько средств свободно под новые заявки.
+
+    holdings     — активы на хранении (liquidity_reserves: задает оператор, пополнения увеличивают, выплаты уменьшают)
+    liabilities  — долг пользователям: остатки кошельков, еще не зачисленные внутренние переводы и задержанные
+                   на проверку пополнения
+    commitments  — обещанное: to_amount - fee открытых заявок (pending, awaiting_payment, paid) и ожидающие выводы
+    available    = holdings - liabilities - commitments
+
+Снимок хранится в памяти процесса и сдвигается на каждое событие этого контейнера: создание, отмена и расчет
+заявки, пополнение. Поэтому проверка при создании заявки — обращение к словарю под блокировкой, без запроса.
+События других контейнеров и сборщика просроченных заявок снимок видит после сверки: раз в
+LIQUIDITY_RECONCILE_SECONDS он пересчитывается по базе, а расхождение с накопленными значениями пишется в лог.
+Сверка не выполняется в запросе: устаревший снимок пересчитывает фоновый поток (по реплике, если она есть),
+а проверка тем временем работает по старому; пока снимка нет совсем, заявки не проверяются.
+Таймер expire сверяет снимок сразу после закрытия просроченных заявок.
+
+LIQUIDITY_MODE: flag (по умолчанию) — заявка сверх свободного остатка создается с liquidity_flagged = TRUE,
+reject — отклоняется, off — проверки нет. Валюты без строки в liquidity_reserves не проверяются.
+
+Модуль одинаковый в exchange, admin и crypto-webhook — при правке обновляйте все копии.
+"""
+import os
+import threading
+import time
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from instrumentation import REGISTRY, log_event
+
+OPEN_ORDER_STATUSES = ['pending', 'awaiting_payment', 'paid']
+
+RECONCILE_SQL = """
+    WITH h AS (
+        SELECT currency, holdings FROM liquidity_reserves
+    ),
+    l AS (
+        SELECT currency, SUM(total) AS total FROM (
+            SELECT currency, SUM(balance) AS total FROM wallets GROUP BY currency
+            UNION ALL
+            SELECT currency, SUM(amount) FROM transactions
+            WHERE (type = 'transfer_in' AND status = 'pending') OR (type = 'deposit' AND status = 'held')
+            GROUP BY currency
+        ) owed
+        GROUP BY currency
+    ),
+    c AS (
+        SELECT currency, SUM(total) AS total FROM (
+            SELECT to_currency AS currency, SUM(to_amount - fee) AS total FROM exchange_orders
+            WHERE status IN ('pending', 'awaiting_payment', 'paid') GROUP BY to_currency
+            UNION ALL
+            SELECT currency, SUM(amount) FROM transactions
+            WHERE type = 'withdrawal' AND status IN ('pending', 'processing') GROUP BY currency
+        ) promised
+        GROUP BY currency
+    )
+    SELECT currency, h.holdings, COALESCE(l.total, 0), COALESCE(c.total, 0)
+    FROM h FULL JOIN l USING (currency) FULL JOIN c USING (currency)
+    ORDER BY currency
+"""
+
+SET_HOLDINGS_SQL = """
+    INSERT INTO liquidity_reserves (currency, holdings) VALUES (%s, %s)
+    ON CONFLICT (currency) DO UPDATE SET holdings = EXCLUDED.holdings, updated_at = CURRENT_TIMESTAMP
+    RETURNING currency, holdings
+"""
+
+# Пополнение увеличивает активы на хранении; пишется в той же транзакции, что и зачисление на кошелек
+DEPOSIT_SQL = """
+    UPDATE liquidity_reserves SET holdings = holdings + %s, updated_at = CURRENT_TIMESTAMP
+    WHERE currency = %s
+"""
+
+ZERO = Decimal(0)
+
+
+def _decimal(value: Any) -> Decimal:
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+class Reserve:
+    __slots__ = ('holdings', 'liabilities', 'commitments')
+
+    def __init__(self, holdings: Optional[Decimal] = None, liabilities: Decimal = ZERO,
+                 commitments: Decimal = ZERO):
+        # holdings = None — валюта не отслеживается
+        self.holdings = holdings
+        self.liabilities = liabilities
+        self.commitments = commitments
+
+    def available(self) -> Optional[Decimal]:
+        if self.holdings is None:
+            return None
+        return self.holdings - self.liabilities - self.commitments
+
+    def as_dict(self, currency: str) -> Dict[str, Any]:
+        available = self.available()
+        return {
+            'currency': currency,
+            'tracked': self.holdings is not None,
+            'holdings': str(self.holdings) if self.holdings is not None else None,
+            'liabilities': str(self.liabilities),
+            'commitments': str(self.commitments),
+            'available': str(available) if available is not None else None,
+            'coverage': (round(float(self.holdings / (self.liabilities + self.commitments)), 4)
+                         if self.holdings is not None and self.liabilities + self.commitments > 0 else None),
+        }
+
+
+class LiquidityTracker:
+    def __init__(self, reconcile_seconds: float = 60.0, mode: str = 'flag'):
+        self.reconcile_seconds = reconcile_seconds
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.reserves: Dict[str, Reserve] = {}
+        self.expires = 0.0
+        self.refreshing = False
+        self.reconciled_at: Optional[float] = None
+
+    def reserve(self, currency: str, amount: Any) -> str:
+        """
+        Проверяет заявку на amount валюты currency по снимку в памяти и сразу резервирует сумму: ok, flag
+        или reject. Пока снимка нет, ответ ok. Если заявка после этого не создана, сумму нужно вернуть через release
+        """
+        if self.mode == 'off':
+            return 'ok'
+        self._refresh_in_background()
+        amount = _decimal(amount)
+        with self.lock:
+            reserve = self.reserves.get(currency)
+            available = reserve.available() if reserve is not None else None
+            if available is None or available >= amount:
+                verdict = 'ok'
+            else:
+                verdict = 'reject' if self.mode == 'reject' else 'flag'
+            if verdict != 'reject':
+                self._reserve_for(currency).commitments += amount
+            result = verdict if self.reconciled_at is not None else 'unchecked'
+        REGISTRY.inc('liquidity_checks_total', {'currency': currency, 'result': result},
+                     help_text='Pre-trade liquidity checks by result')
+        return verdict
+
+    def release(self, currency: str, amount: Any) -> None:
+        """Заявка не создана, отменена или просрочена — обещанное снимается"""
+        with self.lock:
+            self._reserve_for(currency).commitments -= _decimal(amount)
+
+    def settled(self, order: Dict[str, Any]) -> None:
+        """Расчет заявки: обещанное становится остатком кошелька, списанная валюта уходит из обязательств"""
+        credit = _decimal(order['to_amount']) - _decimal(order['fee'])
+        with self.lock:
+            target = self._reserve_for(order['to_currency'])
+            target.commitments -= credit
+            target.liabilities += credit
+            self._reserve_for(order['from_currency']).liabilities -= _decimal(order['from_amount'])
+
+    def deposit(self, currency: str, amount: Any) -> None:
+        amount = _decimal(amount)
+        with self.lock:
+            reserve = self._reserve_for(currency)
+            if reserve.holdings is not None:
+                reserve.holdings += amount
+            reserve.liabilities += amount
+
+    def invalidate(self) -> None:
+        """Следующая проверка запустит сверку с базой"""
+        with self.lock:
+            self.expires = 0.0
+
+    def exposure(self) -> List[Dict[str, Any]]:
+        """Снимок как есть; свежий — после reconcile"""
+        with self.lock:
+            return [self.reserves[currency].as_dict(currency) for currency in sorted(self.reserves)]
+
+    def reconcile(self, conn) -> Dict[str, Any]:
+        """Пересчитывает снимок по базе; возвращает расхождения с накопленными значениями"""
+        cur = conn.cursor()
+        cur.execute(RECONCILE_SQL)
+        rows = cur.fetchall()
+        cur.close()
+
+        fresh = {currency: Reserve(holdings, _decimal(liabilities), _decimal(commitments))
+                 for currency, holdings, liabilities, commitments in rows}
+        drift: Dict[str, Any] = {}
+        with self.lock:
+            if self.reconciled_at is not None:
+                for currency, reserve in fresh.items():
+                    previous = self.reserves.get(currency) or Reserve()
+                    for field in Reserve.__slots__:
+                        before, after = getattr(previous, field), getattr(reserve, field)
+                        if before is not None and after is not None and before != after:
+                            drift.setdefault(currency, {})[field] = str(after - before)
+            self.reserves = fresh
+            self.reconciled_at = time.time()
+            self.expires = time.monotonic() + self.reconcile_seconds
+        if drift:
+            log_event('liquidity_drift', drift=drift)
+        return drift
+
+    def _refresh_in_background(self) -> None:
+        """Устаревший снимок пересчитывается в отдельном потоке — проверка заявки сверку не ждет"""
+        with self.lock:
+            if self.refreshing or self.expires > time.monotonic():
+                return
+            self.refreshing = True
+        threading.Thread(target=self._refresh, name='liquidity-reconcile', daemon=True).start()
+
+    def _refresh(self) -> None:
+        from db import get_db_connection
+
+        try:
+            conn = get_db_connection(readonly=True)
+            try:
+                self.reconcile(conn)
+            finally:
+                conn.close()
+        except Exception as e:
+            # Следующая попытка — через тот же интервал, а не на каждой заявке
+            with self.lock:
+                self.expires = time.monotonic() + self.reconcile_seconds
+            log_event('liquidity_reconcile_failed', error=f'{type(e).__name__}: {e}')
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def _reserve_for(self, currency: str) -> Reserve:
+        reserve = self.reserves.get(currency)
+        if reserve is None:
+            reserve = self.reserves[currency] = Reserve()
+        return reserve
+
+
+LIQUIDITY = LiquidityTracker(
+    float(os.environ.get('LIQUIDITY_RECONCILE_SECONDS', '60')),
+    os.environ.get('LIQUIDITY_MODE', 'flag'),
+)
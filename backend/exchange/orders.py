@@ -0,0 +1,159 @@
+"""
+Жизненный цикл заявки на обмен: допустимые статусы и переходы между ними.
+
+    pending -> awaiting_payment -> paid -> completed
+    pending / awaiting_payment -> expired, cancelled;  paid -> cancelled
+
+Переход выполняется одним условным UPDATE ... WHERE status = ANY(предыдущие статусы), поэтому два
+одновременных изменения одной заявки не проходят оба. Просроченные pending-заявки закрывает sweep_expired:
+пачки берутся по частичному индексу (created_at) WHERE status = 'pending' с FOR UPDATE SKIP LOCKED, так что
+его можно запускать на нескольких узлах одновременно.
+
+    python orders.py --sweep                 # закрыть все просроченные заявки
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+TRANSITIONS: Dict[str, tuple] = {
+    'pending': ('awaiting_payment', 'expired', 'cancelled'),
+    'awaiting_payment': ('paid', 'completed', 'expired', 'cancelled'),
+    'paid': ('completed', 'cancelled'),
+    'completed': (),
+    'expired': (),
+    'cancelled': (),
+}
+
+STATUSES = tuple(TRANSITIONS)
+
+# Старые клиенты админки переводят заявку в "processing"
+ALIASES = {'processing': 'awaiting_payment'}
+
+# Из каких статусов можно прийти в данный
+SOURCES: Dict[str, List[str]] = {
+    status: [source for source, targets in TRANSITIONS.items() if status in targets] for status in STATUSES
+}
+
+PENDING_TTL_SECONDS = int(os.environ.get('ORDER_PENDING_TTL_SECONDS', '1800'))
+SWEEP_BATCH_SIZE = int(os.environ.get('ORDER_SWEEP_BATCH_SIZE', '5000'))
+
+TRANSITION_SQL = """
+    UPDATE exchange_orders
+    SET status = %(status)s,
+        completed_at = CASE WHEN %(status)s = 'completed' THEN CURRENT_TIMESTAMP ELSE completed_at END
+    WHERE id = %(order_id)s AND status = ANY(%(sources)s)
+    RETURNING *
+"""
+
+SWEEP_BATCH_SQL = """
+    WITH stale AS (
+        SELECT id FROM exchange_orders
+        WHERE status = 'pending' AND created_at < CURRENT_TIMESTAMP - make_interval(secs => %(ttl)s)
+        ORDER BY created_at
+        LIMIT %(batch_size)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    expired AS (
+        UPDATE exchange_orders eo
+        SET status = 'expired'
+        FROM stale
+        WHERE eo.id = stale.id
+        RETURNING eo.id, eo.user_id
+    ),
+    notified AS (
+        INSERT INTO notifications (user_id, type, title, message, related_order_id)
+        SELECT user_id, 'order_status', 'Заявка истекла', 'Заявка #' || id || ' - expired', id
+        FROM expired
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM expired), (SELECT COUNT(*) FROM notified)
+"""
+
+
+class TransitionError(ValueError):
+    """Заявка есть, но из ее текущего статуса в запрошенный перейти нельзя"""
+
+    def __init__(self, order_id: Any, current: str, status: str):
+        super().__init__(f'Order {order_id} cannot move from {current} to {status}')
+        self.current = current
+        self.status = status
+
+
+def normalize(status: Optional[str]) -> str:
+    status = ALIASES.get(status, status)
+    if status not in TRANSITIONS:
+        raise ValueError(f'Unknown order status: {status}')
+    return status
+
+
+def transition(cur, order_id: Any, status: str) -> Optional[Dict[str, Any]]:
+    """
+    Переводит заявку в status внутри транзакции курсора; None — заявки нет.
+    Курсор должен возвращать словари (RealDictCursor)
+    """
+    status = normalize(status)
+    cur.execute(TRANSITION_SQL, {'status': status, 'order_id': order_id, 'sources': SOURCES[status]})
+    order = cur.fetchone()
+    if order:
+        return order
+    cur.execute('SELECT status FROM exchange_orders WHERE id = %s', (order_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    raise TransitionError(order_id, row['status'], status)
+
+
+def sweep_expired(conn, ttl_seconds: int = PENDING_TTL_SECONDS, batch_size: int = SWEEP_BATCH_SIZE,
+                  max_batches: int = 0) -> Dict[str, Any]:
+    """
+    Переводит pending-заявки старше ttl_seconds в expired пачками; каждая пачка — своя транзакция,
+    чтобы блокировки строк держались недолго. max_batches=0 — до конца
+    """
+    summary: Dict[str, Any] = {'batches': 0, 'expired': 0, 'notified': 0}
+    started = time.perf_counter()
+    cur = conn.cursor()
+    try:
+        while not max_batches or summary['batches'] < max_batches:
+            cur.execute(SWEEP_BATCH_SQL, {'ttl': ttl_seconds, 'batch_size': batch_size})
+            expired, notified = cur.fetchone()
+            conn.commit()
+            if not expired:
+                break
+            summary['batches'] += 1
+            summary['expired'] += expired
+            summary['notified'] += notified
+            # Неполная пачка: остальное либо не просрочено, либо сейчас обрабатывается другим узлом
+            if expired < batch_size:
+                break
+    finally:
+        conn.rollback()
+        cur.close()
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Закрытие просроченных заявок')
+    parser.add_argument('--sweep', action='store_true', help='перевести просроченные pending-заявки в expired')
+    parser.add_argument('--ttl', type=int, default=PENDING_TTL_SECONDS, help='сколько секунд заявка живет в pending')
+    parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE)
+    parser.add_argument('--max-batches', type=int, default=0)
+    args = parser.parse_args(argv)
+    if not args.sweep:
+        parser.error('укажите --sweep')
+
+    from db import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        summary = sweep_expired(conn, args.ttl, args.batch_size, args.max_batches)
+    finally:
+        conn.close()
+    print(summary, file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,97 @@
+"""
+Подписанные котировки обмена: цена фиксируется в момент показа и не пересчитывается при создании заявки.
+
+Котировка считается по снимку курсов из rate_cache без запроса к базе. Токен — JSON с парой, суммами,
+курсом, комиссией, telegram_id и сроком действия, подписанный HMAC-SHA256; при создании заявки подпись
+и срок проверяются без обращения к exchange_rates. Случайный id котировки пишется в exchange_orders.quote_id
+с уникальным индексом, поэтому по одной котировке создается не больше одной заявки.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from typing import Any, Dict, Optional, Tuple
+
+QUOTE_VERSION = 1
+_SIGNATURE_BYTES = 16
+
+
+def _secret() -> bytes:
+    secret = os.environ.get('QUOTE_SECRET')
+    if secret:
+        return secret.encode()
+    # Как и для сессий: без отдельного секрета ключ выводится из SESSION_SECRET или токена бота
+    base = os.environ.get('SESSION_SECRET') or os.environ.get('TELEGRAM_BOT_TOKEN')
+    if base:
+        return hmac.new(b'QuoteSecret', base.encode(), hashlib.sha256).digest()
+    return b''
+
+
+def quote_ttl() -> int:
+    return int(os.environ.get('QUOTE_TTL', '30'))
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def price(rate: Any, markup_percent: Any, from_amount: Any) -> Tuple[float, float, float]:
+    """(итоговый курс, сумма к получению, комиссия) — та же формула, что при создании заявки без котировки"""
+    final_rate = float(rate) * (1 + float(markup_percent) / 100)
+    to_amount = float(from_amount) / final_rate
+    fee = to_amount * 0.01
+    return final_rate, to_amount, fee
+
+
+def issue_quote(telegram_id: Any, from_currency: str, to_currency: str, from_amount: Any,
+                rate_row: Any, ttl: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Котировка с токеном или None, если секрет не настроен"""
+    secret = _secret()
+    if not secret:
+        return None
+    final_rate, to_amount, fee = price(rate_row.rate, rate_row.markup_percent, from_amount)
+    quote = {
+        'quote_id': _b64encode(secrets.token_bytes(12)),
+        'telegram_id': int(telegram_id),
+        'from_currency': from_currency,
+        'to_currency': to_currency,
+        'from_amount': str(from_amount),
+        'to_amount': to_amount,
+        'exchange_rate': final_rate,
+        'fee': fee,
+        'expires_at': int(time.time()) + (quote_ttl() if ttl is None else ttl),
+    }
+    payload = json.dumps([QUOTE_VERSION, quote], separators=(',', ':')).encode()
+    signature = hmac.new(secret, payload, hashlib.sha256).digest()[:_SIGNATURE_BYTES]
+    return {**quote, 'quote_token': f'{_b64encode(payload)}.{_b64encode(signature)}'}
+
+
+def verify_quote(token: Optional[str]) -> Tuple[Optional[Dict[str, Any]], str]:
+    """(котировка, '') для действующего токена, иначе (None, причина отказа)"""
+    secret = _secret()
+    if not token or not secret:
+        return None, 'Quote token required'
+    payload_part, _, signature_part = token.partition('.')
+    try:
+        payload = _b64decode(payload_part)
+        signature = _b64decode(signature_part)
+    except (ValueError, TypeError):
+        return None, 'Invalid quote'
+
+    expected = hmac.new(secret, payload, hashlib.sha256).digest()[:_SIGNATURE_BYTES]
+    if not hmac.compare_digest(signature, expected):
+        return None, 'Invalid quote'
+
+    version, quote = json.loads(payload)
+    if version != QUOTE_VERSION:
+        return None, 'Invalid quote'
+    if quote['expires_at'] <= time.time():
+        return None, 'Quote expired'
+    return quote, ''
@@ -0,0 +1,85 @@
+"""
+Кэш активных курсов в памяти процесса.
+
+Хранит уже сериализованный JSON, чтобы горячий путь не ходил в базу и не вызывал json.dumps,
+и те же строки по паре валют — для котировок exchange.
+Курсы меняются редко: после UPDATE функция rates сбрасывает кэш сразу, остальные контейнеры
+подхватывают изменения по истечении RATES_CACHE_TTL.
+
+Модуль одинаковый во всех функциях backend/ — при правке обновляйте все копии.
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from db import get_db_connection
+from instrumentation import on_warmup
+from rows import fetch_all, text_cursor
+from serializer import rows_json
+
+ACTIVE_RATES_SQL = """
+    SELECT * FROM exchange_rates
+    WHERE is_active = TRUE
+    ORDER BY from_currency, to_currency
+"""
+
+
+class RateCache:
+    def __init__(self, ttl: float = 10.0):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.body: Optional[str] = None
+        self.pairs: Dict[Tuple[str, str], Any] = {}
+        self.expires = 0.0
+
+    def active_rates_json(self, conn=None) -> str:
+        """JSON-массив активных курсов; conn используется только при промахе"""
+        body = self.body
+        if body is not None and self.expires > time.monotonic():
+            return body
+        return self._load(conn)
+
+    def active_rate(self, from_currency: str, to_currency: str, conn=None) -> Optional[Any]:
+        """Строка exchange_rates активной пары (rate и markup_percent — текстом) или None"""
+        if self.body is None or self.expires <= time.monotonic():
+            self._load(conn)
+        return self.pairs.get((from_currency, to_currency))
+
+    def _load(self, conn=None) -> str:
+        # Один поток перечитывает курсы, остальные ждут и берут готовый результат
+        with self.lock:
+            if self.body is not None and self.expires > time.monotonic():
+                return self.body
+
+            own_conn = conn is None
+            if own_conn:
+                conn = get_db_connection(readonly=True)
+            try:
+                cur = text_cursor(conn)
+                cur.execute(ACTIVE_RATES_SQL)
+                rates = fetch_all(cur, 'exchange_rates')
+                cur.close()
+            finally:
+                if own_conn:
+                    conn.close()
+
+            self.pairs = {(rate.from_currency, rate.to_currency): rate for rate in rates}
+            self.body = rows_json(rates)
+            self.expires = time.monotonic() + self.ttl
+            return self.body
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.body = None
+            self.pairs = {}
+            self.expires = 0.0
+
+
+RATES = RateCache(float(os.environ.get('RATES_CACHE_TTL', '10')))
+
+
+@on_warmup('rates_cache')
+def _warm_rates() -> None:
+    if os.environ.get('DATABASE_URL'):
+        RATES.active_rates_json()
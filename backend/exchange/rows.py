@@ -0,0 +1,60 @@
+"""
+Компактные строки таблиц вместо RealDictCursor.
+
+Курсор возвращает кортежи, NUMERIC и TIMESTAMP приходят текстом Postgres (в том же виде,
+что давал json.dumps(default=str) для Decimal и datetime), а строки упаковываются в namedtuple
+со __slots__ = () — по одному типу на таблицу и набор колонок.
+
+Модуль одинаковый во всех функциях backend/ — при правке обновляйте все копии.
+"""
+from collections import namedtuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+TABLES = ('users', 'wallets', 'exchange_orders', 'transactions', 'notifications', 'exchange_rates')
+
+# numeric, timestamp, timestamptz, date
+TEXT_OIDS = (1700, 1114, 1184, 1082)
+
+_text_type = None
+_row_types: Dict[Tuple[str, Tuple[str, ...]], type] = {}
+
+
+def _as_text():
+    global _text_type
+    if _text_type is None:
+        import psycopg2.extensions
+        _text_type = psycopg2.extensions.new_type(TEXT_OIDS, 'ROW_TEXT', lambda value, cur: value)
+    return _text_type
+
+
+def text_cursor(conn):
+    """Курсор кортежей, у которого числа и даты остаются строками"""
+    import psycopg2.extensions
+    cur = conn.cursor()
+    psycopg2.extensions.register_type(_as_text(), cur)
+    return cur
+
+
+def row_type(table: str, columns: Sequence[str]) -> type:
+    key = (table, tuple(columns))
+    cls = _row_types.get(key)
+    if cls is None:
+        name = ''.join(part.capitalize() for part in table.split('_')) + 'Row'
+        cls = _row_types[key] = namedtuple(name, key[1], rename=True)
+    return cls
+
+
+def _columns(cur) -> List[str]:
+    return [column[0] for column in cur.description]
+
+
+def fetch_all(cur, table: str) -> List[Any]:
+    make = row_type(table, _columns(cur))._make
+    return [make(row) for row in cur.fetchall()]
+
+
+def fetch_one(cur, table: str) -> Optional[Any]:
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return row_type(table, _columns(cur))._make(row)
@@ -0,0 +1,146 @@
+"""
+Расчет завершенных заявок по кошелькам: списание from_currency, зачисление to_currency за вычетом fee,
+две строки transactions и перевод заявки в completed — одним запросом на заявку.
+
+Порядок блокировок везде один: сначала строки заявок по возрастанию id, затем кошельки по возрастанию id.
+Запрос блокирует кошельки пользователя (ORDER BY id FOR UPDATE) и проверяет баланс по заблокированной,
+то есть последней, версии строки — параллельные расчеты одного пользователя выстраиваются в очередь и не уводят
+баланс в минус. Пакетный режим заранее блокирует все заявки и кошельки пакета в том же порядке
+и затем рассчитывает заявки по одной в той же транзакции.
+"""
+from typing import Any, Dict, Iterable, List, Optional
+
+from orders import SOURCES, TransitionError
+
+SETTLE_SQL = """
+    WITH target AS (
+        SELECT id, user_id, from_currency, to_currency, from_amount, to_amount - fee AS credit
+        FROM exchange_orders
+        WHERE id = %(order_id)s AND status = ANY(%(sources)s)
+        FOR UPDATE
+    ),
+    locked AS (
+        SELECT w.id, w.currency, w.balance
+        FROM wallets w
+        JOIN target t ON w.user_id = t.user_id AND w.currency IN (t.from_currency, t.to_currency)
+        ORDER BY w.id
+        FOR UPDATE OF w
+    ),
+    checked AS (
+        -- Отрицательная сумма прошла бы проверку баланса и зачислила бы from_currency
+        SELECT t.* FROM target t
+        WHERE t.from_amount > 0 AND t.credit > 0
+          AND EXISTS (SELECT 1 FROM locked l WHERE l.currency = t.from_currency AND l.balance >= t.from_amount)
+          AND EXISTS (SELECT 1 FROM locked l WHERE l.currency = t.to_currency)
+    ),
+    moved AS (
+        UPDATE wallets w
+        SET balance = w.balance
+                      - CASE WHEN w.currency = c.from_currency THEN c.from_amount ELSE 0 END
+                      + CASE WHEN w.currency = c.to_currency THEN c.credit ELSE 0 END,
+            updated_at = CURRENT_TIMESTAMP
+        FROM checked c, locked l
+        WHERE w.id = l.id
+        RETURNING w.id
+    ),
+    recorded AS (
+        INSERT INTO transactions (user_id, type, currency, amount, status, related_order_id)
+        SELECT user_id, 'exchange', from_currency, from_amount, 'completed', id FROM checked
+        UNION ALL
+        SELECT user_id, 'exchange_credit', to_currency, credit, 'completed', id FROM checked
+        RETURNING id
+    ),
+    completed AS (
+        UPDATE exchange_orders eo
+        SET status = 'completed', completed_at = CURRENT_TIMESTAMP
+        FROM checked c
+        WHERE eo.id = c.id
+        RETURNING eo.*
+    )
+    SELECT (SELECT COUNT(*) FROM target) AS found,
+           (SELECT COUNT(*) FROM moved) AS wallets,
+           (SELECT COUNT(*) FROM recorded) AS transactions,
+           (SELECT row_to_json(completed) FROM completed) AS order_json
+"""
+
+LOCK_ORDERS_SQL = """
+    SELECT id FROM exchange_orders
+    WHERE id = ANY(%s) AND status = ANY(%s)
+    ORDER BY id
+    FOR UPDATE
+"""
+
+LOCK_WALLETS_SQL = """
+    SELECT w.id
+    FROM wallets w
+    JOIN exchange_orders eo ON eo.user_id = w.user_id AND w.currency IN (eo.from_currency, eo.to_currency)
+    WHERE eo.id = ANY(%s)
+    ORDER BY w.id
+    FOR UPDATE OF w
+"""
+
+
+class InsufficientFunds(ValueError):
+    """На кошельке from_currency не хватает средств или у пользователя нет нужного кошелька"""
+
+
+def _settle(cur, order_id: Any) -> Optional[Dict[str, Any]]:
+    cur.execute(SETTLE_SQL, {'order_id': order_id, 'sources': SOURCES['completed']})
+    found, _, _, order = cur.fetchone()
+    if order:
+        return order
+    if found:
+        raise InsufficientFunds(
+            f'Order {order_id} cannot be settled: insufficient balance, missing wallet or non-positive amount'
+        )
+    cur.execute('SELECT status FROM exchange_orders WHERE id = %s', (order_id,))
+    current = cur.fetchone()
+    if not current:
+        return None
+    raise TransitionError(order_id, current[0], 'completed')
+
+
+def settle_order(conn, order_id: Any) -> Optional[Dict[str, Any]]:
+    """
+    Рассчитывает одну заявку в текущей транзакции conn и возвращает ее в виде dict; None — заявки нет.
+    TransitionError — заявку нельзя завершить из текущего статуса, InsufficientFunds — не хватает средств
+    """
+    cur = conn.cursor()
+    try:
+        return _settle(cur, order_id)
+    finally:
+        cur.close()
+
+
+def settle_batch(conn, order_ids: Iterable[Any]) -> Dict[str, Any]:
+    """
+    Рассчитывает пакет заявок в одной транзакции. Заявки, которые завершить нельзя, пропускаются
+    и попадают в failed с причиной; остальные фиксируются одним COMMIT
+    """
+    ids = sorted({int(order_id) for order_id in order_ids})
+    settled: List[int] = []
+    failed: List[Dict[str, Any]] = []
+    cur = conn.cursor()
+    try:
+        cur.execute(LOCK_ORDERS_SQL, (ids, SOURCES['completed']))
+        lockable = [row[0] for row in cur.fetchall()]
+        cur.execute(LOCK_WALLETS_SQL, (lockable,))
+        cur.fetchall()
+
+        for order_id in ids:
+            try:
+                order = _settle(cur, order_id)
+            except (TransitionError, InsufficientFunds) as e:
+                failed.append({'order_id': order_id, 'error': str(e)})
+                continue
+            if order is None:
+                failed.append({'order_id': order_id, 'error': 'Order not found'})
+            else:
+                settled.append(order_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return {'settled': settled, 'failed': failed}
@@ -0,0 +1,381 @@
+"""
+Подключение к базе данных для обработчиков
+
+Соединения переиспользуются между вызовами через пул процесса: close() возвращает соединение
+в пул, а подготовленные на нем запросы (statements.py) остаются доступны следующему вызову.
+DB_POOL_SIZE=0 отключает пул.
+
+get_db_connection(readonly=True) отправляет чтение на реплики из DATABASE_REPLICA_URLS:
+выбирается реплика с наименьшим отставанием, если оно не больше REPLICA_MAX_LAG_SECONDS
+и меньше времени, прошедшего с последней записи этого пользователя (note_write), иначе — primary.
+
+Модуль одинаковый во всех функциях backend/ — при правке обновляйте все копии.
+"""
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extensions
+
+from instrumentation import REGISTRY, connection_factory, log_event, on_warmup
+
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', '1'))
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', '30'))
+DB_POOL_WARM = int(os.environ.get('DB_POOL_WARM', '1'))
+
+# Отставание реплики в секундах; 0 — если реплика догнала primary или это сам primary
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def _connect(dsn: Optional[str] = None):
+    return psycopg2.connect(dsn or os.environ['DATABASE_URL'], connection_factory=connection_factory())
+
+
+class PooledConnection:
+    """Соединение из пула; close() возвращает его в пул вместо закрытия"""
+
+    def __init__(self, pool: 'ConnectionPool', conn):
+        self.pool = pool
+        self.conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return self.conn.cursor(*args, **kwargs)
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def rollback(self) -> None:
+        self.conn.rollback()
+
+    def close(self) -> None:
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            self.pool.release(conn)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+class ConnectionPool:
+    def __init__(self, maxsize: int = 4, max_idle: float = 300.0, dsn: Optional[str] = None):
+        self.dsn = dsn
+        self.maxsize = maxsize
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle: List[Tuple[float, object]] = []
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self):
+        if self.maxsize <= 0:
+            return _connect(self.dsn)
+        now = time.monotonic()
+        with self.lock:
+            while self.idle:
+                released_at, conn = self.idle.pop()
+                if conn.closed or now - released_at > self.max_idle:
+                    # Долго простаивавшее соединение сервер или балансировщик мог уже закрыть
+                    self._discard(conn)
+                    continue
+                self.reused += 1
+                return PooledConnection(self, conn)
+            self.created += 1
+        return PooledConnection(self, _connect(self.dsn))
+
+    def release(self, conn) -> None:
+        if conn.closed:
+            return
+        try:
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            self._discard(conn)
+            return
+        with self.lock:
+            if len(self.idle) < self.maxsize:
+                self.idle.append((time.monotonic(), conn))
+                return
+        self._discard(conn)
+
+    @staticmethod
+    def _discard(conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def prime(self, count: int) -> None:
+        """Заранее открывает соединения, пока в пуле не станет count простаивающих"""
+        with self.lock:
+            missing = min(count, self.maxsize) - len(self.idle)
+            self.created += max(missing, 0)
+        for _ in range(missing):
+            self.release(_connect(self.dsn))
+
+    def clear(self) -> None:
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for _, conn in idle:
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'idle': len(self.idle), 'created': self.created, 'reused': self.reused}
+
+
+def _new_pool(dsn: Optional[str] = None) -> ConnectionPool:
+    return ConnectionPool(
+        maxsize=int(os.environ.get('DB_POOL_SIZE', '4')),
+        max_idle=float(os.environ.get('DB_POOL_MAX_IDLE', '300')),
+        dsn=dsn,
+    )
+
+
+POOL = _new_pool()
+
+
+@on_warmup('db_pool')
+def _warm_pool() -> None:
+    # Обработчики импортируют psycopg2.extras только на изменяющих путях — при прогреве грузим его заранее
+    import psycopg2.extras  # noqa: F401
+    if os.environ.get('DATABASE_URL'):
+        POOL.prime(DB_POOL_WARM)
+
+
+class Replica:
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.pool = _new_pool(dsn)
+        self.lag = 0.0
+        self.checked_at = float('-inf')
+
+
+def measured_lag(replica: Replica, conn) -> float:
+    """Источник отставания по умолчанию: запрос к самой реплике"""
+    cur = conn.cursor(raw=True)
+    try:
+        cur.execute(LAG_SQL)
+        return float(cur.fetchone()[0])
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+class ReplicaRouter:
+    """
+    Выбор реплики для чтения. Отставание замеряется не чаще REPLICA_LAG_CHECK_INTERVAL на реплику;
+    lag_source можно подменить (set_lag_source), чтобы локально имитировать отставание.
+    REPLICA_SIMULATED_LAG добавляет к замеру фиксированную задержку
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.replicas: List[Replica] = []
+        self.configured: Optional[str] = None
+        self.lag_source: Callable[[Replica, Any], float] = measured_lag
+        self.last_writes: Dict[str, float] = {}
+
+    def _replicas(self) -> List[Replica]:
+        urls = os.environ.get('DATABASE_REPLICA_URLS', '')
+        if urls != self.configured:
+            with self.lock:
+                if urls != self.configured:
+                    for replica in self.replicas:
+                        replica.pool.clear()
+                    self.replicas = [Replica(dsn.strip()) for dsn in urls.split(',') if dsn.strip()]
+                    self.configured = urls
+        return self.replicas
+
+    def note_write(self, subject: Any) -> None:
+        now = time.monotonic()
+        with self.lock:
+            self.last_writes[str(subject)] = now
+            if len(self.last_writes) > 100000:
+                cutoff = now - READ_YOUR_WRITES_SECONDS
+                self.last_writes = {k: v for k, v in self.last_writes.items() if v > cutoff}
+
+    def _since_write(self, subject: Any) -> Optional[float]:
+        if subject is None:
+            return None
+        written = self.last_writes.get(str(subject))
+        if written is None:
+            return None
+        since = time.monotonic() - written
+        return since if since < READ_YOUR_WRITES_SECONDS else None
+
+    def _refresh(self, replica: Replica, conn) -> None:
+        try:
+            lag = self.lag_source(replica, conn)
+        except psycopg2.Error:
+            lag = float('inf')
+        replica.lag = lag + float(os.environ.get('REPLICA_SIMULATED_LAG', '0') or 0)
+        replica.checked_at = time.monotonic()
+
+    def acquire(self, subject: Any = None):
+        replicas = self._replicas()
+        if not replicas:
+            return POOL.acquire()
+
+        since_write = self._since_write(subject)
+
+        def acceptable(lag: float) -> bool:
+            # Реплика должна была успеть получить последнюю запись пользователя
+            return lag <= REPLICA_MAX_LAG_SECONDS and (since_write is None or lag < since_write)
+
+        reason = 'lag'
+        for replica in sorted(replicas, key=lambda r: (r.lag, random.random())):
+            fresh = time.monotonic() - replica.checked_at < REPLICA_LAG_CHECK_INTERVAL
+            if fresh and not acceptable(replica.lag):
+                continue
+            try:
+                conn = replica.pool.acquire()
+            except psycopg2.Error:
+                replica.lag, replica.checked_at = float('inf'), time.monotonic()
+                reason = 'unavailable'
+                continue
+            if not fresh:
+                self._refresh(replica, conn)
+            if acceptable(replica.lag):
+                REGISTRY.inc('db_route_total', {'target': 'replica', 'reason': 'ok'},
+                             help_text='Read-only connections by target')
+                return conn
+            conn.close()
+
+        if since_write is not None:
+            reason = 'read_your_writes'
+        REGISTRY.inc('db_route_total', {'target': 'primary', 'reason': reason},
+                     help_text='Read-only connections by target')
+        return POOL.acquire()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {'lag': round(r.lag, 3), **r.pool.stats()}
+            for r in self._replicas()
+        ]
+
+
+ROUTER = ReplicaRouter()
+
+
+def set_lag_source(source: Callable[[Replica, Any], float]) -> None:
+    """Подменяет источник отставания реплик (тесты и локальная имитация)"""
+    ROUTER.lag_source = source
+    for replica in ROUTER.replicas:
+        replica.checked_at = float('-inf')
+
+
+def note_write(subject: Any) -> None:
+    """Отмечает запись пользователя: ближайшие чтения по нему не уйдут на отстающую реплику"""
+    if subject is not None:
+        after_commit(ROUTER.note_write, subject)
+
+
+def pool_stats() -> Dict[str, Any]:
+    return {'primary': POOL.stats(), 'replicas': ROUTER.stats()}
+
+
+class SharedConnection:
+    """
+    Одно соединение на несколько вызовов обработчика (batch).
+    close() ничего не делает — соединение закрывает владелец; в атомарном режиме
+    commit() тоже откладывается до конца пакета, а rollback() помечает пакет как неудавшийся.
+    Побочные эффекты в памяти процесса (after_commit) в атомарном режиме копятся в deferred
+    и выполняются только после общего COMMIT
+    """
+
+    def __init__(self, atomic: bool = False):
+        self.atomic = atomic
+        self.failed = False
+        self.conn = None
+        self.deferred: List[Tuple[Callable, tuple, Dict[str, Any]]] = []
+
+    def acquire(self) -> 'SharedConnection':
+        if self.conn is None:
+            self.conn = POOL.acquire()
+        return self
+
+    def cursor(self, *args, **kwargs):
+        return self.conn.cursor(*args, **kwargs)
+
+    def commit(self) -> None:
+        if not self.atomic:
+            self.conn.commit()
+
+    def rollback(self) -> None:
+        self.conn.rollback()
+        if self.atomic:
+            self.failed = True
+
+    def close(self) -> None:
+        pass
+
+    def run_deferred(self) -> None:
+        deferred, self.deferred = self.deferred, []
+        for fn, args, kwargs in deferred:
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                # Пакет уже зафиксирован — сбой кэша или счетчика не должен менять ответ
+                log_event('after_commit_failed', error=f'{type(e).__name__}: {e}')
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+_shared: ContextVar[Optional[SharedConnection]] = ContextVar('shared_connection', default=None)
+
+
+def get_db_connection(readonly: bool = False, subject: Any = None):
+    """
+    Подключение к базе данных с инструментированными курсорами (из пула процесса).
+    readonly=True разрешает реплику; subject (telegram_id) включает read-your-writes для пользователя
+    """
+    shared = _shared.get()
+    if shared is not None:
+        return shared.acquire()
+    if readonly:
+        return ROUTER.acquire(subject)
+    return POOL.acquire()
+
+
+def in_atomic_batch() -> bool:
+    """Вызов идет внутри атомарного пакета: его транзакцию еще может откатить следующий элемент"""
+    shared = _shared.get()
+    return shared is not None and shared.atomic
+
+
+def after_commit(fn: Callable, *args: Any, **kwargs: Any) -> None:
+    """
+    Побочный эффект в памяти процесса после фиксации записи (кэши, счетчики, маршрутизация чтений).
+    В атомарном пакете откладывается до общего COMMIT и отбрасывается при откате, иначе выполняется сразу
+    """
+    shared = _shared.get()
+    if shared is not None and shared.atomic:
+        shared.deferred.append((fn, args, kwargs))
+    else:
+        fn(*args, **kwargs)
+
+
+@contextmanager
+def shared_connection(atomic: bool = False) -> Iterator[SharedConnection]:
+    """Все get_db_connection() внутри блока возвращают одно и то же соединение"""
+    shared = SharedConnection(atomic)
+    token = _shared.set(shared)
+    try:
+        yield shared
+    finally:
+        _shared.reset(token)
+        if shared.conn is not None:
+            shared.conn.close()
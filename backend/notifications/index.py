@@ -2,64 +2,89 @@
 Функция управления уведомлениями пользователя в реальном времени
 """
 import json
-import os
 from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from db import get_db_connection, note_write
+from instrumentation import instrument
+from batch import batchable
+from encoding import list_response, negotiated
+from identity import resolve_user
+from ratelimit import LIMITER
+from session import session_from_event, session_required
+from rows import fetch_all, text_cursor
+from statements import prepared
 
+NOTIFICATIONS_PAGE = prepared('notifications_page', '''
+    SELECT n.*
+    FROM notifications n
+    WHERE n.user_id = $1
+    ORDER BY n.created_at DESC
+    LIMIT 50
+''')
+
+# Заголовки ответов собираются один раз при загрузке модуля
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Telegram-User-Id, X-Session-Token, Authorization',
+    'Access-Control-Max-Age': '86400'
+}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+@instrument('notifications')
+@negotiated
+@batchable
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Telegram-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
+            'headers': CORS_HEADERS,
             'body': '',
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    session = session_from_event(event)
+    
+    if not session and session_required():
+        return {
+            'statusCode': 401,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'Session token required'}),
+            'isBase64Encoded': False
+        }
+    
+    params = event.get('queryStringParameters') or {}
     
     if method == 'GET':
-        params = event.get('queryStringParameters') or {}
-        telegram_id = params.get('telegram_id')
+        telegram_id = session.telegram_id if session else params.get('telegram_id')
         
         if not telegram_id:
             return {
                 'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'error': 'telegram_id is required'}),
                 'isBase64Encoded': False
             }
         
-        cur.execute(
-            """
-            SELECT n.*
-            FROM notifications n
-            JOIN users u ON n.user_id = u.id
-            WHERE u.telegram_id = %s
-            ORDER BY n.created_at DESC
-            LIMIT 50
-            """,
-            (telegram_id,)
-        )
-        notifications = cur.fetchall()
+        conn = get_db_connection(readonly=True, subject=telegram_id)
+        cur = text_cursor(conn)
+        user = session or resolve_user(conn, telegram_id)
+        notifications = []
+        
+        if user:
+            NOTIFICATIONS_PAGE.execute(cur, (user.user_id,))
+            notifications = fetch_all(cur, 'notifications')
         
         cur.close()
         conn.close()
         
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps([dict(n) for n in notifications], default=str),
-            'isBase64Encoded': False
-        }
+        return list_response(event, notifications)
+    
+    # psycopg2.extras (и logging за ним) нужен только изменяющим запросам — не грузим его на холодном старте
+    from psycopg2.extras import RealDictCursor
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
     
     if method == 'PUT':
         body_data = json.loads(event.get('body', '{}'))
@@ -68,39 +93,48 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if not notification_id:
             return {
                 'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'error': 'notification_id is required'}),
                 'isBase64Encoded': False
             }
         
-        cur.execute(
-            "UPDATE notifications SET is_read = TRUE WHERE id = %s RETURNING *",
-            (notification_id,)
-        )
+        if session:
+            # С токеном отмечать можно только свои уведомления
+            cur.execute(
+                "UPDATE notifications SET is_read = TRUE WHERE id = %s AND user_id = %s RETURNING *",
+                (notification_id, session.user_id)
+            )
+        else:
+            cur.execute(
+                "UPDATE notifications SET is_read = TRUE WHERE id = %s RETURNING *",
+                (notification_id,)
+            )
         updated = cur.fetchone()
         
         conn.commit()
         cur.close()
         conn.close()
+        if session:
+            note_write(session.telegram_id)
         
         if not updated:
             return {
                 'statusCode': 404,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'error': 'Notification not found'}),
                 'isBase64Encoded': False
             }
         
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': JSON_HEADERS,
             'body': json.dumps(dict(updated), default=str),
             'isBase64Encoded': False
         }
     
     if method == 'POST':
         body_data = json.loads(event.get('body', '{}'))
-        telegram_id = body_data.get('telegram_id')
+        telegram_id = session.telegram_id if session else body_data.get('telegram_id')
         notification_type = body_data.get('type')
         title = body_data.get('title')
         message = body_data.get('message')
@@ -108,18 +142,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if not all([telegram_id, notification_type, title, message]):
             return {
                 'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'error': 'All fields are required'}),
                 'isBase64Encoded': False
             }
         
-        cur.execute("SELECT id FROM users WHERE telegram_id = %s", (telegram_id,))
-        user = cur.fetchone()
+        limited = LIMITER.check(event, 'notifications.create', telegram_id)
+        if limited:
+            cur.close()
+            conn.close()
+            return limited
+        
+        user = session or resolve_user(conn, telegram_id)
         
         if not user:
             return {
                 'statusCode': 404,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'error': 'User not found'}),
                 'isBase64Encoded': False
             }
@@ -130,17 +169,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             VALUES (%s, %s, %s, %s)
             RETURNING *
             """,
-            (user['id'], notification_type, title, message)
+            (user.user_id, notification_type, title, message)
         )
         new_notification = cur.fetchone()
         
         conn.commit()
         cur.close()
         conn.close()
+        note_write(telegram_id)
         
         return {
             'statusCode': 201,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': JSON_HEADERS,
             'body': json.dumps(dict(new_notification), default=str),
             'isBase64Encoded': False
         }
@@ -150,7 +190,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     return {
         'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'headers': JSON_HEADERS,
         'body': json.dumps({'error': 'Method not allowed'}),
         'isBase64Encoded': False
     }
@@ -2,71 +2,69 @@
 Функция управления курсами валют и интеграции с внешними API
 """
 import json
-import os
 from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from db import after_commit, get_db_connection
+from instrumentation import instrument
+from batch import batchable
+from encoding import list_response, negotiated
+from rate_cache import RATES
+from rows import fetch_all, text_cursor
 
+# Заголовки ответов собираются один раз при загрузке модуля
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Telegram-User-Id',
+    'Access-Control-Max-Age': '86400'
+}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+@instrument('rates')
+@negotiated
+@batchable
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Telegram-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
+            'headers': CORS_HEADERS,
             'body': '',
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    params = event.get('queryStringParameters') or {}
+    
+    # Активные курсы отдаем из кэша процесса, без соединения с базой
+    if method == 'GET' and params.get('action') != 'list':
+        return {
+            'statusCode': 200,
+            'headers': JSON_HEADERS,
+            'body': RATES.active_rates_json(),
+            'isBase64Encoded': False
+        }
     
+    # Полный список курсов, включая неактивные (action=list)
     if method == 'GET':
-        params = event.get('queryStringParameters') or {}
-        action = params.get('action')
-        
-        if action == 'list':
-            cur.execute(
-                """
-                SELECT * FROM exchange_rates
-                ORDER BY from_currency, to_currency
-                """
-            )
-            rates = cur.fetchall()
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'rates': [dict(r) for r in rates]}, default=str),
-                'isBase64Encoded': False
-            }
-        
+        conn = get_db_connection(readonly=True)
+        cur = text_cursor(conn)
         cur.execute(
             """
             SELECT * FROM exchange_rates
-            WHERE is_active = TRUE
             ORDER BY from_currency, to_currency
             """
         )
-        rates = cur.fetchall()
+        rates = fetch_all(cur, 'exchange_rates')
         
         cur.close()
         conn.close()
         
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps([dict(r) for r in rates], default=str),
-            'isBase64Encoded': False
-        }
+        return list_response(event, rates, key='rates')
+    
+    # psycopg2.extras (и logging за ним) нужен только изменяющим запросам — не грузим его на холодном старте
+    from psycopg2.extras import RealDictCursor
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
     
     if method == 'POST':
         body_data = json.loads(event.get('body', '{}'))
@@ -96,7 +94,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             if not updates:
                 return {
                     'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': JSON_HEADERS,
                     'body': json.dumps({'error': 'No fields to update'}),
                     'isBase64Encoded': False
                 }
@@ -118,25 +116,26 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             conn.commit()
             cur.close()
             conn.close()
+            after_commit(RATES.invalidate)
             
             if not updated_rate:
                 return {
                     'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': JSON_HEADERS,
                     'body': json.dumps({'error': 'Rate not found'}),
                     'isBase64Encoded': False
                 }
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'success': True, 'rate': dict(updated_rate)}, default=str),
                 'isBase64Encoded': False
             }
         
         return {
             'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': JSON_HEADERS,
             'body': json.dumps({'error': 'Invalid action'}),
             'isBase64Encoded': False
         }
@@ -151,7 +150,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if not all([from_currency, to_currency, rate]):
             return {
                 'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'error': 'from_currency, to_currency, and rate are required'}),
                 'isBase64Encoded': False
             }
@@ -182,18 +181,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         conn.commit()
         cur.close()
         conn.close()
+        after_commit(RATES.invalidate)
         
         if not updated_rate:
             return {
                 'statusCode': 404,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'error': 'Exchange rate not found'}),
                 'isBase64Encoded': False
             }
         
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': JSON_HEADERS,
             'body': json.dumps(dict(updated_rate), default=str),
             'isBase64Encoded': False
         }
@@ -203,7 +203,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     return {
         'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'headers': JSON_HEADERS,
         'body': json.dumps({'error': 'Method not allowed'}),
         'isBase64Encoded': False
     }
\ No newline at end of file
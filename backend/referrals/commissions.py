@@ -0,0 +1,180 @@
+"""
+Начисление реферальных комиссий по завершенным заявкам.
+
+Заявки выбираются пачками по ключу (completed_at, id) от отметки в referral_accrual_state.
+Вся пачка обрабатывается одним запросом: комиссия каждого уровня берется из комиссии заявки
+в рублях, получатели — из referral_closure, строки пишутся в referral_commissions, а referral_earnings
+получателей увеличивается одним сгруппированным UPDATE.
+
+Комиссия заявки (fee, в to_currency) переводится в рубли по курсу самой заявки, если одна из валют — RUB
+(from_amount = to_amount * exchange_rate), иначе — по текущему курсу to_currency -> RUB из exchange_rates.
+Заявка, для которой курса нет, останавливает пачку: отметка остается перед ней, в лог пишется
+referral_accrual_unpriced, и следующий запуск продолжит с нее, когда курс появится.
+
+Заявка может стать completed позже заявок, уже пройденных отметкой, поэтому каждый запуск
+начинает с отметки минус ACCRUAL_OVERLAP_SECONDS; уникальность (order_id, beneficiary_id)
+не дает начислить одну заявку дважды.
+
+    python commissions.py --backfill --batch-size 20000     # вся история с начала
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List
+
+from instrumentation import log_event
+
+# Доли комиссии заявки по уровням: 1 — прямой реферер
+REFERRAL_TIERS = [Decimal(p) / 100 for p in os.environ.get('REFERRAL_TIERS', '20,5,2').split(',') if p.strip()]
+ACCRUAL_BATCH_SIZE = int(os.environ.get('ACCRUAL_BATCH_SIZE', '5000'))
+ACCRUAL_OVERLAP_SECONDS = int(os.environ.get('ACCRUAL_OVERLAP_SECONDS', '300'))
+
+# Один запуск за раз на всю базу
+ACCRUAL_LOCK_KEY = 0x72656663
+
+ACCRUE_BATCH_SQL = """
+    WITH candidates AS (
+        SELECT eo.id, eo.user_id, eo.completed_at,
+               eo.fee * CASE WHEN eo.to_currency = 'RUB' THEN 1
+                             WHEN eo.from_currency = 'RUB' THEN eo.exchange_rate
+                             ELSE r.rate END AS fee_rub
+        FROM exchange_orders eo
+        LEFT JOIN exchange_rates r ON r.from_currency = eo.to_currency AND r.to_currency = 'RUB'
+        WHERE eo.status = 'completed' AND (eo.completed_at, eo.id) > (%(mark_at)s, %(mark_id)s)
+        ORDER BY eo.completed_at, eo.id
+        LIMIT %(batch_size)s
+    ),
+    -- Первая заявка без курса в рубли: пачка и отметка заканчиваются перед ней
+    unpriced AS (
+        SELECT completed_at, id FROM candidates WHERE fee_rub IS NULL ORDER BY completed_at, id LIMIT 1
+    ),
+    batch AS (
+        SELECT c.* FROM candidates c
+        WHERE NOT EXISTS (SELECT 1 FROM unpriced u WHERE (c.completed_at, c.id) >= (u.completed_at, u.id))
+    ),
+    tiers AS (
+        SELECT share, depth::int AS depth FROM unnest(%(tiers)s::numeric[]) WITH ORDINALITY AS t(share, depth)
+    ),
+    accrued AS (
+        INSERT INTO referral_commissions (order_id, beneficiary_id, referral_id, depth, fee_rub, amount)
+        SELECT b.id, c.ancestor_id, b.user_id, c.depth, b.fee_rub, round(b.fee_rub * t.share, 8)
+        FROM batch b
+        JOIN referral_closure c ON c.descendant_id = b.user_id AND c.depth <= %(max_depth)s
+        JOIN tiers t ON t.depth = c.depth
+        WHERE b.fee_rub > 0
+        ON CONFLICT (order_id, beneficiary_id) DO NOTHING
+        RETURNING beneficiary_id, amount
+    ),
+    credited AS (
+        UPDATE users u
+        SET referral_earnings = COALESCE(u.referral_earnings, 0) + s.total,
+            updated_at = CURRENT_TIMESTAMP
+        FROM (SELECT beneficiary_id, SUM(amount) AS total FROM accrued GROUP BY beneficiary_id) s
+        WHERE u.id = s.beneficiary_id
+        RETURNING s.total
+    ),
+    last AS (
+        SELECT completed_at, id FROM batch ORDER BY completed_at DESC, id DESC LIMIT 1
+    )
+    SELECT (SELECT COUNT(*) FROM batch),
+           (SELECT completed_at FROM last),
+           (SELECT id FROM last),
+           (SELECT COUNT(*) FROM accrued),
+           (SELECT COUNT(*) FROM credited),
+           (SELECT COALESCE(SUM(total), 0) FROM credited),
+           (SELECT id FROM unpriced)
+"""
+
+
+def accrue(conn, batch_size: int = ACCRUAL_BATCH_SIZE, max_batches: int = 0,
+           overlap_seconds: int = ACCRUAL_OVERLAP_SECONDS, backfill: bool = False) -> Dict[str, Any]:
+    """
+    Обрабатывает завершенные заявки пачками; каждая пачка — отдельная транзакция вместе с отметкой.
+    max_batches=0 — до конца; backfill=True начинает с самой ранней заявки
+    """
+    cur = conn.cursor()
+    cur.execute('SELECT pg_try_advisory_lock(%s)', (ACCRUAL_LOCK_KEY,))
+    if not cur.fetchone()[0]:
+        conn.rollback()
+        cur.close()
+        return {'skipped': 'already running'}
+
+    summary: Dict[str, Any] = {'batches': 0, 'orders': 0, 'commissions': 0, 'credited_users': 0,
+                               'credited_total': '0'}
+    credited_total = Decimal(0)
+    started = time.perf_counter()
+    try:
+        cur.execute("SELECT mark_at, mark_id FROM referral_accrual_state WHERE name = 'commissions'")
+        mark_at, mark_id = cur.fetchone()
+        conn.commit()
+        overlap = timedelta(seconds=overlap_seconds)
+        # '-infinity' приходит из psycopg2 как datetime.min
+        if backfill or mark_at - datetime.min < overlap:
+            mark_at, mark_id = datetime.min, 0
+        else:
+            mark_at, mark_id = mark_at - overlap, 0
+
+        params = {'tiers': REFERRAL_TIERS, 'max_depth': len(REFERRAL_TIERS), 'batch_size': batch_size}
+        while not max_batches or summary['batches'] < max_batches:
+            cur.execute(ACCRUE_BATCH_SQL, {**params, 'mark_at': mark_at, 'mark_id': mark_id})
+            orders, last_at, last_id, commissions, users, total, unpriced_id = cur.fetchone()
+            if unpriced_id is not None:
+                log_event('referral_accrual_unpriced', order_id=unpriced_id)
+                summary['unpriced_order'] = unpriced_id
+            if not orders:
+                conn.rollback()
+                break
+            mark_at, mark_id = last_at, last_id
+            # Отметка только растет: перекрытие и backfill не отодвигают ее назад
+            cur.execute(
+                """
+                UPDATE referral_accrual_state
+                SET mark_at = %s, mark_id = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE name = 'commissions' AND (mark_at, mark_id) < (%s, %s)
+                """,
+                (mark_at, mark_id, mark_at, mark_id)
+            )
+            conn.commit()
+
+            summary['batches'] += 1
+            summary['orders'] += orders
+            summary['commissions'] += commissions
+            summary['credited_users'] += users
+            credited_total += total
+            if orders < batch_size or unpriced_id is not None:
+                break
+    finally:
+        # Упавшая пачка оставляет прерванную транзакцию — откатываем ее до снятия блокировки
+        conn.rollback()
+        cur.execute('SELECT pg_advisory_unlock(%s)', (ACCRUAL_LOCK_KEY,))
+        conn.commit()
+        cur.close()
+
+    summary['credited_total'] = str(credited_total)
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Начисление реферальных комиссий')
+    parser.add_argument('--backfill', action='store_true', help='пройти всю историю заявок с начала')
+    parser.add_argument('--batch-size', type=int, default=ACCRUAL_BATCH_SIZE)
+    parser.add_argument('--max-batches', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from db import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        summary = accrue(conn, args.batch_size, args.max_batches, backfill=args.backfill)
+    finally:
+        conn.close()
+    print(summary, file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,175 @@
+"""
+Реферальная программа: статистика реферера и начисление комиссий по завершенным заявкам
+"""
+import json
+import os
+from typing import Dict, Any
+from db import get_db_connection
+from instrumentation import instrument, timer_payload
+from commissions import accrue
+from identity import resolve_user
+from session import session_from_event, session_required
+from statements import prepared
+
+# Рефералы по уровням из referral_closure и последние начисления — одним запросом, JSON собирает Postgres
+REFERRAL_STATS = prepared('referral_stats', '''
+    SELECT u.referral_code,
+           COALESCE(u.referral_earnings, 0)::text,
+           COALESCE((
+               SELECT json_agg(json_build_object('depth', depth, 'count', cnt) ORDER BY depth)
+               FROM (
+                   SELECT depth, COUNT(*) AS cnt FROM referral_closure
+                   WHERE ancestor_id = u.id GROUP BY depth
+               ) levels
+           ), '[]')::text,
+           (SELECT COUNT(*) FROM referral_commissions WHERE beneficiary_id = u.id),
+           COALESCE((
+               SELECT json_agg(c)
+               FROM (
+                   SELECT order_id, referral_id, depth, amount::text AS amount, created_at::text AS created_at
+                   FROM referral_commissions
+                   WHERE beneficiary_id = u.id
+                   ORDER BY created_at DESC
+                   LIMIT $2
+               ) c
+           ), '[]')::text
+    FROM users u
+    WHERE u.id = $1
+''')
+
+# Заголовки ответов собираются один раз при загрузке модуля
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Session-Token, Authorization, X-Admin-Key',
+    'Access-Control-Max-Age': '86400'
+}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+def run_accrual(batch_size: int = 0, max_batches: int = 0) -> Dict[str, Any]:
+    conn = get_db_connection()
+    try:
+        if batch_size:
+            return accrue(conn, batch_size=batch_size, max_batches=max_batches)
+        return accrue(conn, max_batches=max_batches)
+    finally:
+        conn.close()
+
+
+@instrument('referrals')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Статистика реферера и запуск начисления комиссий
+    Args: event - dict с httpMethod, headers (X-Session-Token, X-Admin-Key), queryStringParameters (telegram_id, limit),
+                  body (action=accrue) или сообщение таймер-триггера с payload "accrue"
+          context - object с атрибутами request_id и др.
+    Returns: HTTP response dict
+    """
+    # Таймер-триггер с payload "accrue" начисляет комиссии по новым завершенным заявкам
+    if timer_payload(event) == 'accrue':
+        return {
+            'statusCode': 200,
+            'headers': JSON_HEADERS,
+            'body': json.dumps(run_accrual()),
+            'isBase64Encoded': False
+        }
+
+    method: str = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': CORS_HEADERS,
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method == 'GET':
+        params = event.get('queryStringParameters') or {}
+        session = session_from_event(event)
+        if not session and session_required():
+            return {
+                'statusCode': 401,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'Session token required'}),
+                'isBase64Encoded': False
+            }
+        telegram_id = session.telegram_id if session else params.get('telegram_id')
+        if not telegram_id:
+            return {
+                'statusCode': 400,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'telegram_id is required'}),
+                'isBase64Encoded': False
+            }
+        limit = min(int(params.get('limit', 20)), 100)
+
+        conn = get_db_connection(readonly=True, subject=telegram_id)
+        try:
+            user = session or resolve_user(conn, telegram_id)
+            row = None
+            if user:
+                cur = conn.cursor()
+                REFERRAL_STATS.execute(cur, (user.user_id, limit))
+                row = cur.fetchone()
+                cur.close()
+        finally:
+            conn.close()
+
+        if not row:
+            return {
+                'statusCode': 404,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'User not found'}),
+                'isBase64Encoded': False
+            }
+
+        referral_code, earnings, levels_json, commissions_count, recent_json = row
+        referrals_count = sum(level['count'] for level in json.loads(levels_json))
+        body = (
+            f'{{"referral_code":{json.dumps(referral_code)},"referral_earnings":{json.dumps(earnings)},'
+            f'"referrals_count":{referrals_count},"levels":{levels_json},'
+            f'"commissions_count":{int(commissions_count)},"recent_commissions":{recent_json}}}'
+        )
+        return {
+            'statusCode': 200,
+            'headers': JSON_HEADERS,
+            'body': body,
+            'isBase64Encoded': False
+        }
+
+    if method == 'POST':
+        body_data = json.loads(event.get('body') or '{}')
+        headers = event.get('headers') or {}
+        admin_key = headers.get('X-Admin-Key') or headers.get('x-admin-key')
+
+        if body_data.get('action') != 'accrue':
+            return {
+                'statusCode': 400,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'Unknown action'}),
+                'isBase64Encoded': False
+            }
+        if admin_key != os.environ.get('ADMIN_SECRET_KEY', 'admin123'):
+            return {
+                'statusCode': 403,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'Unauthorized'}),
+                'isBase64Encoded': False
+            }
+
+        summary = run_accrual(int(body_data.get('batch_size') or 0), int(body_data.get('max_batches') or 0))
+        return {
+            'statusCode': 200,
+            'headers': JSON_HEADERS,
+            'body': json.dumps(summary),
+            'isBase64Encoded': False
+        }
+
+    return {
+        'statusCode': 405,
+        'headers': JSON_HEADERS,
+        'body': json.dumps({'error': 'Method not allowed'}),
+        'isBase64Encoded': False
+    }
@@ -0,0 +1,385 @@
+"""
+Инструментирование обработчиков: время запроса, время и число SQL-запросов, число строк,
+время обращений к Telegram / Crypto Bot и размер ответа.
+Пишет структурированные JSON-логи и копит метрики в формате Prometheus.
+
+Модуль одинаковый во всех функциях backend/ — при правке обновляйте все копии.
+"""
+import functools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+SLOW_QUERY_SAMPLE_RATE = float(os.environ.get('SLOW_QUERY_SAMPLE_RATE', '1.0'))
+LOG_REQUESTS = os.environ.get('LOG_REQUESTS', '1') != '0'
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class RequestStats:
+    """Счетчики одного вызова обработчика"""
+    __slots__ = ('function', 'request_id', 'started', 'db_time', 'queries', 'rows',
+                 'upstream_time', 'upstream_calls')
+
+    def __init__(self, function: str, request_id: Optional[str]):
+        self.function = function
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.db_time = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.upstream_time = 0.0
+        self.upstream_calls = 0
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar('request_stats', default=None)
+_thread = threading.local()
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _current.get()
+
+
+def thread_query_count() -> int:
+    """Сколько SQL-запросов выполнено в текущем потоке с начала работы процесса"""
+    return getattr(_thread, 'queries', 0)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+    """Метрики процесса; под шлюзом общие для всех функций"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self.histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Histogram] = {}
+        self.help: Dict[str, Tuple[str, str]] = {}
+
+    def inc(self, name: str, labels: Dict[str, str], value: float = 1.0, help_text: str = '') -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.help.setdefault(name, ('counter', help_text))
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name: str, labels: Dict[str, str], value: float,
+                buckets: Tuple[float, ...] = DURATION_BUCKETS, help_text: str = '') -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.help.setdefault(name, ('histogram', help_text))
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus"""
+        def fmt_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+        lines: List[str] = []
+        with self.lock:
+            for name, (kind, help_text) in sorted(self.help.items()):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                if kind == 'counter':
+                    for (metric, labels), value in sorted(self.counters.items()):
+                        if metric == name:
+                            lines.append(f'{name}{fmt_labels(labels)} {value:g}')
+                    continue
+                for (metric, labels), h in sorted(self.histograms.items(), key=lambda kv: kv[0]):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(h.buckets, h.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{fmt_labels(labels, [("le", f"{bound:g}")])} {cumulative}')
+                    lines.append(f'{name}_bucket{fmt_labels(labels, [("le", "+Inf")])} {h.count}')
+                    lines.append(f'{name}_sum{fmt_labels(labels)} {h.total:g}')
+                    lines.append(f'{name}_count{fmt_labels(labels)} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def render_prometheus() -> str:
+    return REGISTRY.render()
+
+
+def log_event(event: str, **fields: Any) -> None:
+    """Одна строка JSON в stdout — так логи читает облачная платформа"""
+    stats = _current.get()
+    record = {'event': event, 'ts': round(time.time(), 3)}
+    if stats is not None:
+        record['function'] = stats.function
+        record['request_id'] = stats.request_id
+    record.update(fields)
+    sys.stdout.write(json.dumps(record, default=str, ensure_ascii=False) + '\n')
+    sys.stdout.flush()
+
+
+def record_query(elapsed: float, rows: int) -> None:
+    _thread.queries = getattr(_thread, 'queries', 0) + 1
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+        stats.rows += max(rows, 0)
+
+
+@contextmanager
+def upstream(service: str) -> Iterator[None]:
+    """Замер обращения к внешнему API: with upstream('telegram'): urlopen(...)"""
+    started = time.perf_counter()
+    status = 'ok'
+    try:
+        yield
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        stats = _current.get()
+        function = stats.function if stats is not None else ''
+        if stats is not None:
+            stats.upstream_time += elapsed
+            stats.upstream_calls += 1
+        REGISTRY.observe('upstream_request_duration_seconds', {'service': service, 'function': function},
+                         elapsed, help_text='Latency of calls to external APIs')
+        REGISTRY.inc('upstream_requests_total', {'service': service, 'status': status},
+                     help_text='Calls to external APIs')
+
+
+def _is_read_only(sql: str) -> bool:
+    head = sql.lstrip().lower()
+    if not (head.startswith('select') or head.startswith('with')):
+        return False
+    return not any(word in head for word in ('insert ', 'update ', 'delete ', 'for update'))
+
+
+def _explain_slow_query(conn, sql: str, elapsed: float) -> None:
+    """
+    EXPLAIN для медленного запроса на том же соединении.
+    ANALYZE выполняем только для чтения, чтобы не повторять запись; все — внутри SAVEPOINT,
+    чтобы ошибка EXPLAIN не сломала транзакцию обработчика
+    """
+    options = 'ANALYZE, BUFFERS, FORMAT JSON' if _is_read_only(sql) else 'FORMAT JSON'
+    cur = conn.cursor(raw=True)
+    use_savepoint = not conn.autocommit
+    try:
+        if use_savepoint:
+            cur.execute('SAVEPOINT slow_query_explain')
+        cur.execute(f'EXPLAIN ({options}) {sql}')
+        plan = cur.fetchone()[0]
+        if use_savepoint:
+            cur.execute('RELEASE SAVEPOINT slow_query_explain')
+        log_event('slow_query', duration_ms=round(elapsed * 1000, 2), sql=sql[:2000], plan=plan)
+    except Exception as e:
+        if use_savepoint:
+            try:
+                cur.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            except Exception:
+                pass
+        log_event('slow_query', duration_ms=round(elapsed * 1000, 2), sql=sql[:2000], explain_error=str(e))
+    finally:
+        cur.close()
+
+
+_cursor_classes: Dict[type, type] = {}
+_connection_class: Optional[type] = None
+
+
+def _instrumented_cursor(base: type) -> type:
+    cls = _cursor_classes.get(base)
+    if cls is not None:
+        return cls
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            result = base.execute(self, query, vars)
+        except Exception:
+            record_query(time.perf_counter() - started, 0)
+            raise
+        elapsed = time.perf_counter() - started
+        record_query(elapsed, self.rowcount)
+        if (elapsed * 1000 >= SLOW_QUERY_MS and self.name is None
+                and random.random() < SLOW_QUERY_SAMPLE_RATE and self.query):
+            sql = self.query.decode('utf-8', 'replace') if isinstance(self.query, bytes) else str(self.query)
+            _explain_slow_query(self.connection, sql, elapsed)
+        return result
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return base.executemany(self, query, vars_list)
+        finally:
+            record_query(time.perf_counter() - started, self.rowcount)
+
+    cls = type(f'Instrumented{base.__name__}', (base,), {'execute': execute, 'executemany': executemany})
+    _cursor_classes[base] = cls
+    return cls
+
+
+def connection_factory() -> type:
+    """Класс соединения psycopg2, чьи курсоры считают время и число запросов"""
+    global _connection_class
+    if _connection_class is None:
+        import psycopg2.extensions
+
+        class InstrumentedConnection(psycopg2.extensions.connection):
+            def cursor(self, *args, raw: bool = False, **kwargs):
+                if raw:
+                    return super().cursor()
+                base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+                kwargs['cursor_factory'] = _instrumented_cursor(base)
+                return super().cursor(*args, **kwargs)
+
+        _connection_class = InstrumentedConnection
+    return _connection_class
+
+
+def _response_size(response: Any) -> int:
+    if not isinstance(response, dict):
+        return 0
+    body = response.get('body') or ''
+    if not isinstance(body, str):
+        return len(body)
+    if response.get('isBase64Encoded'):
+        # Размер на проводе — после декодирования base64
+        return len(body) * 3 // 4 - body.count('=', -2)
+    return len(body.encode('utf-8'))
+
+
+_warmup_hooks: List[Tuple[str, Callable[[], Any]]] = []
+
+
+def on_warmup(name: str) -> Callable:
+    """
+    Регистрирует функцию прогрева: пул соединений, подготовленные запросы, кэши, отложенные импорты.
+    Хуки выполняются по порядку регистрации, то есть в порядке импорта модулей
+    """
+    def decorator(hook: Callable[[], Any]) -> Callable[[], Any]:
+        if all(existing != name for existing, _ in _warmup_hooks):
+            _warmup_hooks.append((name, hook))
+        return hook
+    return decorator
+
+
+def timer_payload(event: Dict[str, Any]) -> Optional[str]:
+    """payload сообщения таймер-триггера облачной функции; None — это не таймер"""
+    messages = event.get('messages') if isinstance(event, dict) else None
+    if not isinstance(messages, list) or not messages or not isinstance(messages[0], dict):
+        return None
+    metadata = messages[0].get('event_metadata') or {}
+    if not str(metadata.get('event_type', '')).endswith('TimerMessage'):
+        return None
+    return str((messages[0].get('details') or {}).get('payload') or '')
+
+
+def is_warmup(event: Dict[str, Any]) -> bool:
+    """{"warmup": true} или таймер-триггер без payload (или с payload "warmup")"""
+    if not isinstance(event, dict):
+        return False
+    if event.get('warmup'):
+        return True
+    return timer_payload(event) in ('', 'warmup')
+
+
+def run_warmup() -> Dict[str, Any]:
+    """Выполняет все хуки прогрева; ошибка одного хука не мешает остальным"""
+    results: Dict[str, Any] = {}
+    for name, hook in list(_warmup_hooks):
+        started = time.perf_counter()
+        try:
+            hook()
+            results[name] = {'ms': round((time.perf_counter() - started) * 1000, 2)}
+        except Exception as e:
+            results[name] = {'ms': round((time.perf_counter() - started) * 1000, 2), 'error': str(e)}
+        REGISTRY.inc('handler_warmup_total', {'hook': name, 'status': 'error' if 'error' in results[name] else 'ok'},
+                     help_text='Warm-up hook runs')
+    return results
+
+
+def instrument(function: str) -> Callable:
+    """Декоратор для handler(event, context): метрики и JSON-лог на каждый вызов"""
+    def decorator(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable:
+        @functools.wraps(handler)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if is_warmup(event):
+                # Прогрев не доходит до обработчика и не попадает в метрики запросов
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps({'function': function, 'warmup': run_warmup()}),
+                    'isBase64Encoded': False
+                }
+            stats = RequestStats(function, getattr(context, 'request_id', None))
+            token = _current.set(stats)
+            response: Any = None
+            status = 500
+            try:
+                response = handler(event, context)
+                if isinstance(response, dict):
+                    status = int(response.get('statusCode', 200))
+                return response
+            finally:
+                elapsed = time.perf_counter() - stats.started
+                size = _response_size(response)
+                labels = {'function': function}
+                REGISTRY.inc('handler_requests_total', {'function': function, 'status': str(status)},
+                             help_text='Handler invocations by status')
+                REGISTRY.observe('handler_duration_seconds', labels, elapsed,
+                                 help_text='Handler wall time')
+                REGISTRY.observe('handler_db_duration_seconds', labels, stats.db_time,
+                                 help_text='Time spent in SQL per invocation')
+                REGISTRY.inc('handler_db_queries_total', labels, stats.queries,
+                             help_text='SQL statements executed')
+                REGISTRY.inc('handler_db_rows_total', labels, stats.rows,
+                             help_text='Rows returned or affected by SQL statements')
+                REGISTRY.observe('handler_response_bytes', labels, size, buckets=SIZE_BUCKETS,
+                                 help_text='Response body size')
+                if LOG_REQUESTS:
+                    log_event(
+                        'request',
+                        method=event.get('httpMethod'),
+                        status=status,
+                        duration_ms=round(elapsed * 1000, 2),
+                        db_ms=round(stats.db_time * 1000, 2),
+                        queries=stats.queries,
+                        rows=stats.rows,
+                        upstream_ms=round(stats.upstream_time * 1000, 2),
+                        upstream_calls=stats.upstream_calls,
+                        response_bytes=size,
+                    )
+                _current.reset(token)
+        return wrapper
+    return decorator
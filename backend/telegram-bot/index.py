@@ -6,11 +6,14 @@ import os
 import urllib.request
 import urllib.parse
 from typing import Dict, Any, Optional
-import psycopg2
 from psycopg2.extras import RealDictCursor
+from db import get_db_connection
+from instrumentation import instrument, log_event, upstream
+from identity import CACHE, resolve_user
 
 BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
-BASE_URL = f'https://api.telegram.org/bot{BOT_TOKEN}'
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+BASE_URL = f'{TELEGRAM_API_URL}/bot{BOT_TOKEN}'
 
 def send_message(chat_id: int, text: str, parse_mode: str = 'HTML') -> bool:
     """Отправка сообщения через Telegram Bot API"""
@@ -28,13 +31,22 @@ def send_message(chat_id: int, text: str, parse_mode: str = 'HTML') -> bool:
     )
     
     try:
-        with urllib.request.urlopen(req) as response:
+        with upstream('telegram'), urllib.request.urlopen(req) as response:
             result = json.loads(response.read().decode('utf-8'))
             return result.get('ok', False)
     except Exception as e:
-        print(f"Error sending message: {e}")
+        log_event('telegram_send_failed', error=str(e))
         return False
 
+# Заголовки ответов собираются один раз при загрузке модуля
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type',
+    'Access-Control-Max-Age': '86400'
+}
+
+@instrument('telegram-bot')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Обработка webhook от Telegram и управление ботом
@@ -44,12 +56,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
+            'headers': CORS_HEADERS,
             'body': '',
             'isBase64Encoded': False
         }
@@ -66,7 +73,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             telegram_user = message['from']
             
             if text.startswith('/start'):
-                conn = psycopg2.connect(os.environ['DATABASE_URL'])
+                conn = get_db_connection()
                 cur = conn.cursor(cursor_factory=RealDictCursor)
                 
                 # Проверяем или создаем пользователя
@@ -88,6 +95,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     )
                 )
                 conn.commit()
+                CACHE.invalidate(telegram_id=telegram_user['id'])
                 
                 cur.close()
                 conn.close()
@@ -127,26 +135,30 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 )
                 
                 try:
-                    urllib.request.urlopen(req)
+                    with upstream('telegram'):
+                        urllib.request.urlopen(req)
                 except Exception as e:
-                    print(f"Error sending web app button: {e}")
+                    log_event('telegram_send_failed', error=str(e))
             
             elif text == '/wallets':
-                conn = psycopg2.connect(os.environ['DATABASE_URL'])
+                conn = get_db_connection()
                 cur = conn.cursor(cursor_factory=RealDictCursor)
                 
-                cur.execute(
-                    """
-                    SELECT w.*, c.symbol, c.name
-                    FROM wallets w
-                    JOIN currencies c ON w.currency_id = c.id
-                    JOIN users u ON w.user_id = u.id
-                    WHERE u.telegram_id = %s
-                    ORDER BY w.balance DESC
-                    """,
-                    (str(telegram_user['id']),)
-                )
-                wallets = cur.fetchall()
+                user = resolve_user(conn, telegram_user['id'])
+                wallets = []
+                
+                if user:
+                    cur.execute(
+                        """
+                        SELECT w.*, c.symbol, c.name
+                        FROM wallets w
+                        JOIN currencies c ON w.currency_id = c.id
+                        WHERE w.user_id = %s
+                        ORDER BY w.balance DESC
+                        """,
+                        (user.user_id,)
+                    )
+                    wallets = cur.fetchall()
                 
                 cur.close()
                 conn.close()
@@ -0,0 +1,139 @@
+"""
+Реестр подготовленных запросов для горячих SQL.
+
+Запрос готовится (PREPARE) один раз на соединение и дальше выполняется по имени (EXECUTE),
+так что Postgres не разбирает и не планирует его заново на каждый вызов. Список подготовленных
+имен хранится на самом соединении: новое соединение из пула готовит запросы заново.
+Если сервер потерял запрос или после ALTER TABLE план больше не подходит, запрос
+переподготавливается, а вызов повторяется, если транзакция еще не начата.
+
+Модуль одинаковый во всех функциях backend/ — при правке обновляйте все копии.
+"""
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Sequence
+
+import psycopg2
+import psycopg2.extensions
+
+from instrumentation import REGISTRY, on_warmup
+
+# invalid_sql_statement_name, feature_not_supported (cached plan must not change result type)
+REPREPARE_CODES = ('26000', '0A000')
+
+_PLACEHOLDER = re.compile(r'\$(\d+)')
+
+
+class Statement:
+    __slots__ = ('name', 'sql', 'params', 'execute_sql', 'count', 'total_time', 'prepares', 'lock')
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+        self.params = max((int(n) for n in _PLACEHOLDER.findall(sql)), default=0)
+        args = ', '.join(['%s'] * self.params)
+        self.execute_sql = f'EXECUTE {name} ({args})' if self.params else f'EXECUTE {name}'
+        self.count = 0
+        self.total_time = 0.0
+        self.prepares = 0
+        self.lock = threading.Lock()
+
+    def _prepare(self, cur) -> None:
+        cur.execute(f'PREPARE {self.name} AS {self.sql}')
+        cur.connection.prepared_statements.add(self.name)
+        with self.lock:
+            self.prepares += 1
+        REGISTRY.inc('db_statement_prepares_total', {'statement': self.name},
+                     help_text='PREPARE of registered statements')
+
+    def execute(self, cur, params: Sequence[Any] = ()) -> None:
+        """Выполняет запрос на курсоре cur; результат читается обычным fetchone / fetchall"""
+        conn = cur.connection
+        prepared = getattr(conn, 'prepared_statements', None)
+        if prepared is None:
+            prepared = conn.prepared_statements = set()
+
+        fresh_transaction = conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        if self.name not in prepared:
+            self._prepare(cur)
+
+        started = time.perf_counter()
+        try:
+            cur.execute(self.execute_sql, tuple(params))
+        except psycopg2.Error as e:
+            if e.pgcode not in REPREPARE_CODES:
+                raise
+            prepared.discard(self.name)
+            if not fresh_transaction or conn.autocommit:
+                # Транзакция обработчика уже прервана — следующий вызов подготовит запрос заново
+                raise
+            conn.rollback()
+            if e.pgcode == '0A000':
+                # Запрос на сервере есть, но его план устарел после смены схемы
+                cur.execute(f'DEALLOCATE {self.name}')
+            self._prepare(cur)
+            cur.execute(self.execute_sql, tuple(params))
+        elapsed = time.perf_counter() - started
+
+        with self.lock:
+            self.count += 1
+            self.total_time += elapsed
+        REGISTRY.observe('db_statement_duration_seconds', {'statement': self.name}, elapsed,
+                         help_text='Execution time of registered prepared statements')
+
+
+class StatementRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statements: Dict[str, Statement] = {}
+
+    def register(self, name: str, sql: str) -> Statement:
+        """Параметры в sql пишутся как $1, $2, ... — так их понимает PREPARE"""
+        with self.lock:
+            statement = self.statements.get(name)
+            if statement is None:
+                statement = self.statements[name] = Statement(name, sql)
+            elif statement.sql != sql:
+                raise ValueError(f'statement {name} is already registered with different SQL')
+            return statement
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {
+                'count': s.count,
+                'prepares': s.prepares,
+                'avg_ms': round(s.total_time / s.count * 1000, 3) if s.count else 0.0,
+            }
+            for name, s in self.statements.items()
+        }
+
+
+STATEMENTS = StatementRegistry()
+
+
+def prepared(name: str, sql: str) -> Statement:
+    return STATEMENTS.register(name, sql)
+
+
+@on_warmup('statements')
+def _warm_statements() -> None:
+    """PREPARE всех зарегистрированных запросов на соединении из пула"""
+    if not STATEMENTS.statements or not os.environ.get('DATABASE_URL'):
+        return
+    from db import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        names = getattr(cur.connection, 'prepared_statements', None)
+        if names is None:
+            names = cur.connection.prepared_statements = set()
+        for statement in list(STATEMENTS.statements.values()):
+            if statement.name not in names:
+                statement._prepare(cur)
+        cur.close()
+        conn.commit()
+    finally:
+        conn.close()
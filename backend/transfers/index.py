@@ -0,0 +1,223 @@
+"""
+Функция внутренних переводов между пользователями
+"""
+import json
+from typing import Dict, Any, Optional
+from decimal import Decimal, InvalidOperation
+from db import get_db_connection, note_write
+from instrumentation import instrument, timer_payload
+from identity import CACHE, UserIdentity, current_user, resolve_user
+from ratelimit import LIMITER
+from risk import RISK
+from session import session_from_event, session_required
+from rows import fetch_all, text_cursor
+from serializer import rows_json
+from statements import prepared
+from transfers import InsufficientFunds, flush_credits, transfer
+
+# Точность кошельков — DECIMAL(20, 8)
+AMOUNT_QUANTUM = Decimal('0.00000001')
+
+USER_TRANSFERS = prepared('user_transfers', '''
+    SELECT t.id, t.type, t.currency, t.amount, t.status, t.recipient_user_id, t.related_transaction_id,
+           t.created_at
+    FROM transactions t
+    WHERE t.user_id = $1 AND t.type IN ('transfer_out', 'transfer_in')
+    ORDER BY t.created_at DESC
+    LIMIT 50
+''')
+
+USER_BY_REFERRAL_CODE = prepared(
+    'user_by_referral_code', 'SELECT id, is_admin, is_blocked FROM users WHERE referral_code = $1'
+)
+
+# Заголовки ответов собираются один раз при загрузке модуля
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Telegram-User-Id, X-Session-Token, Authorization',
+    'Access-Control-Max-Age': '86400'
+}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+def resolve_recipient(conn, body_data: Dict[str, Any]) -> Optional[UserIdentity]:
+    """Получатель по to_telegram_id или to_referral_code; None — не найден"""
+    if body_data.get('to_telegram_id'):
+        return resolve_user(conn, body_data['to_telegram_id'])
+    cur = conn.cursor()
+    USER_BY_REFERRAL_CODE.execute(cur, (body_data['to_referral_code'],))
+    row = cur.fetchone()
+    cur.close()
+    return UserIdentity(*row) if row else None
+
+
+@instrument('transfers')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    # Таймер-триггер с payload "credit" зачисляет отложенные переводы горячим получателям
+    if timer_payload(event) == 'credit':
+        conn = get_db_connection()
+        try:
+            summary = flush_credits(conn)
+        finally:
+            conn.close()
+        return {
+            'statusCode': 200,
+            'headers': JSON_HEADERS,
+            'body': json.dumps(summary),
+            'isBase64Encoded': False
+        }
+
+    method: str = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': CORS_HEADERS,
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    session = session_from_event(event)
+
+    if not session and session_required():
+        return {
+            'statusCode': 401,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'Session token required'}),
+            'isBase64Encoded': False
+        }
+
+    if method == 'GET':
+        params = event.get('queryStringParameters') or {}
+        telegram_id = session.telegram_id if session else params.get('telegram_id')
+
+        if not telegram_id:
+            return {
+                'statusCode': 400,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'telegram_id is required'}),
+                'isBase64Encoded': False
+            }
+
+        conn = get_db_connection(readonly=True, subject=telegram_id)
+        user = session or resolve_user(conn, telegram_id)
+        transfers = []
+
+        if user:
+            cur = text_cursor(conn)
+            USER_TRANSFERS.execute(cur, (user.user_id,))
+            transfers = fetch_all(cur, 'transactions')
+            cur.close()
+
+        conn.close()
+
+        return {
+            'statusCode': 200,
+            'headers': JSON_HEADERS,
+            'body': rows_json(transfers),
+            'isBase64Encoded': False
+        }
+
+    if method == 'POST':
+        body_data = json.loads(event.get('body', '{}'))
+        telegram_id = session.telegram_id if session else body_data.get('telegram_id')
+        currency = body_data.get('currency')
+
+        try:
+            amount = Decimal(str(body_data.get('amount')))
+        except InvalidOperation:
+            amount = None
+
+        has_recipient = body_data.get('to_telegram_id') or body_data.get('to_referral_code')
+        if not telegram_id or not currency or amount is None or not has_recipient:
+            return {
+                'statusCode': 400,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({
+                    'error': 'telegram_id, currency, amount and to_telegram_id or to_referral_code are required'
+                }),
+                'isBase64Encoded': False
+            }
+
+        if not amount.is_finite() or amount <= 0 or amount != amount.quantize(AMOUNT_QUANTUM):
+            return {
+                'statusCode': 400,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'Invalid amount'}),
+                'isBase64Encoded': False
+            }
+
+        limited = LIMITER.check(event, 'transfers.create', telegram_id)
+        if limited:
+            return limited
+
+        conn = get_db_connection()
+        sender = current_user(conn, session, telegram_id)
+        recipient = resolve_recipient(conn, body_data)
+
+        if not sender or not recipient:
+            conn.close()
+            return {
+                'statusCode': 404,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'User not found'}),
+                'isBase64Encoded': False
+            }
+
+        if sender.is_blocked or recipient.is_blocked or sender.user_id == recipient.user_id:
+            conn.close()
+            return {
+                'statusCode': 403,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'Transfer not allowed'}),
+                'isBase64Encoded': False
+            }
+
+        # flag пишется в risk_events в одной транзакции с переводом; hold и block перевод отклоняют
+        decision = RISK.screen(conn, sender.user_id, 'transfer', currency, amount)
+        if decision.action in ('hold', 'block'):
+            conn.commit()
+            conn.close()
+            if decision.action == 'block':
+                CACHE.invalidate(user_id=sender.user_id)
+            return {
+                'statusCode': 423 if decision.action == 'hold' else 403,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({
+                    'error': 'Transfer held for review' if decision.action == 'hold' else 'User is blocked',
+                    'reasons': list(decision.reasons),
+                }),
+                'isBase64Encoded': False
+            }
+
+        try:
+            result = transfer(conn, sender.user_id, recipient.user_id, currency, amount)
+            RISK.checkpoint(conn)
+        except InsufficientFunds as e:
+            return {
+                'statusCode': 409,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': str(e)}),
+                'isBase64Encoded': False
+            }
+        finally:
+            conn.close()
+
+        note_write(telegram_id)
+        if body_data.get('to_telegram_id'):
+            note_write(body_data['to_telegram_id'])
+
+        return {
+            'statusCode': 201,
+            'headers': JSON_HEADERS,
+            'body': json.dumps(result),
+            'isBase64Encoded': False
+        }
+
+    return {
+        'statusCode': 405,
+        'headers': JSON_HEADERS,
+        'body': json.dumps({'error': 'Method not allowed'}),
+        'isBase64Encoded': False
+    }
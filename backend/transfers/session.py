@@ -0,0 +1,192 @@
+"""
+Подписанные сессионные токены и проверка initData Telegram WebApp.
+
+auth проверяет initData один раз и выдает компактный токен: user_id, telegram_id, флаги и срок действия,
+подписанные HMAC-SHA256. Остальные функции проверяют подпись без обращения к базе и держат
+небольшой кэш уже проверенных токенов.
+
+Модуль одинаковый во всех функциях backend/ — при правке обновляйте все копии.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional
+from urllib.parse import parse_qsl
+
+TOKEN_VERSION = 1
+# версия, user_id, telegram_id, флаги, срок действия (unix time)
+_PAYLOAD = struct.Struct('>BQqBI')
+_SIGNATURE_BYTES = 16
+FLAG_ADMIN = 1
+FLAG_BLOCKED = 2
+
+
+class Session(NamedTuple):
+    user_id: int
+    telegram_id: int
+    is_admin: bool
+    is_blocked: bool
+    expires_at: int
+
+
+def _secret() -> bytes:
+    secret = os.environ.get('SESSION_SECRET')
+    if secret:
+        return secret.encode()
+    # Без отдельного секрета выводим ключ из токена бота, чтобы не хранить его в токене напрямую
+    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
+    if bot_token:
+        return hmac.new(b'SessionSecret', bot_token.encode(), hashlib.sha256).digest()
+    return b''
+
+
+def session_ttl() -> int:
+    return int(os.environ.get('SESSION_TTL', '43200'))
+
+
+def session_required() -> bool:
+    """Если REQUIRE_SESSION_TOKEN=1, сырой telegram_id от клиента больше не принимается"""
+    return os.environ.get('REQUIRE_SESSION_TOKEN', '0') == '1'
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def issue_token(user_id: int, telegram_id: int, is_admin: bool = False, is_blocked: bool = False,
+                ttl: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """{'token': ..., 'expires_at': ...} или None, если секрет не настроен"""
+    secret = _secret()
+    if not secret:
+        return None
+    expires_at = int(time.time()) + (session_ttl() if ttl is None else ttl)
+    flags = (FLAG_ADMIN if is_admin else 0) | (FLAG_BLOCKED if is_blocked else 0)
+    payload = _PAYLOAD.pack(TOKEN_VERSION, int(user_id), int(telegram_id), flags, expires_at)
+    signature = hmac.new(secret, payload, hashlib.sha256).digest()[:_SIGNATURE_BYTES]
+    return {'token': _b64encode(payload + signature), 'expires_at': expires_at}
+
+
+class VerifiedTokens:
+    """LRU недавно проверенных токенов: повторный запрос с тем же токеном не считает HMAC"""
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries: 'OrderedDict[str, Session]' = OrderedDict()
+
+    def get(self, token: str) -> Optional[Session]:
+        with self.lock:
+            session = self.entries.get(token)
+            if session is not None:
+                self.entries.move_to_end(token)
+            return session
+
+    def put(self, token: str, session: Session) -> None:
+        with self.lock:
+            self.entries[token] = session
+            self.entries.move_to_end(token)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+VERIFIED = VerifiedTokens(int(os.environ.get('SESSION_CACHE_SIZE', '4096')))
+
+
+def verify_token(token: Optional[str]) -> Optional[Session]:
+    """Session для действующего токена, иначе None"""
+    if not token:
+        return None
+
+    now = time.time()
+    session = VERIFIED.get(token)
+    if session is not None:
+        return session if session.expires_at > now else None
+
+    secret = _secret()
+    if not secret:
+        return None
+    try:
+        raw = _b64decode(token)
+    except (ValueError, TypeError):
+        return None
+    if len(raw) != _PAYLOAD.size + _SIGNATURE_BYTES:
+        return None
+
+    payload, signature = raw[:_PAYLOAD.size], raw[_PAYLOAD.size:]
+    expected = hmac.new(secret, payload, hashlib.sha256).digest()[:_SIGNATURE_BYTES]
+    if not hmac.compare_digest(signature, expected):
+        return None
+
+    version, user_id, telegram_id, flags, expires_at = _PAYLOAD.unpack(payload)
+    if version != TOKEN_VERSION or expires_at <= now:
+        return None
+
+    session = Session(user_id, telegram_id, bool(flags & FLAG_ADMIN), bool(flags & FLAG_BLOCKED), expires_at)
+    VERIFIED.put(token, session)
+    return session
+
+
+def token_from_event(event: Dict[str, Any]) -> Optional[str]:
+    """Токен из X-Session-Token или Authorization: Bearer"""
+    headers = event.get('headers') or {}
+    for name, value in headers.items():
+        lower = name.lower()
+        if lower == 'x-session-token' and value:
+            return value.strip()
+        if lower == 'authorization' and value and value[:7].lower() == 'bearer ':
+            return value[7:].strip()
+    return None
+
+
+def session_from_event(event: Dict[str, Any]) -> Optional[Session]:
+    return verify_token(token_from_event(event))
+
+
+def validate_init_data(init_data: str, bot_token: str, max_age: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Проверка подписи initData Telegram WebApp:
+    secret = HMAC_SHA256("WebAppData", bot_token), hash = HMAC_SHA256(secret, data_check_string).
+    Возвращает поля initData (user уже разобран из JSON) или None
+    """
+    if not init_data or not bot_token:
+        return None
+
+    fields = dict(parse_qsl(init_data, keep_blank_values=True))
+    received_hash = fields.pop('hash', '')
+    if not received_hash:
+        return None
+
+    data_check_string = '\n'.join(f'{key}={fields[key]}' for key in sorted(fields))
+    secret = hmac.new(b'WebAppData', bot_token.encode(), hashlib.sha256).digest()
+    expected = hmac.new(secret, data_check_string.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, received_hash):
+        return None
+
+    if max_age is None:
+        max_age = int(os.environ.get('INIT_DATA_MAX_AGE', '86400'))
+    try:
+        auth_date = int(fields.get('auth_date', '0'))
+    except ValueError:
+        return None
+    if max_age and time.time() - auth_date > max_age:
+        return None
+
+    try:
+        fields['user'] = json.loads(fields['user']) if fields.get('user') else None
+    except ValueError:
+        return None
+    return fields
@@ -0,0 +1,249 @@
+"""
+Внутренние переводы между пользователями: списание с кошелька отправителя и зачисление получателю
+одним запросом, пара строк transactions (transfer_out / transfer_in) и уведомления обеим сторонам.
+
+Порядок блокировок: перевод ждет только блокировку кошелька отправителя. Кошелек получателя берется
+FOR UPDATE SKIP LOCKED — если его держит другая транзакция (горячий получатель, например мерчант),
+перевод не ждет, а ставит зачисление в очередь: transfer_in остается pending. Следующий перевод,
+которому блокировка досталась, зачисляет свою сумму вместе со всей очередью получателя одним UPDATE.
+Счетчики user_stats для строк переводов ведет этот же запрос, а не построчный триггер: строка отправителя
+обновляется всегда, строка получателя — только вместе с зачислением на его кошелек (за ту же блокировку),
+обе одним INSERT по возрастанию user_id. Ожидания — кошелек отправителя и строки user_stats в одном порядке,
+поэтому взаимоблокировок нет, а параллельные переводы одному получателю не выстраиваются в очередь ни на его
+кошельке, ни на его строке user_stats.
+
+Остаток очереди, если переводы получателю прекратились, зачисляет flush_credits: таймер с payload "credit"
+или
+
+    python transfers.py --flush
+"""
+import argparse
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+FLUSH_BATCH_SIZE = 500
+
+TRANSFER_SQL = """
+    WITH sender AS (
+        SELECT id, balance FROM wallets
+        WHERE user_id = %(sender)s AND currency = %(currency)s
+        FOR UPDATE
+    ),
+    debited AS (
+        UPDATE wallets w
+        SET balance = w.balance - %(amount)s, updated_at = CURRENT_TIMESTAMP
+        FROM sender s
+        WHERE w.id = s.id AND s.balance >= %(amount)s
+        RETURNING w.balance
+    ),
+    recipient AS (
+        SELECT id FROM wallets
+        WHERE user_id = %(recipient)s AND currency = %(currency)s AND EXISTS (SELECT 1 FROM debited)
+        FOR UPDATE SKIP LOCKED
+    ),
+    out_tx AS (
+        INSERT INTO transactions (user_id, type, currency, amount, status, recipient_user_id)
+        SELECT %(sender)s, 'transfer_out', %(currency)s, %(amount)s, 'completed', %(recipient)s
+        FROM debited
+        RETURNING id
+    ),
+    in_tx AS (
+        INSERT INTO transactions (user_id, type, currency, amount, status, recipient_user_id, related_transaction_id)
+        SELECT %(recipient)s, 'transfer_in', %(currency)s, %(amount)s,
+               CASE WHEN EXISTS (SELECT 1 FROM recipient) THEN 'completed' ELSE 'pending' END,
+               %(recipient)s, o.id
+        FROM out_tx o
+        RETURNING id, status
+    ),
+    flushed AS (
+        UPDATE transactions t
+        SET status = 'completed', updated_at = CURRENT_TIMESTAMP
+        FROM recipient r
+        WHERE t.user_id = %(recipient)s AND t.currency = %(currency)s
+          AND t.type = 'transfer_in' AND t.status = 'pending'
+        RETURNING t.amount
+    ),
+    credited AS (
+        UPDATE wallets w
+        SET balance = w.balance + %(amount)s + COALESCE((SELECT SUM(amount) FROM flushed), 0),
+            updated_at = CURRENT_TIMESTAMP
+        FROM recipient r
+        WHERE w.id = r.id
+        RETURNING w.id
+    ),
+    notified AS (
+        INSERT INTO notifications (user_id, type, title, message)
+        SELECT %(sender)s, 'transfer', 'Перевод отправлен',
+               'Вы перевели ' || %(amount)s || ' ' || %(currency)s
+        FROM out_tx
+        UNION ALL
+        SELECT %(recipient)s, 'transfer', 'Входящий перевод',
+               'Вам переведено ' || %(amount)s || ' ' || %(currency)s
+        FROM out_tx
+    ),
+    -- Получатель учитывает свой transfer_in и зачисленную очередь; отложенный transfer_in — при зачислении
+    stats AS (
+        INSERT INTO user_stats (user_id, transactions_count, last_activity_at)
+        SELECT user_id, SUM(n), CURRENT_TIMESTAMP
+        FROM (
+            SELECT %(sender)s::bigint AS user_id, 1::bigint AS n FROM out_tx
+            UNION ALL
+            SELECT %(recipient)s::bigint, 1 + (SELECT COUNT(*) FROM flushed) FROM recipient
+        ) s
+        GROUP BY user_id
+        ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET transactions_count = user_stats.transactions_count + EXCLUDED.transactions_count,
+            last_activity_at = GREATEST(user_stats.last_activity_at, EXCLUDED.last_activity_at)
+    )
+    SELECT (SELECT COUNT(*) FROM sender) AS found,
+           (SELECT id FROM out_tx) AS transfer_id,
+           (SELECT status FROM in_tx) AS credit_status,
+           (SELECT balance FROM debited) AS balance,
+           (SELECT COUNT(*) FROM flushed) AS flushed,
+           (SELECT COUNT(*) FROM credited) AS credited,
+           EXISTS (SELECT 1 FROM wallets WHERE user_id = %(recipient)s AND currency = %(currency)s) AS has_wallet
+"""
+
+# Получатель без кошелька в этой валюте: кошелек создается при зачислении очереди
+ENSURE_WALLETS_SQL = """
+    INSERT INTO wallets (user_id, currency)
+    SELECT DISTINCT t.user_id, t.currency
+    FROM transactions t
+    WHERE t.type = 'transfer_in' AND t.status = 'pending'
+      AND (%(user_id)s::bigint IS NULL OR t.user_id = %(user_id)s)
+      AND (%(currency)s::text IS NULL OR t.currency = %(currency)s)
+      AND NOT EXISTS (SELECT 1 FROM wallets w WHERE w.user_id = t.user_id AND w.currency = t.currency)
+    ON CONFLICT (user_id, currency) DO NOTHING
+"""
+
+# Кошельки, занятые переводами, пропускаются — их очередь зачислит тот перевод
+FLUSH_SQL = """
+    WITH locked AS (
+        SELECT w.id, w.user_id, w.currency
+        FROM wallets w
+        WHERE (w.user_id, w.currency) IN (
+            SELECT user_id, currency FROM transactions
+            WHERE type = 'transfer_in' AND status = 'pending'
+              AND (%(user_id)s::bigint IS NULL OR user_id = %(user_id)s)
+              AND (%(currency)s::text IS NULL OR currency = %(currency)s)
+        )
+        ORDER BY w.id
+        LIMIT %(batch_size)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    flushed AS (
+        UPDATE transactions t
+        SET status = 'completed', updated_at = CURRENT_TIMESTAMP
+        FROM locked l
+        WHERE t.user_id = l.user_id AND t.currency = l.currency
+          AND t.type = 'transfer_in' AND t.status = 'pending'
+        RETURNING l.id AS wallet_id, l.user_id, t.amount
+    ),
+    credited AS (
+        UPDATE wallets w
+        SET balance = w.balance + f.total, updated_at = CURRENT_TIMESTAMP
+        FROM (SELECT wallet_id, SUM(amount) AS total FROM flushed GROUP BY wallet_id) f
+        WHERE w.id = f.wallet_id
+        RETURNING w.id
+    ),
+    stats AS (
+        INSERT INTO user_stats (user_id, transactions_count, last_activity_at)
+        SELECT user_id, COUNT(*), CURRENT_TIMESTAMP FROM flushed
+        GROUP BY user_id
+        ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET transactions_count = user_stats.transactions_count + EXCLUDED.transactions_count,
+            last_activity_at = GREATEST(user_stats.last_activity_at, EXCLUDED.last_activity_at)
+    )
+    SELECT (SELECT COUNT(*) FROM credited), (SELECT COUNT(*) FROM flushed)
+"""
+
+
+class InsufficientFunds(ValueError):
+    """У отправителя нет кошелька в этой валюте или на нем не хватает средств"""
+
+
+def transfer(conn, sender_id: int, recipient_id: int, currency: str, amount: Any) -> Dict[str, Any]:
+    """
+    Переводит amount со своего кошелька получателю и фиксирует транзакцию.
+    credit_status — completed (зачислено сразу) или pending (зачисление в очереди получателя)
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(TRANSFER_SQL, {
+            'sender': sender_id, 'recipient': recipient_id, 'currency': currency, 'amount': amount,
+        })
+        found, transfer_id, credit_status, balance, flushed, _, has_wallet = cur.fetchone()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    if transfer_id is None:
+        conn.rollback()
+        raise InsufficientFunds('Insufficient funds' if found else f'No {currency} wallet')
+    conn.commit()
+
+    if not has_wallet:
+        flush_credits(conn, recipient_id, currency)
+    return {
+        'transfer_id': transfer_id,
+        'currency': currency,
+        'amount': str(amount),
+        'balance': str(balance),
+        'credit_status': credit_status,
+        'flushed': flushed,
+    }
+
+
+def flush_credits(conn, user_id: Optional[int] = None, currency: Optional[str] = None,
+                  batch_size: int = FLUSH_BATCH_SIZE) -> Dict[str, Any]:
+    """Зачисляет отложенные переводы на кошельки получателей пачками по batch_size кошельков"""
+    summary: Dict[str, Any] = {'wallets': 0, 'credits': 0}
+    started = time.perf_counter()
+    params = {'user_id': user_id, 'currency': currency, 'batch_size': batch_size}
+    cur = conn.cursor()
+    try:
+        cur.execute(ENSURE_WALLETS_SQL, params)
+        conn.commit()
+        while True:
+            cur.execute(FLUSH_SQL, params)
+            wallets, credits = cur.fetchone()
+            conn.commit()
+            summary['wallets'] += wallets
+            summary['credits'] += credits
+            if wallets < batch_size:
+                break
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Зачисление отложенных внутренних переводов')
+    parser.add_argument('--flush', action='store_true', help='зачислить все отложенные переводы')
+    parser.add_argument('--batch-size', type=int, default=FLUSH_BATCH_SIZE)
+    args = parser.parse_args(argv)
+    if not args.flush:
+        parser.error('укажите --flush')
+
+    from db import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        summary = flush_credits(conn, batch_size=args.batch_size)
+    finally:
+        conn.close()
+    print(summary, file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -2,67 +2,87 @@
 Функция управления кошельками пользователя
 """
 import json
-import os
 from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from db import get_db_connection
+from instrumentation import instrument
+from identity import resolve_user
+from session import session_from_event, session_required
+from rows import fetch_all, text_cursor
+from serializer import rows_json
+from statements import prepared
 
+WALLETS_BY_USER = prepared('wallets_by_user', '''
+    SELECT w.*, $1::bigint AS telegram_id
+    FROM wallets w
+    WHERE w.user_id = $2
+    ORDER BY w.currency
+''')
+
+# Заголовки ответов собираются один раз при загрузке модуля
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Telegram-User-Id, X-Session-Token, Authorization',
+    'Access-Control-Max-Age': '86400'
+}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+@instrument('wallets')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Telegram-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
+            'headers': CORS_HEADERS,
             'body': '',
             'isBase64Encoded': False
         }
     
     if method == 'GET':
         params = event.get('queryStringParameters') or {}
-        telegram_id = params.get('telegram_id')
+        session = session_from_event(event)
+        telegram_id = session.telegram_id if session else params.get('telegram_id')
+        
+        if not session and session_required():
+            return {
+                'statusCode': 401,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'Session token required'}),
+                'isBase64Encoded': False
+            }
         
         if not telegram_id:
             return {
                 'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': JSON_HEADERS,
                 'body': json.dumps({'error': 'telegram_id is required'}),
                 'isBase64Encoded': False
             }
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+        conn = get_db_connection(readonly=True, subject=telegram_id)
+        # Проверенный токен уже содержит user_id — в users не ходим
+        user = session or resolve_user(conn, telegram_id)
+        wallets = []
         
-        cur.execute(
-            """
-            SELECT w.*, u.telegram_id
-            FROM wallets w
-            JOIN users u ON w.user_id = u.id
-            WHERE u.telegram_id = %s
-            ORDER BY w.currency
-            """,
-            (telegram_id,)
-        )
-        wallets = cur.fetchall()
+        if user:
+            cur = text_cursor(conn)
+            WALLETS_BY_USER.execute(cur, (telegram_id, user.user_id))
+            wallets = fetch_all(cur, 'wallets')
+            cur.close()
         
-        cur.close()
         conn.close()
         
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps([dict(w) for w in wallets], default=str),
+            'headers': JSON_HEADERS,
+            'body': rows_json(wallets),
             'isBase64Encoded': False
         }
     
     return {
         'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'headers': JSON_HEADERS,
         'body': json.dumps({'error': 'Method not allowed'}),
         'isBase64Encoded': False
     }
@@ -0,0 +1,196 @@
+"""
+Функция вывода средств: заявки на вывод и обработчик выплат через Crypto Bot
+"""
+import json
+import os
+from typing import Dict, Any
+from decimal import Decimal, InvalidOperation
+from db import get_db_connection, note_write
+from instrumentation import instrument, timer_payload
+from identity import resolve_user
+from payouts import run_payouts
+from ratelimit import LIMITER
+from session import session_from_event, session_required
+from rows import fetch_all, fetch_one, text_cursor
+from serializer import row_json, rows_json
+from statements import prepared
+
+WITHDRAWAL_ASSETS = tuple(
+    asset.strip() for asset in os.environ.get('WITHDRAWAL_ASSETS', 'USDT,TON,BTC,ETH').split(',') if asset.strip()
+)
+
+USER_WITHDRAWALS = prepared('user_withdrawals', '''
+    SELECT t.id, t.currency, t.amount, t.status, t.crypto_address, t.tx_hash, t.payout_error,
+           t.created_at, t.processed_at
+    FROM transactions t
+    WHERE t.user_id = $1 AND t.type = 'withdrawal'
+    ORDER BY t.created_at DESC
+    LIMIT 50
+''')
+
+# Сумма списывается с кошелька при создании заявки — выплата уже не может увести баланс в минус.
+# Если средств не хватает, списание ничего не обновляет и заявка не создается
+CREATE_WITHDRAWAL_SQL = '''
+    WITH debited AS (
+        UPDATE wallets
+        SET balance = balance - %(amount)s, updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = %(user_id)s AND currency = %(currency)s AND balance >= %(amount)s
+        RETURNING user_id
+    )
+    INSERT INTO transactions (user_id, type, currency, amount, status, crypto_address)
+    SELECT user_id, 'withdrawal', %(currency)s, %(amount)s, 'pending', %(crypto_address)s
+    FROM debited
+    RETURNING id, currency, amount, status, crypto_address, created_at
+'''
+
+# Заголовки ответов собираются один раз при загрузке модуля
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Telegram-User-Id, X-Session-Token, Authorization',
+    'Access-Control-Max-Age': '86400'
+}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+@instrument('withdrawals')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    # Таймер-триггер с payload "payout" отправляет накопившиеся выводы
+    if timer_payload(event) == 'payout':
+        conn = get_db_connection()
+        try:
+            summary = run_payouts(conn)
+        finally:
+            conn.close()
+        return {
+            'statusCode': 200,
+            'headers': JSON_HEADERS,
+            'body': json.dumps(summary),
+            'isBase64Encoded': False
+        }
+
+    method: str = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': CORS_HEADERS,
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    session = session_from_event(event)
+
+    if not session and session_required():
+        return {
+            'statusCode': 401,
+            'headers': JSON_HEADERS,
+            'body': json.dumps({'error': 'Session token required'}),
+            'isBase64Encoded': False
+        }
+
+    if method == 'GET':
+        params = event.get('queryStringParameters') or {}
+        telegram_id = session.telegram_id if session else params.get('telegram_id')
+
+        if not telegram_id:
+            return {
+                'statusCode': 400,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'telegram_id is required'}),
+                'isBase64Encoded': False
+            }
+
+        conn = get_db_connection(readonly=True, subject=telegram_id)
+        user = session or resolve_user(conn, telegram_id)
+        withdrawals = []
+
+        if user:
+            cur = text_cursor(conn)
+            USER_WITHDRAWALS.execute(cur, (user.user_id,))
+            withdrawals = fetch_all(cur, 'transactions')
+            cur.close()
+
+        conn.close()
+
+        return {
+            'statusCode': 200,
+            'headers': JSON_HEADERS,
+            'body': rows_json(withdrawals),
+            'isBase64Encoded': False
+        }
+
+    if method == 'POST':
+        body_data = json.loads(event.get('body', '{}'))
+        telegram_id = session.telegram_id if session else body_data.get('telegram_id')
+        currency = body_data.get('currency')
+
+        try:
+            amount = Decimal(str(body_data.get('amount')))
+        except InvalidOperation:
+            amount = None
+
+        if not telegram_id or not currency or amount is None:
+            return {
+                'statusCode': 400,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'telegram_id, currency and amount are required'}),
+                'isBase64Encoded': False
+            }
+
+        if currency not in WITHDRAWAL_ASSETS or not amount.is_finite() or amount <= 0:
+            return {
+                'statusCode': 400,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'Invalid currency or amount'}),
+                'isBase64Encoded': False
+            }
+
+        limited = LIMITER.check(event, 'withdrawals.create', telegram_id)
+        if limited:
+            return limited
+
+        conn = get_db_connection()
+        user = session or resolve_user(conn, telegram_id)
+
+        if not user:
+            conn.close()
+            return {
+                'statusCode': 404,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'User not found'}),
+                'isBase64Encoded': False
+            }
+
+        cur = text_cursor(conn)
+        cur.execute(CREATE_WITHDRAWAL_SQL, {
+            'user_id': user.user_id, 'currency': currency, 'amount': amount,
+            'crypto_address': body_data.get('crypto_address'),
+        })
+        withdrawal = fetch_one(cur, 'transactions')
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        if not withdrawal:
+            return {
+                'statusCode': 409,
+                'headers': JSON_HEADERS,
+                'body': json.dumps({'error': 'Insufficient funds'}),
+                'isBase64Encoded': False
+            }
+
+        note_write(telegram_id)
+
+        return {
+            'statusCode': 201,
+            'headers': JSON_HEADERS,
+            'body': row_json(withdrawal),
+            'isBase64Encoded': False
+        }
+
+    return {
+        'statusCode': 405,
+        'headers': JSON_HEADERS,
+        'body': json.dumps({'error': 'Method not allowed'}),
+        'isBase64Encoded': False
+    }
@@ -0,0 +1,267 @@
+"""
+Обработчик выплат: отправка ожидающих выводов через transfer Crypto Bot.
+
+Каждый проход захватывает пачку выводов (FOR UPDATE SKIP LOCKED, статус processing фиксируется сразу),
+группирует ее по валюте, сверяет сумму группы с балансом приложения (один getBalance на проход) и отправляет
+переводы не более чем в PAYOUT_CONCURRENCY потоков. spend_id перевода — "wd-<id вывода>", поэтому повторная
+отправка того же вывода Crypto Bot не исполнит дважды. Результаты пишутся обратно одним запросом на исход:
+выполненные (tx_hash = transfer_id), отложенные, повторяемые и отклоненные — с возвратом суммы на кошелек.
+
+Сумма возвращается только после явного отказа Crypto Bot (ok: false на 4xx). Если исход перевода неизвестен
+(сеть, таймаут, 5xx, 429), аренда снимается и вывод сразу возвращается в очередь: повторный перевод с тем же
+spend_id безопасен. Вывод упавшего обработчика остается в processing и снова попадает в очередь через
+PAYOUT_LEASE_SECONDS. Несколько узлов могут работать одновременно.
+
+    python payouts.py --max-batches 10
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from instrumentation import REGISTRY, log_event, upstream
+
+PAYOUT_BATCH_SIZE = int(os.environ.get('PAYOUT_BATCH_SIZE', '200'))
+PAYOUT_CONCURRENCY = int(os.environ.get('PAYOUT_CONCURRENCY', '8'))
+PAYOUT_LEASE_SECONDS = int(os.environ.get('PAYOUT_LEASE_SECONDS', '300'))
+
+# Ответы Crypto Bot, означающие, что перевод с этим spend_id уже исполнен
+ALREADY_SENT_ERRORS = ('SPEND_ID_ALREADY_USED',)
+
+CLAIM_SQL = """
+    UPDATE transactions t
+    SET status = 'processing',
+        payout_attempts = t.payout_attempts + 1,
+        updated_at = CURRENT_TIMESTAMP
+    FROM (
+        SELECT id FROM transactions
+        WHERE type = 'withdrawal'
+          AND (status = 'pending'
+               OR (status = 'processing' AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %(lease)s)))
+        ORDER BY id
+        LIMIT %(batch_size)s
+        FOR UPDATE SKIP LOCKED
+    ) claimed, users u
+    WHERE t.id = claimed.id AND u.id = t.user_id
+    RETURNING t.id, t.user_id, u.telegram_id, t.currency, t.amount, t.payout_attempts
+"""
+
+COMPLETE_SQL = """
+    WITH done AS (
+        UPDATE transactions t
+        SET status = 'completed', tx_hash = r.tx_hash, payout_error = NULL,
+            processed_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        FROM unnest(%s::bigint[], %s::text[]) AS r(id, tx_hash)
+        WHERE t.id = r.id AND t.status = 'processing'
+        RETURNING t.id, t.user_id, t.currency, t.amount
+    ),
+    -- Выплаченное покидает хранение
+    paid_out AS (
+        UPDATE liquidity_reserves r
+        SET holdings = r.holdings - d.total, updated_at = CURRENT_TIMESTAMP
+        FROM (SELECT currency, SUM(amount) AS total FROM done GROUP BY currency) d
+        WHERE r.currency = d.currency
+    )
+    INSERT INTO notifications (user_id, type, title, message)
+    SELECT user_id, 'withdrawal', 'Вывод выполнен', 'Вывод #' || id || ': ' || amount || ' ' || currency || ' отправлен'
+    FROM done
+"""
+
+# Исход неизвестен: аренда снимается, повтор уйдет с тем же spend_id
+RETRY_SQL = """
+    UPDATE transactions t
+    SET status = 'pending', payout_error = r.error, updated_at = CURRENT_TIMESTAMP
+    FROM unnest(%s::bigint[], %s::text[]) AS r(id, error)
+    WHERE t.id = r.id AND t.status = 'processing'
+"""
+
+# Не отправлялся: сразу возвращается в очередь
+DEFER_SQL = """
+    UPDATE transactions t
+    SET status = 'pending', payout_error = r.error, updated_at = CURRENT_TIMESTAMP
+    FROM unnest(%s::bigint[], %s::text[]) AS r(id, error)
+    WHERE t.id = r.id AND t.status = 'processing'
+"""
+
+FAIL_SQL = """
+    WITH failed AS (
+        UPDATE transactions t
+        SET status = 'failed', payout_error = r.error,
+            processed_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        FROM unnest(%s::bigint[], %s::text[]) AS r(id, error)
+        WHERE t.id = r.id AND t.status = 'processing'
+        RETURNING t.id, t.user_id, t.currency, t.amount
+    ),
+    refunded AS (
+        UPDATE wallets w
+        SET balance = w.balance + f.total, updated_at = CURRENT_TIMESTAMP
+        FROM (SELECT user_id, currency, SUM(amount) AS total FROM failed GROUP BY user_id, currency) f
+        WHERE w.user_id = f.user_id AND w.currency = f.currency
+    )
+    INSERT INTO notifications (user_id, type, title, message)
+    SELECT user_id, 'withdrawal', 'Вывод отклонен', 'Вывод #' || id || ' не выполнен, средства возвращены на кошелек'
+    FROM failed
+"""
+
+
+class CryptoBotError(Exception):
+    """Crypto Bot ответил ok: false на 4xx — повтор того же запроса результата не изменит"""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.name = name
+
+
+def api_call(method: str, payload: Optional[Dict[str, Any]] = None) -> Any:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+
+    base_url = os.environ.get('CRYPTO_BOT_API_URL', 'https://pay.crypt.bot/api')
+    headers = {'Crypto-Pay-API-Token': os.environ.get('CRYPTO_BOT_API_TOKEN', ''), 'Content-Type': 'application/json'}
+    data = json.dumps(payload).encode() if payload is not None else None
+    request = Request(f'{base_url}/{method}', data=data, headers=headers, method='POST' if data else 'GET')
+    try:
+        with upstream('crypto_bot'), urlopen(request, timeout=10) as response:
+            result = json.loads(response.read().decode())
+    except HTTPError as e:
+        # 5xx и 429 не означают отказа: перевод мог пройти или будет принят позже
+        if e.code >= 500 or e.code == 429:
+            raise
+        # Ошибки API приходят с 4xx и тем же JSON в теле
+        try:
+            result = json.loads(e.read().decode())
+        except ValueError:
+            raise e
+    if not result.get('ok'):
+        error = result.get('error') or {}
+        raise CryptoBotError((error.get('name') or str(error)) if isinstance(error, dict) else str(error))
+    return result['result']
+
+
+def spend_id(withdrawal_id: int) -> str:
+    return f'wd-{withdrawal_id}'
+
+
+def available_balances() -> Dict[str, Decimal]:
+    return {item['currency_code']: Decimal(str(item['available'])) for item in api_call('getBalance')}
+
+
+def _send(withdrawal: Tuple) -> Tuple[int, str, str]:
+    """(id, результат, tx_hash или текст ошибки); результат — sent, retry или failed"""
+    withdrawal_id, _, telegram_id, currency, amount, _ = withdrawal
+    try:
+        transfer = api_call('transfer', {
+            'user_id': telegram_id, 'asset': currency, 'amount': str(amount),
+            'spend_id': spend_id(withdrawal_id), 'comment': f'Вывод #{withdrawal_id}',
+        })
+        return withdrawal_id, 'sent', str(transfer.get('transfer_id'))
+    except CryptoBotError as e:
+        if e.name in ALREADY_SENT_ERRORS:
+            return withdrawal_id, 'sent', ''
+        return withdrawal_id, 'failed', e.name
+    except Exception as e:
+        # Сеть, таймаут, 5xx или 429: исход перевода неизвестен — повторяем с тем же spend_id
+        return withdrawal_id, 'retry', f'{type(e).__name__}: {e}'
+
+
+def _write_back(conn, results: List[Tuple[int, str, str]]) -> None:
+    grouped: Dict[str, Tuple[List[int], List[str]]] = {
+        outcome: ([], []) for outcome in ('sent', 'retry', 'deferred', 'failed')
+    }
+    for withdrawal_id, outcome, detail in results:
+        ids, details = grouped[outcome]
+        ids.append(withdrawal_id)
+        details.append(detail)
+
+    cur = conn.cursor()
+    for outcome, sql in (('sent', COMPLETE_SQL), ('retry', RETRY_SQL), ('deferred', DEFER_SQL), ('failed', FAIL_SQL)):
+        ids, details = grouped[outcome]
+        if ids:
+            cur.execute(sql, (ids, details))
+    cur.close()
+    conn.commit()
+
+
+def run_payouts(conn, batch_size: int = PAYOUT_BATCH_SIZE, max_batches: int = 0,
+                concurrency: int = PAYOUT_CONCURRENCY, lease_seconds: int = PAYOUT_LEASE_SECONDS) -> Dict[str, Any]:
+    """Проходы захват → отправка → запись результатов, пока очередь не опустеет; max_batches=0 — без ограничения"""
+    # Пул потоков нужен только таймеру выплат — HTTP-вызовы функции его не загружают
+    from concurrent.futures import ThreadPoolExecutor
+
+    summary: Dict[str, Any] = {'batches': 0, 'sent': 0, 'retry': 0, 'failed': 0, 'deferred': 0}
+    started = time.perf_counter()
+    balances: Optional[Dict[str, Decimal]] = None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while not max_batches or summary['batches'] < max_batches:
+            cur = conn.cursor()
+            cur.execute(CLAIM_SQL, {'lease': lease_seconds, 'batch_size': batch_size})
+            claimed = cur.fetchall()
+            cur.close()
+            conn.commit()
+            if not claimed:
+                break
+            summary['batches'] += 1
+
+            if balances is None:
+                balances = available_balances()
+
+            by_asset: Dict[str, List[Tuple]] = defaultdict(list)
+            for withdrawal in claimed:
+                by_asset[withdrawal[3]].append(withdrawal)
+
+            # Выводы сверх баланса приложения в этом проходе не отправляются и возвращаются в очередь
+            to_send: List[Tuple] = []
+            deferred: List[Tuple[int, str, str]] = []
+            for asset, group in by_asset.items():
+                budget = balances.get(asset, Decimal(0))
+                for withdrawal in group:
+                    if withdrawal[4] <= budget:
+                        budget -= withdrawal[4]
+                        to_send.append(withdrawal)
+                    else:
+                        deferred.append((withdrawal[0], 'deferred', f'Insufficient {asset} app balance'))
+                balances[asset] = budget
+
+            sent = list(pool.map(_send, to_send))
+            _write_back(conn, sent + deferred)
+
+            for _, outcome, _ in sent:
+                summary[outcome] += 1
+                REGISTRY.inc('payouts_total', {'outcome': outcome}, help_text='Withdrawal payouts by outcome')
+            summary['deferred'] += len(deferred)
+            if deferred:
+                log_event('payouts_deferred', count=len(deferred))
+            # Проход без выполненных и отклоненных выводов (Crypto Bot недоступен, баланса нет) не повторяется:
+            # вернувшиеся в очередь выводы иначе захватывались бы снова тем же проходом
+            if len(claimed) < batch_size or not any(outcome in ('sent', 'failed') for _, outcome, _ in sent):
+                break
+
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Отправка ожидающих выводов через Crypto Bot')
+    parser.add_argument('--batch-size', type=int, default=PAYOUT_BATCH_SIZE)
+    parser.add_argument('--max-batches', type=int, default=0)
+    parser.add_argument('--concurrency', type=int, default=PAYOUT_CONCURRENCY)
+    args = parser.parse_args(argv)
+
+    from db import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        summary = run_payouts(conn, args.batch_size, args.max_batches, args.concurrency)
+    finally:
+        conn.close()
+    print(summary, file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
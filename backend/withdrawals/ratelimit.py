@@ -0,0 +1,259 @@
+"""
+Ограничение частоты запросов: token bucket в памяти процесса по telegram_id, IP и маршруту.
+
+Правило маршрута задает лимиты для областей user, ip и global в виде N/секунды. Проверка — пара
+операций со словарем под блокировкой, без обращения к базе. Превышение лимита — ответ 429 с Retry-After.
+
+При RATE_LIMIT_BACKEND=postgres области из RATE_LIMIT_SHARED_SCOPES (по умолчанию global) считаются
+общими для всех контейнеров: контейнер забирает из UNLOGGED-таблицы rate_limit_windows порцию токенов
+текущего окна и расходует ее локально, так что в базу уходит один запрос на порцию, а не на каждый вызов.
+Лимиты user и ip остаются локальными для контейнера.
+
+RATE_LIMITS переопределяет правила: "exchange.create:user=10/60,ip=30/60;auth.signup:ip=5/600",
+RATE_LIMITS=off отключает ограничение.
+
+Модуль одинаковый во всех функциях backend/ — при правке обновляйте все копии.
+"""
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from instrumentation import REGISTRY, log_event
+
+DEFAULT_RULES = (
+    'exchange.create:user=10/60,ip=60/60,global=600/60;'
+    'notifications.create:user=30/60,ip=120/60;'
+    'auth.login:ip=60/60;'
+    'auth.signup:ip=10/600,global=300/60;'
+    'withdrawals.create:user=5/60,ip=30/60;'
+    'transfers.create:user=30/60,ip=120/60'
+)
+
+SCOPES = ('user', 'ip', 'global')
+MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '50000'))
+LEASE_FRACTION = float(os.environ.get('RATE_LIMIT_LEASE_FRACTION', '0.1'))
+
+RESERVE_SQL = """
+    INSERT INTO rate_limit_windows (key, window_id, used, expires_at)
+    VALUES (%s, %s, %s, to_timestamp(%s))
+    ON CONFLICT (key, window_id) DO UPDATE SET used = rate_limit_windows.used + EXCLUDED.used
+    RETURNING used
+"""
+
+CLEANUP_SQL = 'DELETE FROM rate_limit_windows WHERE expires_at < now()'
+
+
+class Limit(NamedTuple):
+    count: int
+    period: float
+
+
+def parse_rules(spec: str) -> Dict[str, Dict[str, Limit]]:
+    """"route:scope=N/sec,...;route:..." -> {route: {scope: Limit}}"""
+    rules: Dict[str, Dict[str, Limit]] = {}
+    for part in spec.split(';'):
+        route, _, limits = part.strip().partition(':')
+        if not route or not limits:
+            continue
+        rule = rules.setdefault(route.strip(), {})
+        for item in limits.split(','):
+            scope, _, value = item.strip().partition('=')
+            count, _, period = value.partition('/')
+            if scope in SCOPES and count:
+                rule[scope] = Limit(int(count), float(period or 1))
+    return rules
+
+
+class TokenBuckets:
+    """Корзины одной области одного маршрута: ключ -> [токены, время пополнения]"""
+
+    def __init__(self, limit: Limit):
+        self.capacity = float(limit.count)
+        self.rate = limit.count / limit.period
+        self.lock = threading.Lock()
+        self.buckets: Dict[str, List[float]] = {}
+
+    def take(self, key: str, now: float) -> float:
+        """0 — токен выдан, иначе через сколько секунд он появится"""
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= MAX_KEYS:
+                    self._prune(now)
+                bucket = self.buckets[key] = [self.capacity, now]
+            else:
+                bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1.0:
+                bucket[0] -= 1.0
+                return 0.0
+            return (1.0 - bucket[0]) / self.rate
+
+    def _prune(self, now: float) -> None:
+        # Полные к этому моменту корзины ничем не отличаются от новых
+        full = [k for k, (tokens, updated) in self.buckets.items()
+                if tokens + (now - updated) * self.rate >= self.capacity]
+        for key in full:
+            del self.buckets[key]
+        if len(self.buckets) >= MAX_KEYS:
+            self.buckets.clear()
+
+
+class PostgresWindows:
+    """Общий счетчик окна в rate_limit_windows; соединение берется из пула процесса"""
+
+    def reserve(self, key: str, window_id: int, expires_at: float, amount: int, limit: int) -> int:
+        """Сколько токенов из amount удалось забрать в окне"""
+        from db import POOL
+
+        conn = POOL.acquire()
+        try:
+            cur = conn.cursor(raw=True)
+            cur.execute(RESERVE_SQL, (key, window_id, amount, expires_at))
+            used = cur.fetchone()[0]
+            if random.random() < 0.01:
+                cur.execute(CLEANUP_SQL)
+            cur.close()
+            conn.commit()
+        finally:
+            conn.close()
+        # Счетчик растет атомарно: used - amount — значение до нашего увеличения
+        return max(0, min(amount, limit - (used - amount)))
+
+
+class SharedWindow:
+    """Фиксированные окна общего лимита, расходуемые локально порциями"""
+
+    def __init__(self, route: str, scope: str, limit: Limit, backend: PostgresWindows):
+        self.prefix = f'{route}:{scope}:'
+        self.limit = limit
+        self.lease = max(1, int(limit.count * LEASE_FRACTION))
+        self.backend = backend
+        self.lock = threading.Lock()
+        # ключ -> [окно, оставшиеся токены порции, окно исчерпано]
+        self.leases: Dict[str, List[Any]] = {}
+
+    def take(self, key: str, now: float) -> float:
+        wall = time.time()
+        window_id = int(wall // self.limit.period)
+        window_end = (window_id + 1) * self.limit.period
+        with self.lock:
+            lease = self.leases.get(key)
+            if lease is not None and lease[0] == window_id:
+                if lease[1] > 0:
+                    lease[1] -= 1
+                    return 0.0
+                if lease[2]:
+                    return window_end - wall
+
+        try:
+            granted = self.backend.reserve(self.prefix + key, window_id, window_end + self.limit.period,
+                                           self.lease, self.limit.count)
+        except Exception as e:
+            # Недоступная база не должна останавливать прием заявок — пропускаем запрос
+            REGISTRY.inc('rate_limit_backend_errors_total', {}, help_text='Failed shared rate limit reservations')
+            log_event('rate_limit_backend_failed', error=str(e))
+            return 0.0
+
+        with self.lock:
+            if len(self.leases) >= MAX_KEYS:
+                self.leases.clear()
+            if granted > 0:
+                self.leases[key] = [window_id, granted - 1, False]
+                return 0.0
+            self.leases[key] = [window_id, 0, True]
+        return window_end - wall
+
+
+class RateLimiter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.configured: Optional[Tuple[str, str, str]] = None
+        self.rules: Dict[str, Dict[str, Limit]] = {}
+        self.limiters: Dict[Tuple[str, str], Any] = {}
+
+    def _configure(self) -> None:
+        config = (
+            os.environ.get('RATE_LIMITS', DEFAULT_RULES),
+            os.environ.get('RATE_LIMIT_BACKEND', 'memory'),
+            os.environ.get('RATE_LIMIT_SHARED_SCOPES', 'global'),
+        )
+        if config == self.configured:
+            return
+        with self.lock:
+            if config == self.configured:
+                return
+            spec, backend, shared = config
+            self.rules = {} if spec.strip().lower() in ('off', '0', '') else parse_rules(spec)
+            shared_scopes = {s.strip() for s in shared.split(',')} if backend == 'postgres' else set()
+            windows = PostgresWindows() if shared_scopes else None
+            self.limiters = {
+                (route, scope): SharedWindow(route, scope, limit, windows) if scope in shared_scopes
+                else TokenBuckets(limit)
+                for route, rule in self.rules.items()
+                for scope, limit in rule.items()
+            }
+            self.configured = config
+
+    def retry_after(self, route: str, user: Any = None, ip: Optional[str] = None) -> Tuple[float, str]:
+        """(0, '') — запрос разрешен; иначе секунды до следующей попытки и сработавшая область"""
+        self._configure()
+        rule = self.rules.get(route)
+        if not rule:
+            return 0.0, ''
+        now = time.monotonic()
+        for scope in SCOPES:
+            if scope not in rule:
+                continue
+            if scope == 'user':
+                if user is None:
+                    continue
+                key = str(user)
+            elif scope == 'ip':
+                if not ip:
+                    continue
+                key = ip
+            else:
+                key = ''
+            wait = self.limiters[(route, scope)].take(key, now)
+            if wait > 0:
+                return wait, scope
+        return 0.0, ''
+
+    def check(self, event: Dict[str, Any], route: str, user: Any = None) -> Optional[Dict[str, Any]]:
+        """None — можно выполнять запрос, иначе готовый ответ 429"""
+        wait, scope = self.retry_after(route, user, client_ip(event))
+        if wait <= 0:
+            return None
+        REGISTRY.inc('rate_limited_total', {'route': route, 'scope': scope},
+                     help_text='Requests rejected by rate limits')
+        retry_after = max(1, math.ceil(wait))
+        return {
+            'statusCode': 429,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': 'Retry-After',
+                'Retry-After': str(retry_after)
+            },
+            'body': json.dumps({'error': 'Too many requests', 'retry_after': retry_after}),
+            'isBase64Encoded': False
+        }
+
+
+def client_ip(event: Dict[str, Any]) -> Optional[str]:
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    ip = identity.get('sourceIp')
+    if ip:
+        return ip
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == 'x-forwarded-for' and value:
+            return value.split(',')[0].strip()
+    return None
+
+
+LIMITER = RateLimiter()
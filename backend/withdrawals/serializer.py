@@ -0,0 +1,32 @@
+"""
+Сериализация ответов без default-колбэка: строки из rows.py содержат только str, int, bool и None.
+Если установлен orjson, используется он (JSON_SERIALIZER=json принудительно включает стандартный модуль).
+
+Модуль одинаковый во всех функциях backend/ — при правке обновляйте все копии.
+"""
+import json
+import os
+from typing import Any, Iterable, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+USE_ORJSON = orjson is not None and os.environ.get('JSON_SERIALIZER', 'orjson') != 'json'
+
+_encode = json.JSONEncoder(ensure_ascii=True).encode
+
+
+def dumps(value: Any) -> str:
+    if USE_ORJSON:
+        return orjson.dumps(value).decode('utf-8')
+    return _encode(value)
+
+
+def rows_json(rows: Iterable[Any]) -> str:
+    return dumps([row._asdict() for row in rows])
+
+
+def row_json(row: Optional[Any]) -> str:
+    return dumps(row._asdict() if row is not None else None)
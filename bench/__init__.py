@@ -0,0 +1,3 @@
+"""
+Нагрузочные и end-to-end бенчмарки обработчиков backend/ на локальном Postgres
+"""
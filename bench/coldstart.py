@@ -0,0 +1,165 @@
+"""
+Холодный старт функций backend/: каждая функция запускается в отдельном процессе, как новый
+контейнер облачной функции. Замеряется импорт index.py (и самые дорогие модули по -X importtime),
+первый вызов (OPTIONS, без базы) и, если задан --dsn, прогрев {"warmup": true}.
+
+    python -m bench.coldstart                         # сравнить с bench/coldstart_budget.json
+    python -m bench.coldstart --update-budget         # записать текущие значения как бюджет
+    python -m bench.coldstart --dsn $BENCH_DATABASE_URL wallets exchange
+
+Выход с кодом 1, если медиана импорта или первого вызова вышла за бюджет больше чем на
+--tolerance (доля) и --slack-ms (абсолютный запас на шум). База для проверки бюджета не нужна.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, 'backend')
+BUDGET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'coldstart_budget.json')
+
+BUDGET_KEYS = ('import_ms', 'first_call_ms')
+
+# Выполняется в дочернем процессе: argv = каталог функции, флаг прогрева
+CHILD = r'''
+import json, sys, time, types
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import index
+imported = time.perf_counter()
+context = types.SimpleNamespace(request_id='coldstart', function_name='coldstart')
+event = {'httpMethod': 'OPTIONS', 'headers': {}, 'queryStringParameters': {}, 'body': '', 'isBase64Encoded': False}
+index.handler(event, context)
+called = time.perf_counter()
+result = {'import_ms': (imported - started) * 1000, 'first_call_ms': (called - imported) * 1000}
+if sys.argv[2] == '1':
+    response = index.handler({'warmup': True}, context)
+    result['warmup_ms'] = (time.perf_counter() - called) * 1000
+    result['warmup'] = json.loads(response['body']).get('warmup')
+print(json.dumps(result))
+'''
+
+
+def discover_functions() -> List[str]:
+    return sorted(
+        name for name in os.listdir(BACKEND_DIR)
+        if os.path.isfile(os.path.join(BACKEND_DIR, name, 'index.py'))
+    )
+
+
+def parse_importtime(stderr: str, top: int = 5) -> List[Dict[str, Any]]:
+    """Самые дорогие модули по собственному времени импорта"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            _, self_us, cumulative_us, name = (part.strip() for part in line.replace('import time:', '|').split('|'))
+        except ValueError:
+            continue
+        entries.append({'module': name, 'self_ms': int(self_us) / 1000, 'cumulative_ms': int(cumulative_us) / 1000})
+    entries.sort(key=lambda e: e['self_ms'], reverse=True)
+    return [{k: round(v, 2) if isinstance(v, float) else v for k, v in e.items()} for e in entries[:top]]
+
+
+def run_once(function: str, dsn: Optional[str]) -> Dict[str, Any]:
+    env = {k: v for k, v in os.environ.items() if k != 'DATABASE_URL'}
+    env['LOG_REQUESTS'] = '0'
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    if dsn:
+        env['DATABASE_URL'] = dsn
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD, os.path.join(BACKEND_DIR, function), '1' if dsn else '0'],
+        capture_output=True, text=True, env=env, cwd=ROOT_DIR, timeout=60,
+    )
+    if proc.returncode != 0:
+        tail = proc.stderr.strip().splitlines()[-1:] or ['']
+        raise RuntimeError(f'{function}: exit {proc.returncode}: {tail[0]}')
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['top_imports'] = parse_importtime(proc.stderr)
+    return result
+
+
+def measure(function: str, runs: int, dsn: Optional[str]) -> Dict[str, Any]:
+    # Первый запуск пишет __pycache__ и в замер не входит
+    run_once(function, None)
+    samples = [run_once(function, dsn) for _ in range(runs)]
+    result: Dict[str, Any] = {
+        key: round(statistics.median(s[key] for s in samples), 2)
+        for key in ('import_ms', 'first_call_ms', 'warmup_ms') if key in samples[0]
+    }
+    result['top_imports'] = samples[-1]['top_imports']
+    if 'warmup' in samples[-1]:
+        result['warmup'] = samples[-1]['warmup']
+    return result
+
+
+def compare(results: Dict[str, Dict[str, Any]], budget: Dict[str, Dict[str, float]],
+            tolerance: float, slack_ms: float) -> List[str]:
+    failures = []
+    for function, result in results.items():
+        limits = budget.get(function)
+        if not limits:
+            continue
+        for key in BUDGET_KEYS:
+            if key not in limits:
+                continue
+            allowed = limits[key] * (1 + tolerance) + slack_ms
+            if result[key] > allowed:
+                failures.append(f'{function}.{key}: {result[key]:.1f} ms > {allowed:.1f} ms (budget {limits[key]:.1f})')
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Холодный старт функций backend/')
+    parser.add_argument('functions', nargs='*', help='какие функции замерить (по умолчанию все)')
+    parser.add_argument('--runs', type=int, default=5, help='запусков на функцию, берется медиана')
+    parser.add_argument('--dsn', help='замерить и прогрев пула, подготовленных запросов и кэшей')
+    parser.add_argument('--budget', default=BUDGET_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.5, help='допустимый рост относительно бюджета')
+    parser.add_argument('--slack-ms', type=float, default=5.0, help='абсолютный запас на шум измерений')
+    parser.add_argument('--update-budget', action='store_true')
+    parser.add_argument('--output', help='сохранить результаты в JSON')
+    args = parser.parse_args(argv)
+
+    results = {name: measure(name, args.runs, args.dsn) for name in (args.functions or discover_functions())}
+
+    print(f"{'function':<18} {'import ms':>10} {'first call':>11} {'warmup ms':>10}  slowest imports")
+    for name, r in results.items():
+        warmup = f"{r['warmup_ms']:>10.1f}" if 'warmup_ms' in r else f"{'-':>10}"
+        slowest = ', '.join(f"{i['module']} {i['self_ms']:.1f}" for i in r['top_imports'][:3])
+        print(f"{name:<18} {r['import_ms']:>10.1f} {r['first_call_ms']:>11.2f} {warmup}  {slowest}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if args.update_budget:
+        budget = {}
+        if os.path.exists(args.budget):
+            with open(args.budget) as f:
+                budget = json.load(f)
+        for name, r in results.items():
+            budget[name] = {key: r[key] for key in BUDGET_KEYS}
+        with open(args.budget, 'w') as f:
+            json.dump(budget, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'[coldstart] budget saved to {args.budget}')
+        return 0
+
+    budget = {}
+    if os.path.exists(args.budget):
+        with open(args.budget) as f:
+            budget = json.load(f)
+    failures = compare(results, budget, args.tolerance, args.slack_ms)
+    for failure in failures:
+        print(f'[coldstart] REGRESSION {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
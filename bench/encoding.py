@@ -0,0 +1,108 @@
+"""
+Размер ответа на проводе и цена кодирования для списков: JSON, колоночный JSON и MessagePack,
+каждый без сжатия, с gzip и с brotli (если установлены msgpack и brotli).
+
+    python -m bench.encoding                                # синтетические строки, без базы
+    python -m bench.encoding --dsn $BENCH_DATABASE_URL      # плюс реальные страницы из засеянной базы
+"""
+import argparse
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+from bench.serialization import (
+    EXCHANGE_DIR, NOTIFICATION_COLUMNS, ORDER_COLUMNS, _time, synthetic_notifications, synthetic_orders,
+)
+
+# Страницы, которые отдают списочные эндпоинты
+DB_QUERIES = {
+    'admin_orders': ('exchange_orders', """
+        SELECT eo.*, u.telegram_id, u.username, u.first_name
+        FROM exchange_orders eo JOIN users u ON eo.user_id = u.id
+        ORDER BY eo.created_at DESC LIMIT 100
+    """),
+    'admin_transactions': ('transactions', """
+        SELECT t.*, u.telegram_id, u.username
+        FROM transactions t JOIN users u ON t.user_id = u.id
+        ORDER BY t.created_at DESC LIMIT 50
+    """),
+    'rates_list': ('exchange_rates', 'SELECT * FROM exchange_rates ORDER BY from_currency, to_currency'),
+}
+
+
+def _load_encoding():
+    sys.path.insert(0, EXCHANGE_DIR)
+    try:
+        import encoding
+        import rows
+    finally:
+        sys.path.remove(EXCHANGE_DIR)
+    return encoding, rows
+
+
+def measure(encoding_module, rows: List[Any], min_seconds: float) -> Dict[str, Dict[str, float]]:
+    """Для каждой пары формат/сжатие: байты на проводе и мкс на кодирование"""
+    formats = ['json', 'columnar'] + (['msgpack'] if encoding_module.msgpack is not None else [])
+    compressions = [None, 'gzip'] + (['br'] if encoding_module.brotli is not None else [])
+
+    results: Dict[str, Dict[str, float]] = {}
+    for fmt in formats:
+        body, _ = encoding_module.encode_rows(rows, fmt)
+        raw = body if isinstance(body, bytes) else body.encode('utf-8')
+        encode_us = _time(lambda: encoding_module.encode_rows(rows, fmt), min_seconds)
+        for compression in compressions:
+            if compression is None:
+                wire, compress_us = len(raw), 0.0
+            else:
+                wire = len(encoding_module.compress(raw, compression))
+                compress_us = _time(lambda: encoding_module.compress(raw, compression), min_seconds)
+            results[f'{fmt}+{compression or "identity"}'] = {
+                'bytes': wire,
+                'encode_us': round(encode_us + compress_us, 2),
+            }
+    return results
+
+
+def check_encoding(dsn: Optional[str] = None, min_seconds: float = 0.2) -> Dict[str, Dict[str, float]]:
+    encoding_module, rows_module = _load_encoding()
+    results: Dict[str, Dict[str, float]] = {}
+
+    cases = [
+        ('synthetic.exchange_orders', 'exchange_orders', ORDER_COLUMNS, synthetic_orders(100)[1]),
+        ('synthetic.notifications', 'notifications', NOTIFICATION_COLUMNS, synthetic_notifications(50)[1]),
+    ]
+    for name, table, columns, text in cases:
+        make = rows_module.row_type(table, columns)._make
+        for variant, result in measure(encoding_module, [make(r) for r in text], min_seconds).items():
+            results[f'{name}.{variant}'] = result
+
+    if dsn:
+        import psycopg2
+        conn = psycopg2.connect(dsn)
+        try:
+            for name, (table, sql) in DB_QUERIES.items():
+                cur = rows_module.text_cursor(conn)
+                cur.execute(sql)
+                page = rows_module.fetch_all(cur, table)
+                cur.close()
+                for variant, result in measure(encoding_module, page, min_seconds).items():
+                    results[f'db.{name}.{variant}'] = result
+        finally:
+            conn.close()
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Размер и цена кодирования списочных ответов')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--min-seconds', type=float, default=0.2, help='время замера каждого варианта')
+    args = parser.parse_args()
+
+    print(f"{'case':<52} {'bytes':>9} {'encode us':>10}")
+    for name, r in check_encoding(args.dsn, args.min_seconds).items():
+        print(f"{name:<52} {r['bytes']:>9} {r['encode_us']:>10.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
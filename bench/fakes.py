@@ -0,0 +1,147 @@
+"""
+Локальные заглушки Telegram Bot API и Crypto Bot API для бенчмарков.
+
+Один HTTP-сервер обслуживает оба API:
+    /bot<token>/<method>  — Telegram Bot API  (TELEGRAM_API_URL=http://127.0.0.1:<port>)
+    /api/<method>         — Crypto Bot API    (CRYPTO_BOT_API_URL=http://127.0.0.1:<port>/api)
+
+transfer идемпотентен по spend_id, как настоящий Crypto Bot: повторный перевод возвращает исходный и не
+списывает сумму второй раз. drop_rate — доля переводов, после исполнения которых клиент получает 502
+вместо ответа (исход для клиента неизвестен).
+"""
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeApiServer:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency_ms: float = 0.0, drop_rate: float = 0.0):
+        self.latency = latency_ms / 1000.0
+        self.drop_rate = drop_rate
+        self.calls: Counter = Counter()
+        self.transfers: Dict[str, Dict[str, Any]] = {}
+        self.repeated_transfers = 0
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakeApiServer':
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='fake-api', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def env(self) -> Dict[str, str]:
+        """Переменные окружения, направляющие обработчики на заглушки"""
+        return {
+            'TELEGRAM_API_URL': self.url,
+            'TELEGRAM_BOT_TOKEN': 'bench:token',
+            'CRYPTO_BOT_API_URL': f'{self.url}/api',
+            'CRYPTO_BOT_API_TOKEN': 'bench:crypto-bot-token',
+        }
+
+    def telegram(self, method: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if method == 'sendMessage':
+            return {'ok': True, 'result': {'message_id': next(self.ids), 'chat': {'id': payload.get('chat_id')}}}
+        return {'ok': True, 'result': True}
+
+    def crypto_bot(self, method: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if method == 'getMe':
+            return {'ok': True, 'result': {'app_id': 1, 'name': 'bench', 'payment_processing_bot_username': 'CryptoBot'}}
+        if method == 'createInvoice':
+            invoice_id = next(self.ids)
+            return {'ok': True, 'result': {
+                'invoice_id': invoice_id, 'status': 'active', 'asset': payload.get('asset'),
+                'amount': payload.get('amount'), 'pay_url': f'https://t.me/CryptoBot?start=IV{invoice_id}',
+            }}
+        if method == 'getInvoices':
+            return {'ok': True, 'result': {'items': []}}
+        if method == 'getBalance':
+            return {'ok': True, 'result': [
+                {'currency_code': asset, 'available': '1000000000'} for asset in ('USDT', 'TON', 'BTC', 'ETH')
+            ]}
+        if method == 'transfer':
+            key = payload.get('spend_id') or f'anonymous-{next(self.ids)}'
+            with self.lock:
+                transfer = self.transfers.get(key)
+                if transfer is None:
+                    transfer = self.transfers[key] = {
+                        'transfer_id': next(self.ids), 'user_id': payload.get('user_id'),
+                        'asset': payload.get('asset'), 'amount': payload.get('amount'),
+                        'status': 'completed', 'spend_id': payload.get('spend_id'),
+                    }
+                else:
+                    self.repeated_transfers += 1
+            if self.drop_rate and random.random() < self.drop_rate:
+                return None
+            return {'ok': True, 'result': transfer}
+        return {'ok': True, 'result': []}
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _payload(self) -> Dict[str, Any]:
+                parts = urlsplit(self.path)
+                payload = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    payload.update(json.loads(self.rfile.read(length) or b'{}'))
+                return payload
+
+            def _respond(self):
+                path = urlsplit(self.path).path.strip('/')
+                payload = self._payload()
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                if path.startswith('bot'):
+                    method = path.split('/', 1)[-1]
+                    with fake.lock:
+                        fake.calls[f'telegram.{method}'] += 1
+                    result = fake.telegram(method, payload)
+                elif path.startswith('api/'):
+                    method = path.split('/', 1)[-1]
+                    with fake.lock:
+                        fake.calls[f'crypto_bot.{method}'] += 1
+                    result = fake.crypto_bot(method, payload)
+                else:
+                    result = {'ok': False, 'error': 'not found'}
+
+                # None — запрос исполнен, но ответ "потерялся"; шлюз отвечает 502 с JSON-ошибкой API
+                if result is None:
+                    result, status = {'ok': False, 'error': {'code': 502, 'name': 'BAD_GATEWAY'}}, 502
+                else:
+                    status = 200
+                body = json.dumps(result).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = _respond
+            do_POST = _respond
+
+        return Handler
@@ -0,0 +1,191 @@
+"""
+Общая часть бенчмарков: загрузка обработчиков, подсчет SQL-запросов и замер задержек
+"""
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from gateway.server import Context, build_event, load_handler  # noqa: E402
+
+
+def query_count() -> int:
+    """SQL-запросы текущего потока по счетчикам модуля instrumentation обработчиков"""
+    instrumentation = sys.modules.get('instrumentation')
+    return instrumentation.thread_query_count() if instrumentation else 0
+
+
+class Handlers:
+    """Обработчики backend/, загруженные в текущий процесс"""
+
+    def __init__(self, names: List[str]):
+        self.handlers = {name: load_handler(name) for name in names}
+
+    def invoke(self, function: str, method: str, target: str, body: Any = None,
+               headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        payload = b'' if body is None else json.dumps(body).encode()
+        request_id = str(uuid.uuid4())
+        event = build_event(method, target, headers or {}, payload, ('127.0.0.1', 0), request_id)
+        return self.handlers[function](event, Context(request_id=request_id, function_name=function))
+
+    def trigger(self, function: str, payload: str) -> Dict[str, Any]:
+        """Срабатывание таймер-триггера с payload, как его присылает облако"""
+        request_id = str(uuid.uuid4())
+        event = {'messages': [{
+            'event_metadata': {'event_type': 'yandex.cloud.events.serverless.triggers.TimerMessage'},
+            'details': {'payload': payload},
+        }]}
+        return self.handlers[function](event, Context(request_id=request_id, function_name=function))
+
+
+class ScenarioError(Exception):
+    pass
+
+
+def expect(response: Dict[str, Any], *statuses: int) -> Any:
+    """Проверяет статус ответа и возвращает разобранное тело"""
+    status = response.get('statusCode')
+    if status not in statuses:
+        raise ScenarioError(f'unexpected status {status}: {str(response.get("body"))[:200]}')
+    body = response.get('body')
+    if response.get('isBase64Encoded') or not body:
+        return body
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body
+
+
+@dataclass
+class Scenario:
+    name: str
+    run: Callable[['RunContext'], None]
+    # Сценарии, которые пишут много данных, гоняем меньше
+    weight: float = 1.0
+
+
+@dataclass
+class RunContext:
+    handlers: Handlers
+    users: int
+    base_telegram_id: int
+    max_notification_id: int = 0
+    new_ids: Any = field(default_factory=lambda: itertools.count(5_000_000_000 + int(time.time()) * 1000))
+    rng_local: threading.local = field(default_factory=threading.local)
+
+    @property
+    def rng(self):
+        import random
+        if not hasattr(self.rng_local, 'rng'):
+            self.rng_local.rng = random.Random(threading.get_ident())
+        return self.rng_local.rng
+
+    def random_telegram_id(self) -> int:
+        return self.base_telegram_id + self.rng.randint(1, self.users)
+
+    def new_telegram_id(self) -> int:
+        return next(self.new_ids)
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    count: int
+    errors: int
+    duration: float
+    latencies: List[float]
+    queries: int
+    first_error: Optional[str] = None
+
+    def percentile(self, pct: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct))] * 1000
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'rps': round(self.count / self.duration, 1) if self.duration else 0.0,
+            'p50_ms': round(self.percentile(0.50), 3),
+            'p95_ms': round(self.percentile(0.95), 3),
+            'p99_ms': round(self.percentile(0.99), 3),
+            'queries_per_op': round(self.queries / self.count, 2) if self.count else 0.0,
+        }
+
+
+def run_scenario(ctx: RunContext, scenario: Scenario, duration: float, concurrency: int,
+                 warmup: int = 5) -> ScenarioResult:
+    for _ in range(warmup):
+        try:
+            scenario.run(ctx)
+        except Exception:
+            pass
+
+    deadline = time.perf_counter() + duration * scenario.weight
+    lock = threading.Lock()
+    latencies: List[float] = []
+    totals = {'count': 0, 'errors': 0, 'queries': 0}
+    first_error: List[str] = []
+
+    def worker() -> None:
+        local_latencies = []
+        count = errors = queries = 0
+        while time.perf_counter() < deadline:
+            before = query_count()
+            started = time.perf_counter()
+            try:
+                scenario.run(ctx)
+            except Exception as e:
+                errors += 1
+                if not first_error:
+                    first_error.append(f'{type(e).__name__}: {e}')
+            local_latencies.append(time.perf_counter() - started)
+            queries += query_count() - before
+            count += 1
+        with lock:
+            latencies.extend(local_latencies)
+            totals['count'] += count
+            totals['errors'] += errors
+            totals['queries'] += queries
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    elapsed = time.perf_counter() - started
+
+    return ScenarioResult(
+        name=scenario.name, count=totals['count'], errors=totals['errors'], duration=elapsed,
+        latencies=latencies, queries=totals['queries'], first_error=first_error[0] if first_error else None,
+    )
+
+
+def compare_with_baseline(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+                          tolerance: float) -> List[str]:
+    """Список регрессий относительно сохраненного baseline"""
+    failures = []
+    for name, current in results.items():
+        if current.get('errors'):
+            failures.append(f'{name}: {current["errors"]} errors')
+        base = baseline.get(name)
+        if not base:
+            continue
+        if 'p95_ms' in base and current.get('p95_ms', 0) > base['p95_ms'] * (1 + tolerance):
+            failures.append(f'{name}: p95 {current["p95_ms"]}ms > baseline {base["p95_ms"]}ms (+{tolerance:.0%})')
+        if 'queries_per_op' in base and current.get('queries_per_op', 0) > base['queries_per_op'] + 0.01:
+            failures.append(f'{name}: {current["queries_per_op"]} queries/op > baseline {base["queries_per_op"]}')
+        if 'peak_mb' in base and current.get('peak_mb', 0) > base['peak_mb'] * (1 + tolerance):
+            failures.append(f'{name}: peak {current["peak_mb"]}MB > baseline {base["peak_mb"]}MB')
+    return failures
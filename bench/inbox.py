@@ -0,0 +1,280 @@
+"""
+Очередь webhook Crypto Bot: задержка приема и скорость разбора накопившейся очереди.
+
+    python -m bench.inbox --dsn $BENCH_DATABASE_URL
+    python -m bench.inbox --users 2000 --events 50000 --senders 32 --workers 4 --batch-size 500
+
+Заводит пользователей с кошельками USDT и поднимает заглушки Telegram и Crypto Bot. Сначала потоки шлют
+подписанные события invoice_paid в обработчик crypto-webhook (часть — повторно, как при повторной доставке)
+и замеряют задержку ответа — это только проверка подписи и один INSERT в webhook_inbox. Затем несколько
+обработчиков очереди параллельно разбирают накопившиеся события, скорость — событий в секунду.
+
+Проверяется, что событие без подписи отклонено, повторы не добавили строк, вся очередь обработана без ошибок,
+на каждое событие пришлись одна транзакция, одно уведомление и одно сообщение в Telegram, а кошельки равны
+начальному балансу с учетом пополнений. Выход с кодом 1 при любом нарушении, ошибке потока или если p99
+приема больше --max-accept-p99-ms.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from decimal import Decimal
+from typing import Any, Dict, List, Tuple
+
+from bench.fakes import FakeApiServer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEBHOOK_DIR = os.path.join(ROOT_DIR, 'backend', 'crypto-webhook')
+
+INITIAL_BALANCE = Decimal('100')
+
+
+def _load_webhook():
+    sys.path.insert(0, WEBHOOK_DIR)
+    try:
+        import index
+        import inbox
+    finally:
+        sys.path.remove(WEBHOOK_DIR)
+    return index, inbox
+
+
+def _seed(conn, users: int) -> Tuple[List[int], int]:
+    """(telegram_id пользователей, первый свободный update_id)"""
+    cur = conn.cursor()
+    cur.execute('SELECT COALESCE(MAX(telegram_id), 0) + 1 FROM users')
+    base = cur.fetchone()[0]
+    cur.execute(
+        """
+        INSERT INTO users (telegram_id, username, referral_code)
+        SELECT %s + g, 'inbox' || (%s + g), 'I' || (%s + g)
+        FROM generate_series(0, %s - 1) g
+        RETURNING id, telegram_id
+        """,
+        (base, base, base, users)
+    )
+    rows = cur.fetchall()
+    cur.execute(
+        "INSERT INTO wallets (user_id, currency, balance) SELECT u, 'USDT', %s FROM unnest(%s::bigint[]) u",
+        (INITIAL_BALANCE, [row[0] for row in rows])
+    )
+    cur.execute('SELECT COALESCE(MAX(update_id), 0) + 1 FROM webhook_inbox')
+    first_update_id = cur.fetchone()[0]
+    cur.close()
+    conn.commit()
+    return [row[1] for row in rows], first_update_id
+
+
+def _event(update_id: int, telegram_id: int, amount: Decimal) -> str:
+    return json.dumps({
+        'update_id': update_id,
+        'update_type': 'invoice_paid',
+        'request_date': '2024-12-09T12:00:00Z',
+        'payload': {
+            'invoice_id': f'bench-{update_id}',
+            'status': 'paid', 'asset': 'USDT', 'amount': str(amount),
+            'payload': f'user_{telegram_id}',
+        },
+    })
+
+
+def _post(index, inbox, body: str, token: str, signed: bool = True) -> int:
+    from gateway.server import Context
+
+    headers = {'Crypto-Pay-API-Signature': inbox.sign(body, token)} if signed else {}
+    event = {'httpMethod': 'POST', 'headers': headers, 'body': body, 'isBase64Encoded': False}
+    return index.handler(event, Context(request_id='bench-inbox', function_name='crypto-webhook'))['statusCode']
+
+
+def _percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))] if ordered else 0.0
+
+
+def _verify(conn, telegram_ids: List[int], update_ids: List[int], deposited: Dict[int, Decimal]) -> Dict[str, Any]:
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT COUNT(*), COUNT(*) FILTER (WHERE processed_at IS NULL), COUNT(*) FILTER (WHERE error IS NOT NULL)
+        FROM webhook_inbox WHERE update_id = ANY(%s)
+        """,
+        (update_ids,)
+    )
+    inbox_rows, unprocessed, with_error = cur.fetchone()
+    cur.execute(
+        """
+        SELECT COUNT(*), COUNT(DISTINCT crypto_bot_invoice_id)
+        FROM transactions WHERE type = 'deposit' AND crypto_bot_invoice_id = ANY(%s)
+        """,
+        ([f'bench-{update_id}' for update_id in update_ids],)
+    )
+    transactions, invoices = cur.fetchone()
+    cur.execute(
+        """
+        SELECT u.telegram_id, w.balance
+        FROM users u JOIN wallets w ON w.user_id = u.id AND w.currency = 'USDT'
+        WHERE u.telegram_id = ANY(%s)
+        """,
+        (telegram_ids,)
+    )
+    drifted = sum(1 for telegram_id, balance in cur.fetchall()
+                  if balance != INITIAL_BALANCE + deposited.get(telegram_id, Decimal(0)))
+    cur.execute(
+        """
+        SELECT COUNT(*) FROM notifications n JOIN users u ON u.id = n.user_id
+        WHERE u.telegram_id = ANY(%s) AND n.title = 'Пополнение успешно'
+        """,
+        (telegram_ids,)
+    )
+    notifications = cur.fetchone()[0]
+    cur.close()
+    conn.commit()
+    return {
+        'inbox_rows': inbox_rows,
+        'unprocessed': unprocessed,
+        'with_error': with_error,
+        'transactions': transactions,
+        'duplicate_transactions': transactions - invoices,
+        'drifted_wallets': drifted,
+        'notifications': notifications,
+    }
+
+
+def check_inbox(dsn: str, users: int = 1000, events: int = 20000, senders: int = 16, workers: int = 4,
+                batch_size: int = 500, duplicate_share: float = 0.05) -> Dict[str, Any]:
+    import psycopg2
+
+    fake = FakeApiServer().start()
+    os.environ.update(fake.env())
+    os.environ['DATABASE_URL'] = dsn
+    os.environ.setdefault('DB_POOL_SIZE', str(senders))
+    # Пополнения идут чаще, чем у живого пользователя, — оценщик риска их только записывает
+    os.environ.setdefault('RISK_MODE', 'monitor')
+    index, inbox = _load_webhook()
+    token = os.environ['CRYPTO_BOT_API_TOKEN']
+
+    conn = psycopg2.connect(dsn)
+    try:
+        telegram_ids, first_update_id = _seed(conn, users)
+        deposited: Dict[int, Decimal] = {}
+        work: List[str] = []
+        for update_id in range(first_update_id, first_update_id + events):
+            telegram_id = random.choice(telegram_ids)
+            amount = Decimal(random.randint(100, 100000)) / 100
+            deposited[telegram_id] = deposited.get(telegram_id, Decimal(0)) + amount
+            body = _event(update_id, telegram_id, amount)
+            work.append(body)
+            if random.random() < duplicate_share:
+                work.append(body)
+        random.shuffle(work)
+        update_ids = list(range(first_update_id, first_update_id + events))
+
+        unsigned_status = _post(index, inbox, work[0], token, signed=False)
+
+        lock = threading.Lock()
+        errors: List[str] = []
+        latencies: List[float] = []
+
+        def send() -> None:
+            local: List[float] = []
+            try:
+                while True:
+                    with lock:
+                        if not work:
+                            break
+                        body = work.pop()
+                    started = time.perf_counter()
+                    status = _post(index, inbox, body, token)
+                    local.append(time.perf_counter() - started)
+                    if status != 200:
+                        raise RuntimeError(f'webhook returned {status}')
+            except Exception as e:
+                errors.append(f'{type(e).__name__}: {e}')
+            finally:
+                with lock:
+                    latencies.extend(local)
+
+        posted = len(work)
+        threads = [threading.Thread(target=send) for _ in range(senders)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        accept_seconds = time.perf_counter() - started
+
+        telegram_before = fake.calls['telegram.sendMessage']
+        summaries: List[Dict[str, Any]] = []
+
+        def drain() -> None:
+            worker_conn = psycopg2.connect(dsn)
+            try:
+                summaries.append(inbox.process_inbox(worker_conn, batch_size))
+            except Exception as e:
+                errors.append(f'{type(e).__name__}: {e}')
+            finally:
+                worker_conn.close()
+
+        threads = [threading.Thread(target=drain) for _ in range(workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        drain_seconds = time.perf_counter() - started
+
+        result = _verify(conn, telegram_ids, update_ids, deposited)
+        drained = sum(s['events'] for s in summaries)
+        result.update({
+            'events': events,
+            'posted': posted,
+            'unsigned_status': unsigned_status,
+            'accept_p50_ms': round(_percentile(latencies, 0.50) * 1000, 2),
+            'accept_p99_ms': round(_percentile(latencies, 0.99) * 1000, 2),
+            'accepted_per_sec': round(posted / accept_seconds) if accept_seconds else 0,
+            'drained': drained,
+            'batches': sum(s['batches'] for s in summaries),
+            'failed': sum(s['failed'] for s in summaries),
+            'telegram_messages': fake.calls['telegram.sendMessage'] - telegram_before,
+            'drain_seconds': round(drain_seconds, 3),
+            'drained_per_sec': round(drained / drain_seconds) if drain_seconds else 0,
+            'errors': errors,
+        })
+        return result
+    finally:
+        conn.close()
+        fake.stop()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Прием webhook в очередь и разбор очереди')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--senders', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--duplicate-share', type=float, default=0.05)
+    parser.add_argument('--max-accept-p99-ms', type=float, default=25.0)
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('--dsn или BENCH_DATABASE_URL обязателен')
+
+    random.seed(0)
+    result = check_inbox(args.dsn, args.users, args.events, args.senders, args.workers, args.batch_size,
+                         args.duplicate_share)
+    print(result)
+    events = result['events']
+    ok = (not result['errors'] and result['unsigned_status'] == 401 and result['inbox_rows'] == events
+          and not result['unprocessed'] and not result['with_error'] and not result['failed']
+          and result['transactions'] == events and not result['duplicate_transactions']
+          and not result['drifted_wallets'] and result['notifications'] == events
+          and result['telegram_messages'] == events and result['accept_p99_ms'] <= args.max_accept_p99_ms)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
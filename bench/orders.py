@@ -0,0 +1,124 @@
+"""
+Сборщик просроченных заявок: скорость и корректность при нескольких параллельных узлах.
+
+    python -m bench.orders --dsn $BENCH_DATABASE_URL                     # 100k заявок, 4 сборщика
+    python -m bench.orders --orders 20000 --workers 1 --batch-size 1000
+
+Засевает просроченные pending-заявки, запускает сборщики в потоках на отдельных соединениях и проверяет,
+что каждая заявка закрыта ровно один раз. Выход с кодом 1, если часть заявок осталась pending
+или сумма закрытых сборщиками не совпала с засеянным числом.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXCHANGE_DIR = os.path.join(ROOT_DIR, 'backend', 'exchange')
+
+BENCH_TTL_SECONDS = 3600
+
+
+def _load_orders():
+    sys.path.insert(0, EXCHANGE_DIR)
+    try:
+        import orders
+    finally:
+        sys.path.remove(EXCHANGE_DIR)
+    return orders
+
+
+def _seed_stale(conn, count: int) -> None:
+    cur = conn.cursor()
+    # Заявки старше TTL бенчмарка; уже существующие pending-заявки засеянной базы тоже попадут под сборщик
+    cur.execute(
+        """
+        INSERT INTO exchange_orders (user_id, from_currency, to_currency, from_amount, to_amount,
+                                     exchange_rate, fee, status, created_at)
+        SELECT u.min_id + g %% 1000, 'USDT', 'RUB', 10, 900, 90, 9, 'pending',
+               now() - interval '2 hours' - g * interval '1 second'
+        FROM generate_series(1, %s) g, (SELECT MIN(id) AS min_id FROM users) u
+        """,
+        (count,)
+    )
+    cur.close()
+    conn.commit()
+
+
+def _stale_count(conn) -> int:
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT COUNT(*) FROM exchange_orders WHERE status = 'pending' "
+        "AND created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)",
+        (BENCH_TTL_SECONDS,)
+    )
+    count = cur.fetchone()[0]
+    cur.close()
+    conn.commit()
+    return count
+
+
+def check_sweeper(dsn: str, count: int = 100000, workers: int = 4, batch_size: int = 5000) -> Dict[str, Any]:
+    import psycopg2
+
+    orders = _load_orders()
+    conn = psycopg2.connect(dsn)
+    try:
+        _seed_stale(conn, count)
+        expected = _stale_count(conn)
+
+        summaries: List[Dict[str, Any]] = []
+        errors: List[str] = []
+
+        def sweep() -> None:
+            worker_conn = psycopg2.connect(dsn)
+            try:
+                summaries.append(orders.sweep_expired(worker_conn, BENCH_TTL_SECONDS, batch_size))
+            except Exception as e:
+                errors.append(str(e))
+            finally:
+                worker_conn.close()
+
+        threads = [threading.Thread(target=sweep) for _ in range(workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - started
+
+        expired = sum(s['expired'] for s in summaries)
+        return {
+            'expected': expected,
+            'expired': expired,
+            'left_pending': _stale_count(conn),
+            'workers': workers,
+            'per_worker': [s['expired'] for s in summaries],
+            'errors': errors,
+            'seconds': round(seconds, 3),
+            'orders_per_sec': round(expired / seconds) if seconds else 0,
+        }
+    finally:
+        conn.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Сборщик просроченных заявок')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('--dsn или BENCH_DATABASE_URL обязателен')
+
+    result = check_sweeper(args.dsn, args.orders, args.workers, args.batch_size)
+    print(result)
+    ok = not result['errors'] and not result['left_pending'] and result['expired'] == result['expected']
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""
+Обработчик выплат: скорость и отсутствие двойных переводов при параллельных узлах и падениях.
+
+    python -m bench.payouts --dsn $BENCH_DATABASE_URL
+    python -m bench.payouts --users 200 --withdrawals-per-user 10 --workers 4 --drop-rate 0.05
+
+Заводит пользователей с кошельками и выводами (сумма списана с кошелька, как при создании заявки) и поднимает
+заглушку Crypto Bot. Сначала имитируется падение: пачка выводов захватывается и отправляется, но результат
+не записывается. Затем несколько обработчиков работают параллельно, а заглушка у части переводов теряет ответ (502 с ok: false) —
+такие выводы не отклоняются, а возвращаются в очередь и повторяются с тем же spend_id.
+Последний проход с нулевой арендой подбирает все зависшие в processing выводы и повторяет их с тем же spend_id.
+
+Проверяется, что все выводы выполнены, на каждый пришелся ровно один перевод заглушки с его суммой,
+tx_hash совпадает с transfer_id, а кошельки равны начальному балансу за вычетом выводов.
+Выход с кодом 1 при любом нарушении или ошибке потока.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from decimal import Decimal
+from typing import Any, Dict, List
+
+from bench.fakes import FakeApiServer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WITHDRAWALS_DIR = os.path.join(ROOT_DIR, 'backend', 'withdrawals')
+
+INITIAL_BALANCE = Decimal('1000')
+ASSETS = ('USDT', 'TON')
+
+
+def _load_payouts():
+    sys.path.insert(0, WITHDRAWALS_DIR)
+    try:
+        import payouts
+    finally:
+        sys.path.remove(WITHDRAWALS_DIR)
+    return payouts
+
+
+def _seed(conn, users: int, withdrawals_per_user: int) -> List[int]:
+    cur = conn.cursor()
+    cur.execute('SELECT COALESCE(MAX(telegram_id), 0) + 1 FROM users')
+    base = cur.fetchone()[0]
+    cur.execute(
+        """
+        INSERT INTO users (telegram_id, username, referral_code)
+        SELECT %s + g, 'payout' || (%s + g), 'W' || (%s + g)
+        FROM generate_series(0, %s - 1) g
+        RETURNING id
+        """,
+        (base, base, base, users)
+    )
+    user_ids = [row[0] for row in cur.fetchall()]
+    # Выводы не больше 1000 / withdrawals_per_user каждый — баланса хватает на все
+    cur.execute(
+        """
+        INSERT INTO transactions (user_id, type, currency, amount, status)
+        SELECT u, 'withdrawal', (%s::text[])[1 + (random() * (array_length(%s::text[], 1) - 1))::int],
+               round((random() * %s + 0.01)::numeric, 2), 'pending'
+        FROM unnest(%s::bigint[]) u, generate_series(1, %s)
+        RETURNING id
+        """,
+        (list(ASSETS), list(ASSETS), float(INITIAL_BALANCE) / withdrawals_per_user - 0.01, user_ids,
+         withdrawals_per_user)
+    )
+    withdrawal_ids = [row[0] for row in cur.fetchall()]
+    cur.execute(
+        """
+        INSERT INTO wallets (user_id, currency, balance)
+        SELECT u, c, %s - COALESCE((SELECT SUM(amount) FROM transactions t
+                                    WHERE t.user_id = u AND t.currency = c AND t.type = 'withdrawal'), 0)
+        FROM unnest(%s::bigint[]) u CROSS JOIN unnest(%s::text[]) c
+        """,
+        (INITIAL_BALANCE, user_ids, list(ASSETS))
+    )
+    cur.close()
+    conn.commit()
+    return withdrawal_ids
+
+
+def _crash_after_send(conn, payouts, count: int) -> int:
+    """Захватывает и отправляет пачку, но не записывает результат — как упавший обработчик"""
+    cur = conn.cursor()
+    cur.execute(payouts.CLAIM_SQL, {'lease': payouts.PAYOUT_LEASE_SECONDS, 'batch_size': count})
+    claimed = cur.fetchall()
+    cur.close()
+    conn.commit()
+    for withdrawal in claimed:
+        payouts._send(withdrawal)
+    return len(claimed)
+
+
+def _verify(conn, fake: FakeApiServer, payouts, withdrawal_ids: List[int]) -> Dict[str, Any]:
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT t.id, t.status, t.amount, t.tx_hash
+        FROM transactions t WHERE t.id = ANY(%s)
+        """,
+        (withdrawal_ids,)
+    )
+    rows = cur.fetchall()
+    cur.execute(
+        """
+        WITH w AS (
+            SELECT user_id, currency, SUM(amount) AS withdrawn
+            FROM transactions WHERE id = ANY(%s) GROUP BY user_id, currency
+        )
+        SELECT COUNT(*) FILTER (WHERE wl.balance < 0),
+               COUNT(*) FILTER (WHERE wl.balance <> %s - w.withdrawn)
+        FROM w JOIN wallets wl ON wl.user_id = w.user_id AND wl.currency = w.currency
+        """,
+        (withdrawal_ids, INITIAL_BALANCE)
+    )
+    negative, drifted = cur.fetchone()
+    cur.close()
+    conn.commit()
+
+    not_completed = mismatched = 0
+    for withdrawal_id, status, amount, tx_hash in rows:
+        transfer = fake.transfers.get(payouts.spend_id(withdrawal_id))
+        if status != 'completed':
+            not_completed += 1
+        elif (transfer is None or Decimal(transfer['amount']) != amount
+              or (tx_hash and tx_hash != str(transfer['transfer_id']))):
+            mismatched += 1
+    seeded = {payouts.spend_id(withdrawal_id) for withdrawal_id in withdrawal_ids}
+    return {
+        'not_completed': not_completed,
+        'mismatched_transfers': mismatched,
+        'unexpected_transfers': len(set(fake.transfers) - seeded),
+        'repeated_transfers': fake.repeated_transfers,
+        'negative_balances': negative,
+        'drifted_wallets': drifted,
+    }
+
+
+def check_payouts(dsn: str, users: int = 200, withdrawals_per_user: int = 10, workers: int = 4,
+                  batch_size: int = 200, drop_rate: float = 0.05) -> Dict[str, Any]:
+    import psycopg2
+
+    fake = FakeApiServer(latency_ms=2, drop_rate=drop_rate).start()
+    os.environ.update(fake.env())
+    payouts = _load_payouts()
+    conn = psycopg2.connect(dsn)
+    try:
+        withdrawal_ids = _seed(conn, users, withdrawals_per_user)
+        crashed = _crash_after_send(conn, payouts, batch_size)
+
+        summaries: List[Dict[str, Any]] = []
+        errors: List[str] = []
+
+        def work() -> None:
+            worker_conn = psycopg2.connect(dsn)
+            try:
+                summaries.append(payouts.run_payouts(worker_conn, batch_size))
+            except Exception as e:
+                errors.append(f'{type(e).__name__}: {e}')
+            finally:
+                worker_conn.close()
+
+        threads = [threading.Thread(target=work) for _ in range(workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - started
+
+        # Восстановление: аренда истекла у всех, потерянные ответы больше не теряются
+        fake.drop_rate = 0.0
+        resumed = payouts.run_payouts(conn, batch_size, lease_seconds=0)
+
+        result = _verify(conn, fake, payouts, withdrawal_ids)
+        sent = sum(s['sent'] for s in summaries)
+        result.update({
+            'withdrawals': len(withdrawal_ids),
+            'crashed_batch': crashed,
+            'sent': sent,
+            'retried': sum(s['retry'] for s in summaries),
+            'resumed': resumed['sent'],
+            'failed': sum(s['failed'] for s in summaries) + resumed['failed'],
+            'errors': errors,
+            'seconds': round(seconds, 3),
+            'payouts_per_sec': round(sent / seconds) if seconds else 0,
+        })
+        return result
+    finally:
+        conn.close()
+        fake.stop()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Обработчик выплат под параллельной нагрузкой')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--withdrawals-per-user', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--drop-rate', type=float, default=0.05)
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('--dsn или BENCH_DATABASE_URL обязателен')
+
+    random.seed(0)
+    result = check_payouts(args.dsn, args.users, args.withdrawals_per_user, args.workers, args.batch_size,
+                           args.drop_rate)
+    print(result)
+    ok = (not result['errors'] and not result['not_completed'] and not result['mismatched_transfers']
+          and not result['unexpected_transfers'] and not result['negative_balances']
+          and not result['drifted_wallets'] and not result['failed'])
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
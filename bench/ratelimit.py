@@ -0,0 +1,123 @@
+"""
+Цена проверки лимита частоты на горячем пути: токен-корзины в памяти против одного запроса к базе.
+
+    python -m bench.ratelimit                              # только корзины в памяти
+    python -m bench.ratelimit --dsn $BENCH_DATABASE_URL     # плюс SELECT 1 и общий лимит через rate_limit_windows
+
+Выход с кодом 1, если разрешенная проверка в памяти дороже --max-us микросекунд.
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXCHANGE_DIR = os.path.join(ROOT_DIR, 'backend', 'exchange')
+
+# Лимиты, которые на замере не срабатывают: меряется только разрешенный путь
+BENCH_RULES = 'bench.route:user=1000000000/1,ip=1000000000/1,global=1000000000/1'
+
+
+def _load_ratelimit():
+    sys.path.insert(0, EXCHANGE_DIR)
+    try:
+        import ratelimit
+    finally:
+        sys.path.remove(EXCHANGE_DIR)
+    return ratelimit
+
+
+def _per_call_us(fn: Callable[[int], Any], calls: int) -> float:
+    fn(0)
+    started = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def check_ratelimit(dsn: Optional[str] = None, calls: int = 200000) -> Dict[str, Dict[str, float]]:
+    ratelimit = _load_ratelimit()
+    event = {'requestContext': {'identity': {'sourceIp': '203.0.113.7'}}, 'headers': {}}
+    results: Dict[str, Dict[str, float]] = {}
+
+    saved = {k: os.environ.get(k) for k in ('RATE_LIMITS', 'RATE_LIMIT_BACKEND', 'DATABASE_URL')}
+    try:
+        os.environ['RATE_LIMITS'] = BENCH_RULES
+        os.environ['RATE_LIMIT_BACKEND'] = 'memory'
+        limiter = ratelimit.RateLimiter()
+
+        results['memory.same_user'] = {'us': _per_call_us(lambda i: limiter.check(event, 'bench.route', 42), calls)}
+        results['memory.10k_users'] = {
+            'us': _per_call_us(lambda i: limiter.check(event, 'bench.route', i % 10000), calls)
+        }
+        results['memory.unlimited_route'] = {
+            'us': _per_call_us(lambda i: limiter.check(event, 'other.route', i), calls)
+        }
+
+        if dsn:
+            import psycopg2
+            conn = psycopg2.connect(dsn)
+            try:
+                cur = conn.cursor()
+
+                def select_one(_: int) -> None:
+                    cur.execute('SELECT 1')
+                    cur.fetchone()
+
+                results['db.select_1'] = {'us': _per_call_us(select_one, 2000)}
+            finally:
+                conn.close()
+
+            # Общий global-лимит: в базу уходит один запрос на порцию из LEASE_FRACTION лимита
+            os.environ['DATABASE_URL'] = dsn
+            os.environ['RATE_LIMITS'] = 'bench.route:global=100000/60'
+            os.environ['RATE_LIMIT_BACKEND'] = 'postgres'
+            shared = ratelimit.RateLimiter()
+            reserve = ratelimit.PostgresWindows.reserve
+            reservations = [0]
+
+            def counting_reserve(self, *args):
+                reservations[0] += 1
+                return reserve(self, *args)
+
+            ratelimit.PostgresWindows.reserve = counting_reserve
+            try:
+                shared_calls = 20000
+                us = _per_call_us(lambda i: shared.check(event, 'bench.route', i), shared_calls)
+            finally:
+                ratelimit.PostgresWindows.reserve = reserve
+            results['postgres.global_lease'] = {
+                'us': us, 'db_round_trips_per_1k': reservations[0] / (shared_calls + 1) * 1000,
+            }
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    return {name: {k: round(v, 3) for k, v in r.items()} for name, r in results.items()}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Цена проверки лимита частоты')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--calls', type=int, default=200000)
+    parser.add_argument('--max-us', type=float, default=20.0,
+                        help='предел для разрешенной проверки в памяти, мкс')
+    args = parser.parse_args()
+
+    results = check_ratelimit(args.dsn, args.calls)
+    for name, r in results.items():
+        extra = ''.join(f'  {k}={v}' for k, v in r.items() if k != 'us')
+        print(f"{name:<26} {r['us']:>9.3f} us{extra}")
+
+    slow = [name for name, r in results.items() if name.startswith('memory.') and r['us'] > args.max_us]
+    for name in slow:
+        print(f'[ratelimit] {name} is slower than {args.max_us} us')
+    return 1 if slow else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
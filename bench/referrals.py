@@ -0,0 +1,76 @@
+"""
+Скорость начисления реферальных комиссий по всей истории заявок засеянной базы.
+
+    python -m bench.referrals --dsn $BENCH_DATABASE_URL
+    python -m bench.referrals --batch-size 5000 --repeat     # плюс повторный проход: ничего не начисляет
+
+Начисления, отметка и referral_earnings сбрасываются перед замером — запускать только на базе бенчмарков.
+"""
+import argparse
+import os
+import sys
+from typing import Any, Dict
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REFERRALS_DIR = os.path.join(ROOT_DIR, 'backend', 'referrals')
+
+
+def _load_commissions():
+    sys.path.insert(0, REFERRALS_DIR)
+    try:
+        import commissions
+    finally:
+        sys.path.remove(REFERRALS_DIR)
+    return commissions
+
+
+def _reset(conn) -> None:
+    cur = conn.cursor()
+    cur.execute('TRUNCATE referral_commissions')
+    cur.execute("UPDATE referral_accrual_state SET mark_at = '-infinity', mark_id = 0 WHERE name = 'commissions'")
+    cur.execute('UPDATE users SET referral_earnings = 0 WHERE referral_earnings <> 0')
+    cur.close()
+    conn.commit()
+
+
+def check_accrual(dsn: str, batch_size: int = 20000, repeat: bool = False) -> Dict[str, Any]:
+    import psycopg2
+
+    commissions = _load_commissions()
+    conn = psycopg2.connect(dsn)
+    try:
+        _reset(conn)
+        summary = commissions.accrue(conn, batch_size=batch_size, backfill=True)
+        result = {
+            'orders': summary['orders'],
+            'commissions': summary['commissions'],
+            'batches': summary['batches'],
+            'seconds': summary['seconds'],
+            'orders_per_sec': round(summary['orders'] / summary['seconds']) if summary['seconds'] else 0,
+        }
+        if repeat:
+            # Повторный проход по той же истории упирается в UNIQUE (order_id, beneficiary_id)
+            again = commissions.accrue(conn, batch_size=batch_size, backfill=True)
+            result['repeat_commissions'] = again['commissions']
+            result['repeat_seconds'] = again['seconds']
+    finally:
+        conn.close()
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Скорость начисления реферальных комиссий')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--batch-size', type=int, default=20000)
+    parser.add_argument('--repeat', action='store_true', help='повторить проход и проверить, что он ничего не начисляет')
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('--dsn или BENCH_DATABASE_URL обязателен')
+
+    result = check_accrual(args.dsn, args.batch_size, args.repeat)
+    print(result)
+    return 1 if result.get('repeat_commissions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Оценка риска: воспроизведение синтетического журнала событий.
+
+    python -m bench.risk
+    python -m bench.risk --users 20000 --hours 72 --compromised 0.02 --max-us 50
+
+Строит журнал пополнений, заявок и переводов: у обычных пользователей своя частота и типичная сумма,
+у доли скомпрометированных после середины журнала начинается атака — всплеск заявок за минуту, вывод
+переводами крупных сумм или многократный рост часового объема. Журнал проигрывается через RiskScorer
+по времени событий; в середине состояние сериализуется как снимок risk_state и загружается в новый
+экземпляр, как после перезапуска.
+
+Выход с кодом 1, если обнаружено меньше --min-detection атак, hold/block получили больше --max-false-hold
+обычных пользователей или оценка события дольше --max-us микросекунд. База данных не нужна.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Set, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXCHANGE_DIR = os.path.join(ROOT_DIR, 'backend', 'exchange')
+
+KINDS = (('order', 0.6), ('deposit', 0.2), ('transfer', 0.2))
+ATTACKS = ('burst', 'drain', 'velocity')
+
+Event = Tuple[float, int, str, str, float]
+
+
+def _load_risk():
+    sys.path.insert(0, EXCHANGE_DIR)
+    try:
+        import risk
+    finally:
+        sys.path.remove(EXCHANGE_DIR)
+    return risk
+
+
+def _kind(rng: random.Random) -> str:
+    roll = rng.random()
+    for kind, share in KINDS:
+        if roll < share:
+            return kind
+        roll -= share
+    return KINDS[-1][0]
+
+
+def build_log(users: int, hours: int, compromised: float, seed: int = 0) -> Tuple[List[Event], Dict[int, str]]:
+    """(события по времени, user_id → тип атаки для скомпрометированных)"""
+    rng = random.Random(seed)
+    start = 1_700_000_000.0
+    events: List[Event] = []
+    attacked: Dict[int, str] = {}
+    for user_id in range(1, users + 1):
+        per_hour = math.exp(rng.uniform(math.log(0.1), math.log(4)))
+        typical = math.exp(rng.uniform(math.log(5), math.log(2000)))
+        t = start + rng.expovariate(per_hour) * 3600
+        while t < start + hours * 3600:
+            amount = round(typical * rng.lognormvariate(0, 0.5), 2)
+            events.append((t, user_id, _kind(rng), 'USDT', amount))
+            t += rng.expovariate(per_hour) * 3600
+
+        if rng.random() >= compromised:
+            continue
+        attack = rng.choice(ATTACKS)
+        attacked[user_id] = attack
+        t = start + rng.uniform(hours * 0.6, hours * 0.9) * 3600
+        if attack == 'burst':
+            for _ in range(rng.randint(40, 120)):
+                t += rng.uniform(0.2, 1.0)
+                events.append((t, user_id, 'order', 'USDT', round(typical * rng.lognormvariate(0, 0.5), 2)))
+        elif attack == 'drain':
+            for _ in range(rng.randint(2, 5)):
+                t += rng.uniform(30, 300)
+                events.append((t, user_id, 'transfer', 'USDT', round(typical * rng.uniform(60, 200), 2)))
+        else:
+            for _ in range(rng.randint(15, 30)):
+                t += rng.uniform(60, 180)
+                events.append((t, user_id, 'order', 'USDT', round(typical * rng.uniform(2, 5), 2)))
+    events.sort()
+    return events, attacked
+
+
+def _restart(risk, scorer) -> Tuple[Any, int]:
+    """Снимок всех профилей в JSON (как в risk_state) и загрузка в новый экземпляр"""
+    fresh = risk.RiskScorer(**{name: getattr(scorer, name) for name in (
+        'mode', 'hold_per_minute', 'block_per_minute', 'flag_per_day', 'velocity_multiplier', 'size_multiplier',
+        'baseline_events', 'baseline_hours', 'snapshot_seconds', 'max_users')})
+    size = 0
+    for user_id, profiles in scorer.users.items():
+        state = json.dumps({key: profile.dump() for key, profile in profiles.items()})
+        size += len(state)
+        fresh.users[user_id] = {key: risk.Profile.load(data) for key, data in json.loads(state).items()}
+    return fresh, size
+
+
+def replay(users: int = 5000, hours: int = 48, compromised: float = 0.01, seed: int = 0) -> Dict[str, Any]:
+    risk = _load_risk()
+    events, attacked = build_log(users, hours, compromised, seed)
+    scorer = risk.RiskScorer(mode='enforce', max_users=users + 1)
+
+    detected: Set[int] = set()
+    false_hold: Set[int] = set()
+    false_flag: Set[int] = set()
+    actions: Dict[str, int] = dict.fromkeys(risk.ACTIONS, 0)
+    restart_at = len(events) // 2
+    snapshot_bytes = 0
+    elapsed = 0.0
+
+    for index, (t, user_id, kind, currency, amount) in enumerate(events):
+        if index == restart_at:
+            scorer, snapshot_bytes = _restart(risk, scorer)
+        started = time.perf_counter()
+        decision = scorer.score(user_id, kind, currency, amount, now=t)
+        elapsed += time.perf_counter() - started
+
+        actions[decision.action] += 1
+        if decision.action == 'allow':
+            continue
+        if user_id in attacked:
+            detected.add(user_id)
+        elif decision.action in ('hold', 'block'):
+            false_hold.add(user_id)
+        else:
+            false_flag.add(user_id)
+
+    normal = users - len(attacked)
+    by_attack = {
+        attack: f'{sum(1 for u, a in attacked.items() if a == attack and u in detected)}/'
+                f'{sum(1 for a in attacked.values() if a == attack)}'
+        for attack in ATTACKS
+    }
+    return {
+        'events': len(events),
+        'users': users,
+        'compromised': len(attacked),
+        'detection_rate': round(len(detected) / len(attacked), 4) if attacked else 1.0,
+        'detected_by_attack': by_attack,
+        'false_hold_rate': round(len(false_hold) / normal, 4) if normal else 0.0,
+        'false_flag_rate': round(len(false_flag) / normal, 4) if normal else 0.0,
+        'actions': actions,
+        'snapshot_kb': round(snapshot_bytes / 1024),
+        'us_per_event': round(elapsed / len(events) * 1e6, 2) if events else 0.0,
+        'events_per_sec': round(len(events) / elapsed) if elapsed else 0,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Воспроизведение журнала событий через оценщик риска')
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--hours', type=int, default=48)
+    parser.add_argument('--compromised', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-detection', type=float, default=0.95)
+    parser.add_argument('--max-false-hold', type=float, default=0.01)
+    parser.add_argument('--max-us', type=float, default=50.0)
+    args = parser.parse_args()
+
+    result = replay(args.users, args.hours, args.compromised, args.seed)
+    print(result)
+    ok = (result['detection_rate'] >= args.min_detection and result['false_hold_rate'] <= args.max_false_hold
+          and result['us_per_event'] <= args.max_us)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
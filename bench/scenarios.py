@@ -0,0 +1,298 @@
+"""
+Сценарии бенчмарков: отдельные точки входа обработчиков и полные пользовательские сценарии
+"""
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+from typing import Any, Dict, List
+
+from bench.harness import RunContext, Scenario, ScenarioError, expect
+
+ADMIN_HEADERS = {'X-Admin-Key': os.environ.get('ADMIN_SECRET_KEY', 'admin123')}
+
+# Сессионные токены, полученные через auth, по telegram_id
+_SESSIONS: Dict[int, str] = {}
+
+
+def session_headers(ctx: RunContext, telegram_id: int) -> Dict[str, str]:
+    token = _SESSIONS.get(telegram_id)
+    if token is None:
+        user = expect(ctx.handlers.invoke('auth', 'POST', '/auth', {'telegram_id': telegram_id}), 200)
+        token = _SESSIONS[telegram_id] = user['session_token']
+    return {'X-Session-Token': token}
+
+
+def rates_active(ctx: RunContext) -> None:
+    expect(ctx.handlers.invoke('rates', 'GET', '/rates'), 200)
+
+
+def rates_list(ctx: RunContext) -> None:
+    expect(ctx.handlers.invoke('rates', 'GET', '/rates?action=list'), 200)
+
+
+def wallets_get(ctx: RunContext) -> None:
+    expect(ctx.handlers.invoke('wallets', 'GET', f'/wallets?telegram_id={ctx.random_telegram_id()}'), 200)
+
+
+def wallets_get_session(ctx: RunContext) -> None:
+    headers = session_headers(ctx, ctx.random_telegram_id())
+    expect(ctx.handlers.invoke('wallets', 'GET', '/wallets', headers=headers), 200)
+
+
+def bootstrap_get(ctx: RunContext) -> None:
+    expect(ctx.handlers.invoke('bootstrap', 'GET', f'/bootstrap?telegram_id={ctx.random_telegram_id()}'), 200)
+
+
+def app_open_separate(ctx: RunContext) -> None:
+    """Открытие мини-приложения без bootstrap: четыре отдельных вызова"""
+    telegram_id = ctx.random_telegram_id()
+    expect(ctx.handlers.invoke('auth', 'POST', '/auth', {'telegram_id': telegram_id}), 200)
+    expect(ctx.handlers.invoke('wallets', 'GET', f'/wallets?telegram_id={telegram_id}'), 200)
+    expect(ctx.handlers.invoke('rates', 'GET', '/rates'), 200)
+    expect(ctx.handlers.invoke('notifications', 'GET', f'/notifications?telegram_id={telegram_id}'), 200)
+
+
+def notifications_get(ctx: RunContext) -> None:
+    expect(ctx.handlers.invoke('notifications', 'GET', f'/notifications?telegram_id={ctx.random_telegram_id()}'), 200)
+
+
+def notifications_create(ctx: RunContext) -> None:
+    expect(ctx.handlers.invoke('notifications', 'POST', '/notifications', {
+        'telegram_id': ctx.random_telegram_id(), 'type': 'info',
+        'title': 'Бенчмарк', 'message': 'Тестовое уведомление',
+    }), 201)
+
+
+def notifications_mark_read(ctx: RunContext) -> None:
+    notification_id = ctx.rng.randint(1, max(ctx.max_notification_id, 1))
+    expect(ctx.handlers.invoke('notifications', 'PUT', '/notifications', {
+        'notification_id': notification_id,
+    }), 200, 404)
+
+
+def exchange_user_orders(ctx: RunContext) -> None:
+    expect(ctx.handlers.invoke('exchange', 'GET', f'/exchange?telegram_id={ctx.random_telegram_id()}'), 200)
+
+
+def exchange_admin_orders(ctx: RunContext) -> None:
+    expect(ctx.handlers.invoke('exchange', 'GET', '/exchange?action=admin_orders'), 200)
+
+
+def exchange_create_order(ctx: RunContext) -> None:
+    expect(ctx.handlers.invoke('exchange', 'POST', '/exchange', {
+        'telegram_id': ctx.random_telegram_id(), 'from_currency': 'USDT', 'to_currency': 'RUB',
+        'from_amount': round(ctx.rng.uniform(10, 500), 2),
+    }), 201)
+
+
+def exchange_quote_order(ctx: RunContext) -> None:
+    """Котировка из снимка курсов → заявка по токену: одна запись в базу на пару запросов"""
+    telegram_id = ctx.random_telegram_id()
+    amount = round(ctx.rng.uniform(10, 500), 2)
+    quote = expect(ctx.handlers.invoke(
+        'exchange', 'GET',
+        f'/exchange?action=quote&telegram_id={telegram_id}&from_currency=USDT&to_currency=RUB&from_amount={amount}'
+    ), 200)
+    expect(ctx.handlers.invoke('exchange', 'POST', '/exchange', {
+        'telegram_id': telegram_id, 'quote_token': quote['quote_token'],
+    }), 201)
+
+
+def admin_stats(ctx: RunContext) -> None:
+    expect(ctx.handlers.invoke('admin', 'GET', '/admin?action=stats', headers=ADMIN_HEADERS), 200)
+
+
+def admin_users(ctx: RunContext) -> None:
+    offset = ctx.rng.choice([0, 0, 0, 50, 500])
+    expect(ctx.handlers.invoke('admin', 'GET', f'/admin?action=users&offset={offset}', headers=ADMIN_HEADERS), 200)
+
+
+def admin_users_search(ctx: RunContext) -> None:
+    query = f'user{ctx.rng.randint(1, ctx.users)}'
+    expect(ctx.handlers.invoke('admin', 'GET', f'/admin?action=users&search={query}', headers=ADMIN_HEADERS), 200)
+
+
+def admin_transactions(ctx: RunContext) -> None:
+    expect(ctx.handlers.invoke('admin', 'GET', '/admin?action=transactions', headers=ADMIN_HEADERS), 200)
+
+
+def admin_referral_volume(ctx: RunContext) -> None:
+    # Первые пользователи — корни самых больших поддеревьев засеянной базы
+    user_id = ctx.rng.randint(1, min(ctx.users, 100))
+    expect(ctx.handlers.invoke(
+        'admin', 'GET', f'/admin?action=referral_volume&user_id={user_id}&days=90', headers=ADMIN_HEADERS
+    ), 200)
+
+
+def admin_top_referrers(ctx: RunContext) -> None:
+    sort = ctx.rng.choice(['size', 'volume'])
+    expect(ctx.handlers.invoke(
+        'admin', 'GET', f'/admin?action=top_referrers&sort={sort}&days=7', headers=ADMIN_HEADERS
+    ), 200)
+
+
+def admin_liquidity(ctx: RunContext) -> None:
+    expect(ctx.handlers.invoke('admin', 'GET', '/admin?action=liquidity', headers=ADMIN_HEADERS), 200)
+
+
+def admin_export_page(ctx: RunContext) -> None:
+    expect(ctx.handlers.invoke(
+        'admin', 'GET', '/admin?action=export&entity=transactions&format=csv&limit=10000', headers=ADMIN_HEADERS
+    ), 200)
+
+
+def auth_login(ctx: RunContext) -> None:
+    expect(ctx.handlers.invoke('auth', 'POST', '/auth', {'telegram_id': ctx.random_telegram_id()}), 200)
+
+
+def auth_signup(ctx: RunContext) -> None:
+    expect(ctx.handlers.invoke('auth', 'POST', '/auth', {
+        'telegram_id': ctx.new_telegram_id(), 'username': 'bench', 'first_name': 'Bench',
+    }), 201)
+
+
+def deposit_event(ctx: RunContext, telegram_id: int, amount: float, asset: str = 'USDT') -> Dict[str, Any]:
+    update_id = ctx.new_telegram_id()
+    return {
+        'update_id': update_id,
+        'update_type': 'invoice_paid',
+        'payload': {
+            'invoice_id': str(update_id),
+            'status': 'paid', 'asset': asset, 'amount': f'{amount:.2f}',
+            'payload': f'user_{telegram_id}',
+        },
+    }
+
+
+def webhook_headers(event: Dict[str, Any]) -> Dict[str, str]:
+    """Подпись Crypto Bot: HMAC-SHA-256 тела (в том виде, как его отправит invoke) ключом SHA-256(токен)"""
+    secret = hashlib.sha256(os.environ.get('CRYPTO_BOT_API_TOKEN', '').encode()).digest()
+    return {'Crypto-Pay-API-Signature': hmac.new(secret, json.dumps(event).encode(), hashlib.sha256).hexdigest()}
+
+
+def crypto_webhook_deposit(ctx: RunContext) -> None:
+    event = deposit_event(ctx, ctx.random_telegram_id(), ctx.rng.uniform(1, 100))
+    expect(ctx.handlers.invoke('crypto-webhook', 'POST', '/crypto-webhook', event, headers=webhook_headers(event)), 200)
+
+
+def drain_inbox(ctx: RunContext, telegram_id: int, amount: float, asset: str = 'USDT') -> None:
+    """
+    Зачисляет пополнение из очереди webhook таймером "inbox". Событие могла захватить пачка обработчика
+    соседнего сценария (SKIP LOCKED), поэтому таймер повторяется, пока сумма не появится на кошельке
+    """
+    for _ in range(100):
+        expect(ctx.handlers.trigger('crypto-webhook', 'inbox'), 200)
+        wallets = expect(ctx.handlers.invoke('wallets', 'GET', f'/wallets?telegram_id={telegram_id}'), 200)
+        if any(w['currency'] == asset and Decimal(str(w['balance'])) >= Decimal(f'{amount:.2f}') for w in wallets):
+            return
+        time.sleep(0.02)
+    raise ScenarioError(f'deposit for {telegram_id} was not credited from webhook_inbox')
+
+
+def telegram_bot_help(ctx: RunContext) -> None:
+    telegram_id = ctx.random_telegram_id()
+    expect(ctx.handlers.invoke('telegram-bot', 'POST', '/telegram-bot', {
+        'message': {
+            'message_id': 1, 'text': '/help',
+            'from': {'id': telegram_id, 'first_name': 'Bench'},
+            'chat': {'id': telegram_id, 'type': 'private'},
+        }
+    }), 200)
+
+
+def crypto_bot_invoice(ctx: RunContext) -> None:
+    expect(ctx.handlers.invoke('crypto-bot', 'POST', '/crypto-bot', {
+        'asset': 'USDT', 'amount': '10', 'payload': f'user_{ctx.random_telegram_id()}',
+    }), 200)
+
+
+def user_journey(ctx: RunContext) -> None:
+    """Регистрация → пополнение через webhook и очередь → курс → заявка → смена статуса"""
+    telegram_id = ctx.new_telegram_id()
+    h = ctx.handlers
+
+    expect(h.invoke('auth', 'POST', '/auth', {'telegram_id': telegram_id, 'username': 'journey'}), 201)
+    deposit = deposit_event(ctx, telegram_id, 250.0)
+    expect(h.invoke('crypto-webhook', 'POST', '/crypto-webhook', deposit, headers=webhook_headers(deposit)), 200)
+    drain_inbox(ctx, telegram_id, 250.0)
+    expect(h.invoke('rates', 'GET', '/rates'), 200)
+    order = expect(h.invoke('exchange', 'POST', '/exchange', {
+        'telegram_id': telegram_id, 'from_currency': 'USDT', 'to_currency': 'RUB', 'from_amount': 100,
+    }), 201)
+    expect(h.invoke('exchange', 'PUT', '/exchange', {'order_id': order['id'], 'status': 'awaiting_payment'}), 200)
+    expect(h.invoke('exchange', 'PUT', '/exchange', {'order_id': order['id'], 'status': 'completed'},
+                    headers=ADMIN_HEADERS), 200)
+    expect(h.invoke('wallets', 'GET', f'/wallets?telegram_id={telegram_id}'), 200)
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario('rates.active', rates_active),
+    Scenario('rates.list', rates_list),
+    Scenario('wallets.get', wallets_get),
+    Scenario('wallets.get_session', wallets_get_session),
+    Scenario('bootstrap.get', bootstrap_get),
+    Scenario('app_open.separate', app_open_separate),
+    Scenario('notifications.get', notifications_get),
+    Scenario('notifications.create', notifications_create, weight=0.5),
+    Scenario('notifications.mark_read', notifications_mark_read, weight=0.5),
+    Scenario('exchange.user_orders', exchange_user_orders),
+    Scenario('exchange.admin_orders', exchange_admin_orders),
+    Scenario('exchange.create_order', exchange_create_order, weight=0.5),
+    Scenario('exchange.quote_order', exchange_quote_order, weight=0.5),
+    Scenario('admin.stats', admin_stats, weight=0.5),
+    Scenario('admin.users', admin_users),
+    Scenario('admin.users_search', admin_users_search),
+    Scenario('admin.transactions', admin_transactions),
+    Scenario('admin.export_page', admin_export_page, weight=0.5),
+    Scenario('admin.referral_volume', admin_referral_volume, weight=0.5),
+    Scenario('admin.top_referrers', admin_top_referrers, weight=0.5),
+    Scenario('admin.liquidity', admin_liquidity, weight=0.2),
+    Scenario('auth.login', auth_login),
+    Scenario('auth.signup', auth_signup, weight=0.5),
+    Scenario('crypto_webhook.deposit', crypto_webhook_deposit, weight=0.5),
+    Scenario('telegram_bot.help', telegram_bot_help),
+    Scenario('crypto_bot.invoice', crypto_bot_invoice),
+    Scenario('journey.signup_to_settlement', user_journey),
+]
+
+
+def check_export_memory(dsn: str, rows: int = 1_000_000, ceiling_mb: float = 64.0) -> Dict[str, Any]:
+    """
+    Потоковая выгрузка не должна накапливать строки в памяти:
+    пик tracemalloc при выгрузке rows строк ограничен ceiling_mb
+    """
+    import psycopg2
+
+    admin_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend', 'admin')
+    sys.path.insert(0, admin_dir)
+    try:
+        from export import ExportStream
+    finally:
+        sys.path.remove(admin_dir)
+
+    conn = psycopg2.connect(dsn)
+    try:
+        tracemalloc.start()
+        started = time.perf_counter()
+        stream = ExportStream(conn, 'transactions', 'csv', limit=rows)
+        size = sum(len(chunk) for chunk in stream)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        conn.close()
+
+    peak_mb = round(peak / 1024 / 1024, 2)
+    return {
+        'rows': stream.rows,
+        'rows_per_sec': round(stream.rows / elapsed, 1) if elapsed else 0.0,
+        'compressed_mb': round(size / 1024 / 1024, 2),
+        'peak_mb': peak_mb,
+        'ceiling_mb': ceiling_mb,
+        'errors': 0 if peak_mb <= ceiling_mb else 1,
+    }
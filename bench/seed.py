@@ -0,0 +1,186 @@
+"""
+Подготовка базы для бенчмарков: накатывает db_migrations/ и заполняет таблицы реалистичными объемами.
+
+Данные генерируются на стороне Postgres через generate_series, триггеры на время загрузки
+отключаются (session_replication_role = replica), производные таблицы затем пересчитываются целиком.
+
+    python -m bench.seed --dsn $BENCH_DATABASE_URL --scale small --reset
+"""
+import argparse
+import glob
+import os
+import time
+from typing import Dict
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'db_migrations')
+
+SCALES: Dict[str, Dict[str, int]] = {
+    'tiny': {'users': 1_000, 'orders': 5_000, 'transactions': 20_000, 'notifications': 10_000},
+    'small': {'users': 50_000, 'orders': 250_000, 'transactions': 1_000_000, 'notifications': 500_000},
+    'medium': {'users': 250_000, 'orders': 2_000_000, 'transactions': 10_000_000, 'notifications': 3_000_000},
+    'large': {'users': 1_000_000, 'orders': 10_000_000, 'transactions': 50_000_000, 'notifications': 10_000_000},
+}
+
+# Диапазон telegram_id засеянных пользователей: BASE_TELEGRAM_ID + 1 .. BASE_TELEGRAM_ID + users
+BASE_TELEGRAM_ID = 1_000_000_000
+CURRENCIES = ('BTC', 'ETH', 'USDT', 'RUB')
+
+
+def reset_schema(cur) -> None:
+    cur.execute('DROP SCHEMA public CASCADE')
+    cur.execute('CREATE SCHEMA public')
+
+
+def apply_migrations(cur) -> None:
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, 'V*.sql'))):
+        with open(path, encoding='utf-8') as f:
+            cur.execute(f.read())
+
+
+def seed(cur, volumes: Dict[str, int]) -> None:
+    users = volumes['users']
+    cur.execute("SET session_replication_role = replica")
+
+    cur.execute(
+        """
+        INSERT INTO users (telegram_id, username, first_name, referral_code, referred_by_id, created_at)
+        SELECT %s + g, 'user' || g, 'User ' || g, 'R' || g,
+               NULL,
+               now() - (random() * interval '365 days')
+        FROM generate_series(1, %s) g
+        """,
+        (BASE_TELEGRAM_ID, users)
+    )
+    # Примерно треть пользователей пришла по реферальной ссылке более раннего пользователя
+    cur.execute(
+        """
+        UPDATE users u SET referred_by_id = r.id
+        FROM users r
+        WHERE u.telegram_id > %s + 1 AND u.telegram_id %% 3 = 0
+          AND r.telegram_id = %s + 1 + ((u.telegram_id - %s) * 7919) %% (u.telegram_id - %s - 1)
+        """,
+        (BASE_TELEGRAM_ID, BASE_TELEGRAM_ID, BASE_TELEGRAM_ID, BASE_TELEGRAM_ID)
+    )
+    cur.execute(
+        """
+        INSERT INTO wallets (user_id, currency, balance, created_at)
+        SELECT u.id, c.currency, round((random() * 1000)::numeric, 8), u.created_at
+        FROM users u CROSS JOIN unnest(%s::text[]) AS c(currency)
+        """,
+        (list(CURRENCIES),)
+    )
+    cur.execute("SELECT min(id), max(id) FROM users")
+    min_id, max_id = cur.fetchone()
+    span = max_id - min_id + 1
+
+    cur.execute(
+        """
+        INSERT INTO exchange_orders (user_id, from_currency, to_currency, from_amount, to_amount,
+                                     exchange_rate, fee, status, completed_at, created_at)
+        SELECT x.user_id, r.from_currency, r.to_currency, x.amount, x.amount / r.rate, r.rate,
+               x.amount / r.rate * 0.01, x.status,
+               CASE WHEN x.status = 'completed' THEN x.created_at + interval '5 minutes' END,
+               x.created_at
+        FROM (
+            SELECT g,
+                   %s + (random() * (%s - 1))::bigint AS user_id,
+                   round((random() * 500 + 1)::numeric, 8) AS amount,
+                   (ARRAY['completed', 'completed', 'completed', 'pending', 'cancelled'])[1 + g %% 5] AS status,
+                   now() - random() * interval '365 days' AS created_at
+            FROM generate_series(1, %s) g
+        ) x
+        JOIN (
+            SELECT row_number() OVER (ORDER BY id) - 1 AS idx, COUNT(*) OVER () AS cnt,
+                   from_currency, to_currency, rate
+            FROM exchange_rates
+        ) r ON r.idx = (x.g / 5) %% r.cnt
+        """,
+        (min_id, span, volumes['orders'])
+    )
+    cur.execute(
+        """
+        INSERT INTO transactions (user_id, type, currency, amount, status, crypto_bot_invoice_id, created_at)
+        SELECT %s + (random() * (%s - 1))::bigint,
+               (ARRAY['deposit', 'deposit', 'exchange', 'withdrawal'])[1 + g %% 4],
+               (ARRAY['BTC', 'ETH', 'USDT', 'RUB'])[1 + (g / 4) %% 4],
+               round((random() * 1000)::numeric, 8),
+               'completed',
+               NULL,
+               now() - (random() * interval '365 days')
+        FROM generate_series(1, %s) g
+        """,
+        (min_id, span, volumes['transactions'])
+    )
+    cur.execute(
+        """
+        INSERT INTO notifications (user_id, type, title, message, is_read, created_at)
+        SELECT %s + (random() * (%s - 1))::bigint, 'info', 'Уведомление', 'Тестовое уведомление #' || g,
+               g %% 3 <> 0, now() - (random() * interval '90 days')
+        FROM generate_series(1, %s) g
+        """,
+        (min_id, span, volumes['notifications'])
+    )
+
+    cur.execute("SET session_replication_role = DEFAULT")
+    rebuild_derived(cur)
+
+
+def rebuild_derived(cur) -> None:
+    """Пересчет таблиц, которые в рабочем режиме поддерживаются триггерами и обработчиками"""
+    cur.execute("TRUNCATE user_stats")
+    cur.execute(
+        """
+        INSERT INTO user_stats (user_id, wallets_count, transactions_count, last_activity_at)
+        SELECT u.id, COALESCE(w.cnt, 0), COALESCE(t.cnt, 0), GREATEST(w.last_at, t.last_at, o.last_at)
+        FROM users u
+        LEFT JOIN (SELECT user_id, COUNT(*) AS cnt, MAX(created_at) AS last_at FROM wallets GROUP BY user_id) w
+               ON w.user_id = u.id
+        LEFT JOIN (SELECT user_id, COUNT(*) AS cnt, MAX(created_at) AS last_at FROM transactions GROUP BY user_id) t
+               ON t.user_id = u.id
+        LEFT JOIN (SELECT user_id, MAX(created_at) AS last_at FROM exchange_orders GROUP BY user_id) o
+               ON o.user_id = u.id
+        """
+    )
+    cur.execute('SELECT rebuild_referral_closure()')
+    # Активы на хранении с двойным покрытием остатков: проверка ликвидности идет, но заявки не отклоняет
+    cur.execute("TRUNCATE liquidity_reserves")
+    cur.execute(
+        "INSERT INTO liquidity_reserves (currency, holdings) SELECT currency, SUM(balance) * 2 FROM wallets GROUP BY currency"
+    )
+
+
+def prepare_database(dsn: str, scale: str, reset: bool) -> Dict[str, int]:
+    import psycopg2
+
+    volumes = SCALES[scale]
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        if reset:
+            started = time.perf_counter()
+            reset_schema(cur)
+            apply_migrations(cur)
+            seed(cur, volumes)
+            cur.execute('VACUUM ANALYZE')
+            print(f'[seed] {scale}: {volumes} in {time.perf_counter() - started:.1f}s')
+        cur.execute('SELECT COUNT(*) FROM users')
+        return {'users': cur.fetchone()[0]}
+    finally:
+        cur.close()
+        conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Накатить миграции и засеять базу для бенчмарков')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--reset', action='store_true', help='пересоздать схему public (все данные удаляются)')
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('--dsn или BENCH_DATABASE_URL обязателен')
+    prepare_database(args.dsn, args.scale, args.reset)
+
+
+if __name__ == '__main__':
+    main()
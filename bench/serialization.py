@@ -0,0 +1,167 @@
+"""
+Сравнение сериализации ответов: RealDictCursor + dict(r) + json.dumps(default=str)
+против кортежных строк rows.py + serializer.py (и orjson, если установлен).
+
+    python -m bench.serialization                       # синтетические строки, без базы
+    python -m bench.serialization --dsn $BENCH_DATABASE_URL   # плюс выборка из засеянной базы
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXCHANGE_DIR = os.path.join(ROOT_DIR, 'backend', 'exchange')
+
+ORDER_COLUMNS = ('id', 'user_id', 'from_currency', 'to_currency', 'from_amount', 'to_amount',
+                 'exchange_rate', 'fee', 'status', 'crypto_bot_invoice_id', 'completed_at', 'created_at')
+NOTIFICATION_COLUMNS = ('id', 'user_id', 'type', 'title', 'message', 'is_read', 'related_order_id', 'created_at')
+
+# Результаты, которые отдают обработчики: 100 заявок, 50 уведомлений
+DB_QUERIES = {
+    'exchange_orders': ('SELECT * FROM exchange_orders WHERE user_id = %s ORDER BY created_at DESC LIMIT 100', 100),
+    'notifications': ('SELECT * FROM notifications WHERE user_id = %s ORDER BY created_at DESC LIMIT 50', 50),
+}
+
+
+def _load_backend_modules():
+    sys.path.insert(0, EXCHANGE_DIR)
+    try:
+        import rows
+        import serializer
+    finally:
+        sys.path.remove(EXCHANGE_DIR)
+    return rows, serializer
+
+
+def synthetic_orders(n: int) -> Tuple[List[Dict[str, Any]], List[Tuple[Any, ...]]]:
+    """Одни и те же заявки в двух видах: как их отдает RealDictCursor и как текстовый курсор"""
+    base = datetime(2024, 12, 9, 12, 0, 0, 123456)
+    typed, text = [], []
+    for i in range(n):
+        created = base - timedelta(minutes=i * 7)
+        values = (
+            1000 + i, 42, 'USDT', 'BTC', Decimal('150.00000000'), Decimal('0.00152345'),
+            Decimal('0.00001015'), Decimal('3.00000000'), 'completed', None, created, created,
+        )
+        typed.append(dict(zip(ORDER_COLUMNS, values)))
+        text.append(tuple(str(v) if isinstance(v, (Decimal, datetime)) else v for v in values))
+    return typed, text
+
+
+def synthetic_notifications(n: int) -> Tuple[List[Dict[str, Any]], List[Tuple[Any, ...]]]:
+    base = datetime(2024, 12, 9, 12, 0, 0, 654321)
+    typed, text = [], []
+    for i in range(n):
+        created = base - timedelta(minutes=i * 3)
+        values = (5000 + i, 42, 'info', 'Пополнение успешно', f'На ваш счет зачислено {i}.00 USDT',
+                  bool(i % 2), None, created)
+        typed.append(dict(zip(NOTIFICATION_COLUMNS, values)))
+        text.append(tuple(str(v) if isinstance(v, datetime) else v for v in values))
+    return typed, text
+
+
+def _time(fn: Callable[[], Any], min_seconds: float = 0.5) -> float:
+    """Среднее время одного вызова, мкс"""
+    fn()
+    count = 0
+    started = time.perf_counter()
+    while True:
+        fn()
+        count += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return elapsed / count * 1e6
+
+
+def compare_synthetic(rows_module, serializer_module, min_seconds: float) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    for table, (typed, text), columns in (
+        ('exchange_orders', synthetic_orders(100), ORDER_COLUMNS),
+        ('notifications', synthetic_notifications(50), NOTIFICATION_COLUMNS),
+    ):
+        make = rows_module.row_type(table, columns)._make
+
+        def old_path():
+            return json.dumps([dict(r) for r in typed], default=str)
+
+        def new_path():
+            return serializer_module._encode([r._asdict() for r in map(make, text)])
+
+        # Ответы должны совпадать байт в байт
+        assert old_path() == new_path(), f'{table}: serialized output differs'
+
+        entry = {'old_us': _time(old_path, min_seconds), 'new_us': _time(new_path, min_seconds)}
+        if serializer_module.orjson is not None:
+            orjson = serializer_module.orjson
+            entry['orjson_us'] = _time(lambda: orjson.dumps([r._asdict() for r in map(make, text)]).decode(),
+                                       min_seconds)
+        entry['speedup'] = entry['old_us'] / entry['new_us']
+        results[f'synthetic.{table}'] = {k: round(v, 2) for k, v in entry.items()}
+    return results
+
+
+def compare_database(dsn: str, rows_module, serializer_module, min_seconds: float) -> Dict[str, Dict[str, float]]:
+    """Полный путь обработчика на реальных строках: выборка + сериализация"""
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+
+    conn = psycopg2.connect(dsn)
+    results: Dict[str, Dict[str, float]] = {}
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT user_id FROM exchange_orders GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1')
+            row = cur.fetchone()
+        user_id = row[0] if row else 1
+
+        for table, (sql, _) in DB_QUERIES.items():
+            def old_path():
+                cur = conn.cursor(cursor_factory=RealDictCursor)
+                cur.execute(sql, (user_id,))
+                body = json.dumps([dict(r) for r in cur.fetchall()], default=str)
+                cur.close()
+                return body
+
+            def new_path():
+                cur = rows_module.text_cursor(conn)
+                cur.execute(sql, (user_id,))
+                body = serializer_module.rows_json(rows_module.fetch_all(cur, table))
+                cur.close()
+                return body
+
+            entry = {'old_us': _time(old_path, min_seconds), 'new_us': _time(new_path, min_seconds)}
+            entry['speedup'] = entry['old_us'] / entry['new_us']
+            results[f'db.{table}'] = {k: round(v, 2) for k, v in entry.items()}
+    finally:
+        conn.close()
+    return results
+
+
+def check_serialization(dsn: Optional[str] = None, min_seconds: float = 0.5) -> Dict[str, Dict[str, float]]:
+    rows_module, serializer_module = _load_backend_modules()
+    results = compare_synthetic(rows_module, serializer_module, min_seconds)
+    if dsn:
+        results.update(compare_database(dsn, rows_module, serializer_module, min_seconds))
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Бенчмарк сериализации ответов')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--min-seconds', type=float, default=0.5, help='время замера каждого варианта')
+    args = parser.parse_args()
+
+    results = check_serialization(args.dsn, args.min_seconds)
+    print(f"{'case':<28} {'old us':>10} {'new us':>10} {'orjson us':>10} {'speedup':>8}")
+    for name, r in results.items():
+        orjson_us = f"{r['orjson_us']:>10.1f}" if 'orjson_us' in r else f"{'-':>10}"
+        print(f"{name:<28} {r['old_us']:>10.1f} {r['new_us']:>10.1f} {orjson_us} {r['speedup']:>7.2f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+Расчет заявок под параллельной нагрузкой: скорость и сохранность балансов.
+
+    python -m bench.settlement --dsn $BENCH_DATABASE_URL
+    python -m bench.settlement --users 50 --orders-per-user 40 --workers 8 --batch-size 25
+
+Заводит отдельных пользователей с кошельками USDT/RUB и оплаченными заявками, сумма которых у части
+пользователей больше баланса. Потоки рассчитывают заявки параллельно — поодиночке и пакетами, причем
+каждую заявку пытаются рассчитать два потока. Затем проверяется, что балансы не ушли в минус, каждый кошелек
+равен начальному балансу с учетом рассчитанных заявок (нет расхождений), а на каждую рассчитанную заявку
+пришлось ровно две строки transactions. Выход с кодом 1 при любом нарушении или ошибке потока.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from decimal import Decimal
+from typing import Any, Dict, List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXCHANGE_DIR = os.path.join(ROOT_DIR, 'backend', 'exchange')
+
+INITIAL_BALANCE = Decimal('1000')
+
+
+def _load_settlement():
+    sys.path.insert(0, EXCHANGE_DIR)
+    try:
+        import settlement
+    finally:
+        sys.path.remove(EXCHANGE_DIR)
+    return settlement
+
+
+def _seed(conn, users: int, orders_per_user: int) -> List[int]:
+    cur = conn.cursor()
+    cur.execute('SELECT COALESCE(MAX(telegram_id), 0) + 1 FROM users')
+    base = cur.fetchone()[0]
+    cur.execute(
+        """
+        INSERT INTO users (telegram_id, username, referral_code)
+        SELECT %s + g, 'settle' || (%s + g), 'S' || (%s + g)
+        FROM generate_series(0, %s - 1) g
+        RETURNING id
+        """,
+        (base, base, base, users)
+    )
+    user_ids = [row[0] for row in cur.fetchall()]
+    cur.execute(
+        """
+        INSERT INTO wallets (user_id, currency, balance)
+        SELECT u, c, CASE WHEN c = 'USDT' THEN %s ELSE 0 END
+        FROM unnest(%s::bigint[]) u CROSS JOIN unnest(ARRAY['USDT', 'RUB']) c
+        """,
+        (INITIAL_BALANCE, user_ids)
+    )
+    # Средняя заявка ~40 USDT: при 40 заявках на пользователя баланса хватает примерно на 60% из них
+    cur.execute(
+        """
+        INSERT INTO exchange_orders (user_id, from_currency, to_currency, from_amount, to_amount,
+                                     exchange_rate, fee, status)
+        SELECT u, 'USDT', 'RUB', a, a * 90, 90, a * 0.9, 'paid'
+        FROM unnest(%s::bigint[]) u,
+             LATERAL (SELECT round((random() * 70 + 5)::numeric, 2) AS a FROM generate_series(1, %s)) x
+        RETURNING id
+        """,
+        (user_ids, orders_per_user)
+    )
+    order_ids = [row[0] for row in cur.fetchall()]
+    cur.close()
+    conn.commit()
+    return order_ids
+
+
+def _verify(conn, order_ids: List[int]) -> Dict[str, Any]:
+    cur = conn.cursor()
+    cur.execute(
+        """
+        WITH o AS (
+            SELECT user_id,
+                   SUM(from_amount) FILTER (WHERE status = 'completed') AS debited,
+                   SUM(to_amount - fee) FILTER (WHERE status = 'completed') AS credited
+            FROM exchange_orders WHERE id = ANY(%s) GROUP BY user_id
+        )
+        SELECT COUNT(*) FILTER (WHERE w.balance < 0),
+               COUNT(*) FILTER (WHERE w.currency = 'USDT' AND w.balance <> %s - COALESCE(o.debited, 0)),
+               COUNT(*) FILTER (WHERE w.currency = 'RUB' AND w.balance <> COALESCE(o.credited, 0))
+        FROM o JOIN wallets w ON w.user_id = o.user_id
+        """,
+        (order_ids, INITIAL_BALANCE)
+    )
+    negative, usdt_drift, rub_drift = cur.fetchone()
+    cur.execute("SELECT COUNT(*) FROM exchange_orders WHERE id = ANY(%s) AND status = 'completed'", (order_ids,))
+    completed = cur.fetchone()[0]
+    cur.execute('SELECT COUNT(*) FROM transactions WHERE related_order_id = ANY(%s)', (order_ids,))
+    transactions = cur.fetchone()[0]
+    cur.close()
+    conn.commit()
+    return {
+        'completed': completed,
+        'negative_balances': negative,
+        'drifted_wallets': usdt_drift + rub_drift,
+        'transactions_per_order': round(transactions / completed, 3) if completed else 0,
+    }
+
+
+def check_settlement(dsn: str, users: int = 50, orders_per_user: int = 40, workers: int = 8,
+                     batch_size: int = 25) -> Dict[str, Any]:
+    import psycopg2
+
+    settlement = _load_settlement()
+    conn = psycopg2.connect(dsn)
+    try:
+        order_ids = _seed(conn, users, orders_per_user)
+
+        # Каждая заявка попадает в очередь дважды; половина потоков берет пакеты, половина — по одной
+        work = order_ids * 2
+        random.shuffle(work)
+        lock = threading.Lock()
+        errors: List[str] = []
+        settled = [0]
+
+        def run(batched: bool) -> None:
+            worker_conn = psycopg2.connect(dsn)
+            try:
+                while True:
+                    with lock:
+                        take = batch_size if batched else 1
+                        chunk, work[:take] = work[:take], []
+                    if not chunk:
+                        return
+                    if batched:
+                        done = len(settlement.settle_batch(worker_conn, chunk)['settled'])
+                    else:
+                        try:
+                            done = 1 if settlement.settle_order(worker_conn, chunk[0]) else 0
+                            worker_conn.commit()
+                        except ValueError:
+                            worker_conn.rollback()
+                            done = 0
+                    with lock:
+                        settled[0] += done
+            except Exception as e:
+                errors.append(f'{type(e).__name__}: {e}')
+            finally:
+                worker_conn.close()
+
+        threads = [threading.Thread(target=run, args=(i % 2 == 0,)) for i in range(workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - started
+
+        result = _verify(conn, order_ids)
+        result.update({
+            'orders': len(order_ids),
+            'reported_settled': settled[0],
+            'errors': errors,
+            'seconds': round(seconds, 3),
+            'settlements_per_sec': round(result['completed'] / seconds) if seconds else 0,
+        })
+        return result
+    finally:
+        conn.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Расчет заявок под параллельной нагрузкой')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--orders-per-user', type=int, default=40)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=25)
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('--dsn или BENCH_DATABASE_URL обязателен')
+
+    result = check_settlement(args.dsn, args.users, args.orders_per_user, args.workers, args.batch_size)
+    print(result)
+    ok = (not result['errors'] and not result['negative_balances'] and not result['drifted_wallets']
+          and result['reported_settled'] == result['completed'] and result['transactions_per_order'] in (0, 2))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+"""
+Внутренние переводы: пропускная способность при множестве отправителей и одном горячем получателе.
+
+    python -m bench.transfers --dsn $BENCH_DATABASE_URL
+    python -m bench.transfers --senders 500 --transfers-per-sender 40 --workers 32
+
+Заводит мерчанта и отправителей с кошельками USDT. Потоки параллельно переводят мерчанту, а часть переводов
+идет обратно от мерчанта отправителям — так горячий кошелек одновременно и получатель, и отправитель.
+После остановки потоков очередь отложенных зачислений сбрасывается flush_credits.
+
+Проверяется, что балансы не ушли в минус, каждый кошелек равен начальному балансу с учетом выполненных
+переводов, зачислений в pending не осталось, на каждый перевод пришлись пара строк transactions
+и два уведомления, а user_stats.transactions_count совпадает с числом строк transactions пользователя. Выход с кодом 1 при любом нарушении или ошибке потока.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from decimal import Decimal
+from typing import Any, Dict, List, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRANSFERS_DIR = os.path.join(ROOT_DIR, 'backend', 'transfers')
+
+INITIAL_BALANCE = Decimal('1000')
+MERCHANT_BALANCE = Decimal('100000')
+
+
+def _load_transfers():
+    sys.path.insert(0, TRANSFERS_DIR)
+    try:
+        import transfers
+    finally:
+        sys.path.remove(TRANSFERS_DIR)
+    return transfers
+
+
+def _seed(conn, senders: int) -> Tuple[int, List[int]]:
+    cur = conn.cursor()
+    cur.execute('SELECT COALESCE(MAX(telegram_id), 0) + 1 FROM users')
+    base = cur.fetchone()[0]
+    cur.execute(
+        """
+        INSERT INTO users (telegram_id, username, referral_code)
+        SELECT %s + g, 'transfer' || (%s + g), 'T' || (%s + g)
+        FROM generate_series(0, %s) g
+        ORDER BY g
+        RETURNING id
+        """,
+        (base, base, base, senders)
+    )
+    merchant, *sender_ids = [row[0] for row in cur.fetchall()]
+    cur.execute(
+        """
+        INSERT INTO wallets (user_id, currency, balance)
+        SELECT u, 'USDT', CASE WHEN u = %s THEN %s ELSE %s END
+        FROM unnest(%s::bigint[]) u
+        """,
+        (merchant, MERCHANT_BALANCE, INITIAL_BALANCE, [merchant] + sender_ids)
+    )
+    cur.close()
+    conn.commit()
+    return merchant, sender_ids
+
+
+def _verify(conn, user_ids: List[int], merchant: int) -> Dict[str, Any]:
+    cur = conn.cursor()
+    cur.execute(
+        """
+        WITH moved AS (
+            SELECT user_id,
+                   COALESCE(SUM(amount) FILTER (WHERE type = 'transfer_in' AND status = 'completed'), 0)
+                   - COALESCE(SUM(amount) FILTER (WHERE type = 'transfer_out'), 0) AS delta
+            FROM transactions
+            WHERE user_id = ANY(%(users)s) AND type IN ('transfer_in', 'transfer_out')
+            GROUP BY user_id
+        )
+        SELECT COUNT(*) FILTER (WHERE w.balance < 0),
+               COUNT(*) FILTER (WHERE w.balance <> CASE WHEN w.user_id = %(merchant)s THEN %(merchant_balance)s
+                                                        ELSE %(initial)s END + COALESCE(m.delta, 0))
+        FROM wallets w LEFT JOIN moved m ON m.user_id = w.user_id
+        WHERE w.user_id = ANY(%(users)s) AND w.currency = 'USDT'
+        """,
+        {'users': user_ids, 'merchant': merchant, 'merchant_balance': MERCHANT_BALANCE, 'initial': INITIAL_BALANCE}
+    )
+    negative, drifted = cur.fetchone()
+    cur.execute(
+        """
+        SELECT COUNT(*) FILTER (WHERE type = 'transfer_out'),
+               COUNT(*) FILTER (WHERE type = 'transfer_in'),
+               COUNT(*) FILTER (WHERE type = 'transfer_in' AND status = 'pending')
+        FROM transactions WHERE user_id = ANY(%s) AND type IN ('transfer_in', 'transfer_out')
+        """,
+        (user_ids,)
+    )
+    outgoing, incoming, pending = cur.fetchone()
+    cur.execute("SELECT COUNT(*) FROM notifications WHERE user_id = ANY(%s) AND type = 'transfer'", (user_ids,))
+    notifications = cur.fetchone()[0]
+    cur.execute(
+        """
+        SELECT COUNT(*) FROM (
+            SELECT u.id, COALESCE(s.transactions_count, 0) AS counted,
+                   (SELECT COUNT(*) FROM transactions t WHERE t.user_id = u.id) AS actual
+            FROM unnest(%s::bigint[]) u(id) LEFT JOIN user_stats s ON s.user_id = u.id
+        ) c WHERE counted <> actual
+        """,
+        (user_ids,)
+    )
+    stats_drift = cur.fetchone()[0]
+    cur.close()
+    conn.commit()
+    return {
+        'negative_balances': negative,
+        'drifted_wallets': drifted,
+        'transfer_out_rows': outgoing,
+        'transfer_in_rows': incoming,
+        'left_pending': pending,
+        'notifications': notifications,
+        'stats_drift': stats_drift,
+    }
+
+
+def check_transfers(dsn: str, senders: int = 200, transfers_per_sender: int = 50, workers: int = 16,
+                    payback_share: float = 0.1) -> Dict[str, Any]:
+    import psycopg2
+
+    transfers = _load_transfers()
+    conn = psycopg2.connect(dsn)
+    try:
+        merchant, sender_ids = _seed(conn, senders)
+
+        work: List[Tuple[int, int, Decimal]] = []
+        for sender in sender_ids:
+            for _ in range(transfers_per_sender):
+                amount = Decimal(random.randint(1, 2000)) / 100
+                if random.random() < payback_share:
+                    work.append((merchant, sender, amount))
+                else:
+                    work.append((sender, merchant, amount))
+        random.shuffle(work)
+
+        lock = threading.Lock()
+        errors: List[str] = []
+        counts = {'completed': 0, 'pending': 0, 'insufficient': 0, 'flushed': 0}
+
+        def run() -> None:
+            worker_conn = psycopg2.connect(dsn)
+            local = dict.fromkeys(counts, 0)
+            try:
+                while True:
+                    with lock:
+                        if not work:
+                            break
+                        sender, recipient, amount = work.pop()
+                    try:
+                        result = transfers.transfer(worker_conn, sender, recipient, 'USDT', amount)
+                    except transfers.InsufficientFunds:
+                        local['insufficient'] += 1
+                        continue
+                    local[result['credit_status']] += 1
+                    local['flushed'] += result['flushed']
+            except Exception as e:
+                errors.append(f'{type(e).__name__}: {e}')
+            finally:
+                worker_conn.close()
+                with lock:
+                    for key, value in local.items():
+                        counts[key] += value
+
+        total = len(work)
+        threads = [threading.Thread(target=run) for _ in range(workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - started
+
+        flushed = transfers.flush_credits(conn)
+        result = _verify(conn, [merchant] + sender_ids, merchant)
+        done = counts['completed'] + counts['pending']
+        result.update({
+            'transfers': total,
+            'done': done,
+            'credited_directly': counts['completed'],
+            'queued_credits': counts['pending'],
+            'flushed_by_transfers': counts['flushed'],
+            'flushed_at_end': flushed['credits'],
+            'insufficient': counts['insufficient'],
+            'errors': errors,
+            'seconds': round(seconds, 3),
+            'transfers_per_sec': round(done / seconds) if seconds else 0,
+        })
+        return result
+    finally:
+        conn.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Внутренние переводы на горячего получателя')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--senders', type=int, default=200)
+    parser.add_argument('--transfers-per-sender', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--payback-share', type=float, default=0.1)
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('--dsn или BENCH_DATABASE_URL обязателен')
+
+    random.seed(0)
+    result = check_transfers(args.dsn, args.senders, args.transfers_per_sender, args.workers, args.payback_share)
+    print(result)
+    ok = (not result['errors'] and not result['negative_balances'] and not result['drifted_wallets']
+          and not result['left_pending'] and not result['stats_drift'] and result['transfer_out_rows'] == result['done']
+          and result['transfer_in_rows'] == result['done'] and result['notifications'] == 2 * result['done'])
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+-- Счетчики активности пользователей для списка в админ-панели.
+-- Поддерживаются триггерами, чтобы список не считал JOIN по wallets и transactions.
+CREATE TABLE user_stats (
+    user_id BIGINT PRIMARY KEY REFERENCES users(id),
+    wallets_count INTEGER NOT NULL DEFAULT 0,
+    transactions_count BIGINT NOT NULL DEFAULT 0,
+    last_activity_at TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION user_stats_wallets_trg() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO user_stats (user_id, wallets_count, last_activity_at)
+        VALUES (NEW.user_id, 1, NEW.created_at)
+        ON CONFLICT (user_id) DO UPDATE
+        SET wallets_count = user_stats.wallets_count + 1,
+            last_activity_at = GREATEST(user_stats.last_activity_at, EXCLUDED.last_activity_at);
+        RETURN NEW;
+    END IF;
+    UPDATE user_stats SET wallets_count = wallets_count - 1 WHERE user_id = OLD.user_id;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_stats_transactions_trg() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO user_stats (user_id, transactions_count, last_activity_at)
+        VALUES (NEW.user_id, 1, NEW.created_at)
+        ON CONFLICT (user_id) DO UPDATE
+        SET transactions_count = user_stats.transactions_count + 1,
+            last_activity_at = GREATEST(user_stats.last_activity_at, EXCLUDED.last_activity_at);
+        RETURN NEW;
+    END IF;
+    UPDATE user_stats SET transactions_count = transactions_count - 1 WHERE user_id = OLD.user_id;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_stats_orders_trg() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO user_stats (user_id, last_activity_at)
+    VALUES (NEW.user_id, NEW.created_at)
+    ON CONFLICT (user_id) DO UPDATE
+    SET last_activity_at = GREATEST(user_stats.last_activity_at, EXCLUDED.last_activity_at);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_user_stats_wallets
+    AFTER INSERT OR DELETE ON wallets
+    FOR EACH ROW EXECUTE FUNCTION user_stats_wallets_trg();
+
+CREATE TRIGGER trg_user_stats_transactions
+    AFTER INSERT OR DELETE ON transactions
+    FOR EACH ROW EXECUTE FUNCTION user_stats_transactions_trg();
+
+CREATE TRIGGER trg_user_stats_orders
+    AFTER INSERT ON exchange_orders
+    FOR EACH ROW EXECUTE FUNCTION user_stats_orders_trg();
+
+-- Первичное заполнение: агрегируем каждую таблицу отдельно, без перемножения строк
+INSERT INTO user_stats (user_id, wallets_count, transactions_count, last_activity_at)
+SELECT u.id,
+       COALESCE(w.cnt, 0),
+       COALESCE(t.cnt, 0),
+       GREATEST(w.last_at, t.last_at, o.last_at)
+FROM users u
+LEFT JOIN (SELECT user_id, COUNT(*) AS cnt, MAX(created_at) AS last_at FROM wallets GROUP BY user_id) w
+       ON w.user_id = u.id
+LEFT JOIN (SELECT user_id, COUNT(*) AS cnt, MAX(created_at) AS last_at FROM transactions GROUP BY user_id) t
+       ON t.user_id = u.id
+LEFT JOIN (SELECT user_id, MAX(created_at) AS last_at FROM exchange_orders GROUP BY user_id) o
+       ON o.user_id = u.id
+ON CONFLICT (user_id) DO NOTHING;
+
+-- Постраничный вывод по дате регистрации без сортировки всей таблицы
+CREATE INDEX idx_users_created_at_id ON users (created_at DESC, id DESC);
+
+-- Поиск в админке по username / telegram_id / referral_code
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX idx_users_username_trgm ON users USING gin (username gin_trgm_ops);
+CREATE INDEX idx_users_telegram_id_trgm ON users USING gin ((telegram_id::text) gin_trgm_ops);
+CREATE INDEX idx_users_referral_code_trgm ON users USING gin (referral_code gin_trgm_ops);
@@ -0,0 +1,3 @@
+-- Keyset-индексы для потоковой выгрузки и списков в админ-панели, упорядоченных по времени
+CREATE INDEX idx_transactions_created_at_id ON transactions (created_at, id);
+CREATE INDEX idx_exchange_orders_created_at_id ON exchange_orders (created_at, id);
@@ -0,0 +1,3 @@
+-- Колонки, которые уже используют обработчики crypto-webhook и telegram-bot
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS crypto_bot_invoice_id VARCHAR(255);
+ALTER TABLE users ADD COLUMN IF NOT EXISTS last_name VARCHAR(255);
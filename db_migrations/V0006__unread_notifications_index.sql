@@ -0,0 +1,2 @@
+-- Страница непрочитанных уведомлений и их количество для bootstrap
+CREATE INDEX idx_notifications_unread ON notifications (user_id, created_at DESC) WHERE is_read = FALSE;
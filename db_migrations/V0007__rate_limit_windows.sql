@@ -0,0 +1,11 @@
+-- Общие для всех контейнеров окна лимитов частоты (RATE_LIMIT_BACKEND=postgres).
+-- Счетчики живут не дольше пары окон, поэтому таблица не пишется в WAL
+CREATE UNLOGGED TABLE rate_limit_windows (
+    key VARCHAR(200) NOT NULL,
+    window_id BIGINT NOT NULL,
+    used INTEGER NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (key, window_id)
+);
+
+CREATE INDEX idx_rate_limit_windows_expires ON rate_limit_windows (expires_at);
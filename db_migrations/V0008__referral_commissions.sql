@@ -0,0 +1,69 @@
+-- Замыкание реферального дерева: все предки каждого пользователя с глубиной (1 — прямой реферер).
+-- Поддерживается auth при регистрации; начисления и аналитика читают его вместо рекурсии по referred_by_id
+CREATE TABLE referral_closure (
+    ancestor_id BIGINT NOT NULL REFERENCES users(id),
+    descendant_id BIGINT NOT NULL REFERENCES users(id),
+    depth INTEGER NOT NULL CHECK (depth > 0),
+    PRIMARY KEY (ancestor_id, descendant_id)
+);
+
+CREATE INDEX idx_referral_closure_descendant ON referral_closure (descendant_id, depth);
+
+-- Начисленные рефереру комиссии: одна строка на заявку и получателя, повторная обработка заявки ничего не добавляет
+CREATE TABLE referral_commissions (
+    id BIGSERIAL PRIMARY KEY,
+    order_id BIGINT NOT NULL REFERENCES exchange_orders(id),
+    beneficiary_id BIGINT NOT NULL REFERENCES users(id),
+    referral_id BIGINT NOT NULL REFERENCES users(id),
+    depth INTEGER NOT NULL,
+    fee_rub DECIMAL(20, 8) NOT NULL,
+    amount DECIMAL(20, 8) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (order_id, beneficiary_id)
+);
+
+CREATE INDEX idx_referral_commissions_beneficiary ON referral_commissions (beneficiary_id, created_at DESC);
+
+-- Отметка, до которой обработаны завершенные заявки: (completed_at, id)
+CREATE TABLE referral_accrual_state (
+    name VARCHAR(50) PRIMARY KEY,
+    mark_at TIMESTAMP NOT NULL,
+    mark_id BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO referral_accrual_state (name, mark_at, mark_id) VALUES ('commissions', '-infinity', 0);
+
+-- Завершенные заявки в порядке завершения
+CREATE INDEX idx_exchange_orders_completed ON exchange_orders (completed_at, id) WHERE status = 'completed';
+
+-- Полная пересборка замыкания по поколениям: каждый шаг — один INSERT ... SELECT на уровень глубины
+CREATE OR REPLACE FUNCTION rebuild_referral_closure() RETURNS INTEGER AS $$
+DECLARE
+    level INTEGER := 1;
+    added INTEGER;
+BEGIN
+    TRUNCATE referral_closure;
+
+    INSERT INTO referral_closure (ancestor_id, descendant_id, depth)
+    SELECT referred_by_id, id, 1 FROM users
+    WHERE referred_by_id IS NOT NULL AND referred_by_id <> id;
+
+    LOOP
+        INSERT INTO referral_closure (ancestor_id, descendant_id, depth)
+        SELECT u.referred_by_id, c.descendant_id, c.depth + 1
+        FROM referral_closure c
+        JOIN users u ON u.id = c.ancestor_id
+        WHERE c.depth = level AND u.referred_by_id IS NOT NULL
+        ON CONFLICT (ancestor_id, descendant_id) DO NOTHING;
+        GET DIAGNOSTICS added = ROW_COUNT;
+        -- ON CONFLICT обрывает цикл в испорченном дереве с петлей
+        EXIT WHEN added = 0 OR level >= 1000;
+        level := level + 1;
+    END LOOP;
+
+    RETURN level;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT rebuild_referral_closure();
@@ -0,0 +1,71 @@
+-- Размер поддерева каждого реферера для аналитики админки.
+-- Поддерживается триггером на referral_closure, чтобы рейтинг рефереров не считал GROUP BY по всему замыканию
+CREATE TABLE referral_subtree_stats (
+    user_id BIGINT PRIMARY KEY REFERENCES users(id),
+    direct_count INTEGER NOT NULL DEFAULT 0,
+    descendants_count BIGINT NOT NULL DEFAULT 0,
+    max_depth INTEGER NOT NULL DEFAULT 0
+);
+
+-- Рейтинг по размеру поддерева читается с начала индекса
+CREATE INDEX idx_referral_subtree_stats_size ON referral_subtree_stats (descendants_count DESC, user_id);
+
+-- Триггер уровня оператора: регистрация добавляет в замыкание несколько строк одним INSERT,
+-- пересборка — по INSERT на поколение; счетчики обновляются одним сгруппированным upsert на оператор
+CREATE OR REPLACE FUNCTION referral_subtree_stats_trg() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO referral_subtree_stats (user_id, direct_count, descendants_count, max_depth)
+    SELECT ancestor_id, COUNT(*) FILTER (WHERE depth = 1), COUNT(*), MAX(depth)
+    FROM added
+    GROUP BY ancestor_id
+    ON CONFLICT (user_id) DO UPDATE
+    SET direct_count = referral_subtree_stats.direct_count + EXCLUDED.direct_count,
+        descendants_count = referral_subtree_stats.descendants_count + EXCLUDED.descendants_count,
+        max_depth = GREATEST(referral_subtree_stats.max_depth, EXCLUDED.max_depth);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_referral_subtree_stats
+    AFTER INSERT ON referral_closure
+    REFERENCING NEW TABLE AS added
+    FOR EACH STATEMENT EXECUTE FUNCTION referral_subtree_stats_trg();
+
+-- Завершенные заявки пользователя с суммой — объем поддерева считается только по индексу
+CREATE INDEX idx_exchange_orders_user_completed ON exchange_orders (user_id, completed_at)
+    INCLUDE (from_currency, from_amount) WHERE status = 'completed';
+
+-- Пересборка теперь сбрасывает и счетчики: TRUNCATE триггер не вызывает, а INSERT-ы пересборки заполнят их заново
+CREATE OR REPLACE FUNCTION rebuild_referral_closure() RETURNS INTEGER AS $$
+DECLARE
+    level INTEGER := 1;
+    added INTEGER;
+BEGIN
+    TRUNCATE referral_closure, referral_subtree_stats;
+
+    INSERT INTO referral_closure (ancestor_id, descendant_id, depth)
+    SELECT referred_by_id, id, 1 FROM users
+    WHERE referred_by_id IS NOT NULL AND referred_by_id <> id;
+
+    LOOP
+        INSERT INTO referral_closure (ancestor_id, descendant_id, depth)
+        SELECT u.referred_by_id, c.descendant_id, c.depth + 1
+        FROM referral_closure c
+        JOIN users u ON u.id = c.ancestor_id
+        WHERE c.depth = level AND u.referred_by_id IS NOT NULL
+        ON CONFLICT (ancestor_id, descendant_id) DO NOTHING;
+        GET DIAGNOSTICS added = ROW_COUNT;
+        -- ON CONFLICT обрывает цикл в испорченном дереве с петлей
+        EXIT WHEN added = 0 OR level >= 1000;
+        level := level + 1;
+    END LOOP;
+
+    RETURN level;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Первичное заполнение счетчиков по уже построенному замыканию
+INSERT INTO referral_subtree_stats (user_id, direct_count, descendants_count, max_depth)
+SELECT ancestor_id, COUNT(*) FILTER (WHERE depth = 1), COUNT(*), MAX(depth)
+FROM referral_closure
+GROUP BY ancestor_id;
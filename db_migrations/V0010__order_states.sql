@@ -0,0 +1,12 @@
+-- Статусы заявок на обмен — только из машины состояний backend/exchange/orders.py.
+-- "processing" из админки становится awaiting_payment
+UPDATE exchange_orders SET status = 'awaiting_payment' WHERE status = 'processing';
+
+-- NOT VALID сразу проверяет новые записи, не сканируя таблицу под эксклюзивной блокировкой;
+-- VALIDATE проверяет старые строки, не блокируя запись
+ALTER TABLE exchange_orders ADD CONSTRAINT exchange_orders_status_check
+    CHECK (status IN ('pending', 'awaiting_payment', 'paid', 'completed', 'expired', 'cancelled')) NOT VALID;
+ALTER TABLE exchange_orders VALIDATE CONSTRAINT exchange_orders_status_check;
+
+-- Очередь сборщика просроченных заявок: в индексе только pending-заявки, закрытые из него выпадают
+CREATE INDEX idx_exchange_orders_pending ON exchange_orders (created_at) WHERE status = 'pending';
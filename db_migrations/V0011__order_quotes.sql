@@ -0,0 +1,4 @@
+-- Котировка, по которой создана заявка: одна котировка — не больше одной заявки
+ALTER TABLE exchange_orders ADD COLUMN quote_id VARCHAR(32);
+
+CREATE UNIQUE INDEX idx_exchange_orders_quote_id ON exchange_orders (quote_id) WHERE quote_id IS NOT NULL;
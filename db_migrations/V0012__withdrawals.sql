@@ -0,0 +1,13 @@
+-- Выводы средств — строки transactions с type = 'withdrawal'.
+-- pending -> processing (захвачен обработчиком выплат) -> completed / failed; при failed сумма возвращается на кошелек
+ALTER TABLE transactions ADD COLUMN payout_attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE transactions ADD COLUMN payout_error TEXT;
+ALTER TABLE transactions ADD COLUMN processed_at TIMESTAMP;
+
+-- Очередь обработчика выплат: только незавершенные выводы, в порядке создания
+CREATE INDEX idx_transactions_withdrawals_queue ON transactions (id)
+    WHERE type = 'withdrawal' AND status IN ('pending', 'processing');
+
+-- История выводов пользователя
+CREATE INDEX idx_transactions_user_withdrawals ON transactions (user_id, created_at DESC)
+    WHERE type = 'withdrawal';
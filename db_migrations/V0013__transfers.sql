@@ -0,0 +1,8 @@
+-- Внутренние переводы между пользователями: пара строк transactions transfer_out (отправитель) и transfer_in
+-- (получатель); transfer_in ссылается на transfer_out. transfer_in в статусе pending — зачисление, отложенное
+-- до пакетного зачисления на кошелек получателя
+ALTER TABLE transactions ADD COLUMN related_transaction_id BIGINT REFERENCES transactions(id);
+
+-- Очередь отложенных зачислений по кошельку получателя
+CREATE INDEX idx_transactions_pending_credits ON transactions (user_id, currency)
+    WHERE type = 'transfer_in' AND status = 'pending';
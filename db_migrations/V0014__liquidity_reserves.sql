@@ -0,0 +1,17 @@
+-- Активы на хранении по валютам: задает оператор, пополнения увеличивают, выплаты уменьшают.
+-- Свободная ликвидность = holdings - остатки кошельков - обещанное по открытым заявкам и выводам
+CREATE TABLE liquidity_reserves (
+    currency VARCHAR(20) PRIMARY KEY,
+    holdings DECIMAL(30, 8) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Заявка создана сверх свободной ликвидности to_currency (LIQUIDITY_MODE=flag)
+ALTER TABLE exchange_orders ADD COLUMN liquidity_flagged BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Сверка обещанного по открытым заявкам читает только индекс
+CREATE INDEX idx_exchange_orders_open_commitments ON exchange_orders (to_currency) INCLUDE (to_amount, fee)
+    WHERE status IN ('pending', 'awaiting_payment', 'paid');
+
+CREATE INDEX idx_exchange_orders_liquidity_flagged ON exchange_orders (created_at)
+    WHERE liquidity_flagged;
@@ -0,0 +1,26 @@
+-- Снимок состояния оценщика риска (скользящие окна и базовые уровни пользователя), чтобы пережить перезапуск.
+-- Потеря снимка лишь обнуляет окна, поэтому таблица не пишется в WAL
+CREATE UNLOGGED TABLE risk_state (
+    user_id BIGINT PRIMARY KEY,
+    state JSONB NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Сработавшие правила: flag — только запись, hold — операция задержана, block — пользователь заблокирован
+CREATE TABLE risk_events (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users(id),
+    kind VARCHAR(20) NOT NULL,
+    currency VARCHAR(20) NOT NULL,
+    amount DECIMAL(20, 8) NOT NULL,
+    action VARCHAR(10) NOT NULL,
+    reasons TEXT[] NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_risk_events_created_at ON risk_events (created_at DESC);
+CREATE INDEX idx_risk_events_user_id ON risk_events (user_id, created_at DESC);
+
+-- Задержанные пополнения (status = 'held') ждут решения администратора
+CREATE INDEX idx_transactions_held_deposits ON transactions (created_at)
+    WHERE type = 'deposit' AND status = 'held';
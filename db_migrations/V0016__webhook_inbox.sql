@@ -0,0 +1,19 @@
+-- Входящие webhook Crypto Bot: обработчик только проверяет подпись и пишет событие сюда, зачисляет обработчик очереди.
+-- update_id уникален — повторная доставка того же события ничего не добавляет
+CREATE TABLE webhook_inbox (
+    id BIGSERIAL PRIMARY KEY,
+    update_id BIGINT NOT NULL UNIQUE,
+    update_type VARCHAR(50) NOT NULL,
+    payload JSONB NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP
+);
+
+-- Очередь обработчика: только необработанные события, в порядке поступления
+CREATE INDEX idx_webhook_inbox_pending ON webhook_inbox (id) WHERE processed_at IS NULL;
+
+-- Проверка, не зачислен ли уже счет, для пачки событий одним запросом
+CREATE INDEX idx_transactions_deposit_invoices ON transactions (crypto_bot_invoice_id)
+    WHERE type = 'deposit';
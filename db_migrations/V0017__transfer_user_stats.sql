@@ -0,0 +1,28 @@
+-- Строки внутренних переводов (transfer_out / transfer_in) учитывает в user_stats сам запрос перевода,
+-- а не построчный триггер: триггер держал бы строку user_stats горячего получателя до конца транзакции
+-- и брал строки отправителя и получателя в разном порядке. Перевод обновляет обе строки одним INSERT
+-- по возрастанию user_id, а получателя — только вместе с зачислением на его кошелек
+DROP TRIGGER trg_user_stats_transactions ON transactions;
+
+CREATE TRIGGER trg_user_stats_transactions
+    AFTER INSERT ON transactions
+    FOR EACH ROW
+    WHEN (NEW.type NOT IN ('transfer_out', 'transfer_in'))
+    EXECUTE FUNCTION user_stats_transactions_trg();
+
+-- Отложенное зачисление еще не учтено в счетчике получателя
+CREATE TRIGGER trg_user_stats_transactions_delete
+    AFTER DELETE ON transactions
+    FOR EACH ROW
+    WHEN (OLD.type <> 'transfer_in' OR OLD.status IS DISTINCT FROM 'pending')
+    EXECUTE FUNCTION user_stats_transactions_trg();
+
+-- Отложенные зачисления, которые успел учесть прежний триггер, будут учтены еще раз при зачислении
+UPDATE user_stats s
+SET transactions_count = s.transactions_count - p.cnt
+FROM (
+    SELECT user_id, COUNT(*) AS cnt FROM transactions
+    WHERE type = 'transfer_in' AND status = 'pending'
+    GROUP BY user_id
+) p
+WHERE s.user_id = p.user_id;
@@ -0,0 +1,8 @@
+-- Счет Crypto Bot зачисляется не более одного раза: проверка обработчика очереди читает уже зачисленные счета,
+-- но две параллельные пачки с одним счетом проходят ее обе. Уникальный индекс заменяет обычный из V0016,
+-- а пачка вставляет пополнения с ON CONFLICT DO NOTHING и зачисляет только вставленные строки.
+-- Если в таблице уже есть повторно зачисленные счета, миграция остановится на них — их нужно разобрать вручную
+CREATE UNIQUE INDEX idx_transactions_deposit_invoices_unique ON transactions (crypto_bot_invoice_id)
+    WHERE type = 'deposit';
+
+DROP INDEX idx_transactions_deposit_invoices;
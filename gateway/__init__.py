@@ -0,0 +1,3 @@
+"""
+Локальный HTTP-шлюз: запускает все функции из backend/ в одном процессе
+"""
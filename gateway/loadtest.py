@@ -0,0 +1,140 @@
+"""
+Нагрузочный тест шлюза: держит N keep-alive соединений на маршрут и печатает RPS и задержки по маршрутам.
+
+Запуск (шлюз должен быть поднят):
+    python -m gateway.loadtest --url http://127.0.0.1:8080 --duration 30 --connections 8
+    python -m gateway.loadtest --scenarios my_scenarios.json
+
+Формат сценариев: [{"name": "...", "method": "GET", "path": "/rates", "body": {...}, "headers": {...}}]
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+DEFAULT_SCENARIOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'loadtest.json')
+
+
+@dataclass
+class Result:
+    name: str
+    ok: int = 0
+    failed: int = 0
+    statuses: Dict[int, int] = field(default_factory=dict)
+    latencies: List[float] = field(default_factory=list)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def build_request(host: str, scenario: Dict[str, Any]) -> bytes:
+    body = scenario.get('body')
+    payload = b'' if body is None else json.dumps(body).encode()
+    headers = {'Host': host, 'Connection': 'keep-alive', 'Content-Length': str(len(payload))}
+    if payload:
+        headers['Content-Type'] = 'application/json'
+    headers.update(scenario.get('headers') or {})
+    head = f"{scenario.get('method', 'GET')} {scenario['path']} HTTP/1.1\r\n"
+    head += ''.join(f'{k}: {v}\r\n' for k, v in headers.items())
+    return (head + '\r\n').encode('latin-1') + payload
+
+
+async def read_response(reader: asyncio.StreamReader) -> int:
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ', 2)[1])
+    length = 0
+    for line in lines[1:]:
+        key, _, value = line.partition(':')
+        if key.strip().lower() == 'content-length':
+            length = int(value.strip())
+    if length:
+        await reader.readexactly(length)
+    return status
+
+
+async def worker(host: str, port: int, scenario: Dict[str, Any], deadline: float, result: Result) -> None:
+    request = build_request(f'{host}:{port}', scenario)
+    reader: Optional[asyncio.StreamReader] = None
+    writer: Optional[asyncio.StreamWriter] = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            started = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status = await read_response(reader)
+            result.latencies.append(time.perf_counter() - started)
+            result.statuses[status] = result.statuses.get(status, 0) + 1
+            if status < 500:
+                result.ok += 1
+            else:
+                result.failed += 1
+        except (ConnectionError, asyncio.IncompleteReadError, OSError):
+            result.failed += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            await asyncio.sleep(0.05)
+    if writer is not None:
+        writer.close()
+
+
+async def run(url: str, scenarios: List[Dict[str, Any]], duration: float, connections: int) -> List[Result]:
+    parts = urlsplit(url)
+    host, port = parts.hostname or '127.0.0.1', parts.port or 80
+    deadline = time.perf_counter() + duration
+    results = [Result(name=s.get('name') or s['path']) for s in scenarios]
+    await asyncio.gather(*(
+        worker(host, port, scenario, deadline, result)
+        for scenario, result in zip(scenarios, results)
+        for _ in range(connections)
+    ))
+    return results
+
+
+def report(results: List[Result], duration: float) -> None:
+    print(f"{'route':<32} {'rps':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}  statuses")
+    total = 0
+    for r in results:
+        count = r.ok + r.failed
+        total += count
+        print(
+            f'{r.name:<32} {count / duration:>9.1f} '
+            f'{percentile(r.latencies, 0.50) * 1000:>8.2f} '
+            f'{percentile(r.latencies, 0.95) * 1000:>8.2f} '
+            f'{percentile(r.latencies, 0.99) * 1000:>8.2f} '
+            f'{r.failed:>7}  {dict(sorted(r.statuses.items()))}'
+        )
+    print(f"{'total':<32} {total / duration:>9.1f}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Нагрузочный тест локального шлюза')
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--scenarios', default=DEFAULT_SCENARIOS)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--connections', type=int, default=4, help='соединений на маршрут')
+    parser.add_argument('--only', action='append', default=[], help='запустить только эти сценарии')
+    args = parser.parse_args(argv)
+
+    with open(args.scenarios, encoding='utf-8') as f:
+        scenarios = json.load(f)
+    if args.only:
+        scenarios = [s for s in scenarios if s.get('name') in args.only]
+
+    results = asyncio.run(run(args.url, scenarios, args.duration, args.connections))
+    report(results, args.duration)
+
+
+if __name__ == '__main__':
+    main()
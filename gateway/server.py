@@ -0,0 +1,372 @@
+"""
+HTTP-шлюз для запуска всех функций backend/ в одном процессе.
+
+Каждая функция импортируется один раз, маршрут /<имя-функции> вызывает ее handler(event, context)
+с тем же event, что и облачная платформа (httpMethod, queryStringParameters, headers, body).
+Блокирующие обработчики выполняются в пуле потоков, для каждого маршрута действует лимит
+одновременных запросов. По SIGINT/SIGTERM шлюз перестает принимать соединения и дожидается
+запросов в обработке.
+
+Запуск:
+    python -m gateway.server --port 8080 --workers 32 --route-limit admin=4
+"""
+import argparse
+import asyncio
+import base64
+import importlib.util
+import json
+import os
+import signal
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+
+@dataclass
+class Context:
+    """Аналог context облачной функции"""
+    request_id: str
+    function_name: str
+    function_version: str = 'local'
+    memory_limit_in_mb: int = 128
+
+
+@dataclass
+class Route:
+    name: str
+    handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]
+    limit: int
+    semaphore: Optional[asyncio.Semaphore] = None
+    requests: int = 0
+    errors: int = 0
+    rejected: int = 0
+    busy_seconds: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+
+
+def discover_functions(backend_dir: str = BACKEND_DIR) -> List[str]:
+    """Имена функций: подкаталоги backend/ с index.py"""
+    return sorted(
+        name for name in os.listdir(backend_dir)
+        if os.path.isfile(os.path.join(backend_dir, name, 'index.py'))
+    )
+
+
+def load_handler(name: str, backend_dir: str = BACKEND_DIR) -> Callable:
+    """
+    Импортирует backend/<name>/index.py под уникальным именем модуля.
+    Каталог функции на время импорта ставится первым в sys.path, чтобы работали
+    соседние модули. Одноименные вспомогательные модули у функций одинаковые,
+    поэтому в процессе загружаются один раз и делят кэши и пулы.
+    """
+    func_dir = os.path.join(backend_dir, name)
+    module_name = 'fn_' + name.replace('-', '_')
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(func_dir, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.path.insert(0, func_dir)
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(func_dir)
+    sys.modules[module_name] = module
+    return module.handler
+
+
+def build_event(method: str, target: str, headers: Dict[str, str], body: bytes,
+                peer: Optional[Tuple[str, int]], request_id: str) -> Dict[str, Any]:
+    """Собирает event в формате облачной функции"""
+    parts = urlsplit(target)
+    query = dict(parse_qsl(parts.query, keep_blank_values=True))
+
+    try:
+        body_text = body.decode('utf-8')
+        is_base64 = False
+    except UnicodeDecodeError:
+        body_text = base64.b64encode(body).decode('ascii')
+        is_base64 = True
+
+    return {
+        'httpMethod': method,
+        'path': parts.path,
+        'headers': headers,
+        'queryStringParameters': query,
+        'body': body_text,
+        'isBase64Encoded': is_base64,
+        'requestContext': {
+            'requestId': request_id,
+            'identity': {'sourceIp': peer[0] if peer else ''},
+        },
+    }
+
+
+def encode_response(status: int, headers: Dict[str, str], body: bytes, keep_alive: bool) -> bytes:
+    try:
+        reason = HTTPStatus(status).phrase
+    except ValueError:
+        reason = ''
+    lines = [f'HTTP/1.1 {status} {reason}']
+    for key, value in headers.items():
+        if key.lower() not in ('content-length', 'connection', 'transfer-encoding'):
+            lines.append(f'{key}: {value}')
+    lines.append(f'Content-Length: {len(body)}')
+    lines.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+def json_response(status: int, payload: Any) -> Tuple[int, Dict[str, str], bytes]:
+    return status, {'Content-Type': 'application/json'}, json.dumps(payload).encode()
+
+
+class Gateway:
+    def __init__(self, routes: Dict[str, Route], workers: int, queue_timeout: float = 5.0,
+                 shutdown_timeout: float = 30.0):
+        self.routes = routes
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='handler')
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.in_flight = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.stopping = False
+        self.started_at = time.time()
+
+    async def start(self, host: str, port: int) -> None:
+        for route in self.routes.values():
+            route.semaphore = asyncio.Semaphore(route.limit)
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+
+    async def shutdown(self) -> None:
+        """Закрывает прием соединений и ждет завершения запросов в обработке"""
+        self.stopping = True
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        try:
+            await asyncio.wait_for(self.idle.wait(), self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            print(f'[gateway] shutdown timeout, {self.in_flight} requests still running', file=sys.stderr)
+        self.executor.shutdown(wait=True)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info('peername')
+        try:
+            while not self.stopping:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body, keep_alive = request
+                status, resp_headers, resp_body = await self.dispatch(method, target, headers, body, peer)
+                keep_alive = keep_alive and not self.stopping
+                writer.write(encode_response(status, resp_headers, resp_body, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:
+            writer.write(encode_response(400, {'Content-Type': 'text/plain'}, str(e).encode(), False))
+        finally:
+            writer.close()
+
+    async def read_request(self, reader: asyncio.StreamReader):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise ValueError('Request header too large')
+        if len(head) > MAX_HEADER_BYTES:
+            raise ValueError('Request header too large')
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            raise ValueError('Malformed request line')
+
+        headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            key, _, value = line.partition(':')
+            headers[key.strip()] = value.strip()
+
+        lower = {k.lower(): v for k, v in headers.items()}
+        if lower.get('transfer-encoding'):
+            raise ValueError('Chunked request bodies are not supported')
+        length = int(lower.get('content-length') or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError('Request body too large')
+        body = await reader.readexactly(length) if length else b''
+
+        connection = lower.get('connection', '').lower()
+        keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+        return method.upper(), target, headers, body, keep_alive
+
+    async def dispatch(self, method: str, target: str, headers: Dict[str, str], body: bytes,
+                       peer) -> Tuple[int, Dict[str, str], bytes]:
+        path = urlsplit(target).path
+        name = path.strip('/').split('/', 1)[0]
+
+        if name == '_health':
+            return json_response(200, {'ok': True, 'uptime': round(time.time() - self.started_at, 1)})
+        if name == '_stats':
+            return json_response(200, self.stats())
+        if name == 'metrics':
+            return self.metrics()
+
+        route = self.routes.get(name)
+        if route is None:
+            return json_response(404, {'error': f'Unknown function: {name}'})
+
+        try:
+            await asyncio.wait_for(route.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            route.rejected += 1
+            status, resp_headers, resp_body = json_response(503, {'error': 'Route is overloaded'})
+            resp_headers['Retry-After'] = '1'
+            return status, resp_headers, resp_body
+
+        request_id = headers.get('X-Request-Id') or str(uuid.uuid4())
+        event = build_event(method, target, headers, body, peer, request_id)
+        context = Context(request_id=request_id, function_name=name)
+
+        self.in_flight += 1
+        self.idle.clear()
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.executor, route.handler, event, context)
+            return self.convert_result(result)
+        except Exception as e:
+            route.errors += 1
+            print(f'[gateway] {name} failed: {e!r}', file=sys.stderr)
+            return json_response(502, {'error': 'Handler failed'})
+        finally:
+            elapsed = time.perf_counter() - started
+            route.requests += 1
+            route.busy_seconds += elapsed
+            if len(route.latencies) < 100000:
+                route.latencies.append(elapsed)
+            route.semaphore.release()
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self.idle.set()
+
+    @staticmethod
+    def convert_result(result: Dict[str, Any]) -> Tuple[int, Dict[str, str], bytes]:
+        status = int(result.get('statusCode', 200))
+        headers = {str(k): str(v) for k, v in (result.get('headers') or {}).items()}
+        body = result.get('body') or ''
+        if result.get('isBase64Encoded'):
+            raw = base64.b64decode(body)
+        elif isinstance(body, bytes):
+            raw = body
+        else:
+            raw = str(body).encode('utf-8')
+        return status, headers, raw
+
+    @staticmethod
+    def metrics() -> Tuple[int, Dict[str, str], bytes]:
+        """Метрики Prometheus: модуль instrumentation общий для всех загруженных функций"""
+        instrumentation = sys.modules.get('instrumentation')
+        text = instrumentation.render_prometheus() if instrumentation else ''
+        return 200, {'Content-Type': 'text/plain; version=0.0.4'}, text.encode()
+
+    def stats(self) -> Dict[str, Any]:
+        routes = {}
+        for name, route in self.routes.items():
+            latencies = sorted(route.latencies)
+            p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+            routes[name] = {
+                'requests': route.requests,
+                'errors': route.errors,
+                'rejected': route.rejected,
+                'limit': route.limit,
+                'avg_ms': round(route.busy_seconds / route.requests * 1000, 2) if route.requests else 0.0,
+                'p95_ms': round(p95 * 1000, 2),
+            }
+        result = {'workers': self.workers, 'in_flight': self.in_flight, 'routes': routes}
+        # Пул соединений и подготовленные запросы общие для всех функций процесса
+        db = sys.modules.get('db')
+        if db is not None and hasattr(db, 'pool_stats'):
+            result['db_pool'] = db.pool_stats()
+        statements = sys.modules.get('statements')
+        if statements is not None:
+            result['statements'] = statements.STATEMENTS.stats()
+        return result
+
+
+def parse_route_limits(values: List[str]) -> Dict[str, int]:
+    limits = {}
+    for item in values:
+        name, _, limit = item.partition('=')
+        limits[name] = int(limit)
+    return limits
+
+
+def build_routes(names: List[str], default_limit: int, limits: Dict[str, int]) -> Dict[str, Route]:
+    return {
+        name: Route(name=name, handler=load_handler(name), limit=limits.get(name, default_limit))
+        for name in names
+    }
+
+
+async def serve(args: argparse.Namespace) -> None:
+    names = args.functions or discover_functions()
+    # Соединений держим столько же, сколько потоков обрабатывают запросы
+    os.environ.setdefault('DB_POOL_SIZE', str(args.workers))
+    routes = build_routes(names, args.default_limit, parse_route_limits(args.route_limit))
+    if args.warmup:
+        # Пул, подготовленные запросы и кэши общие — прогрев каждой функции добавляет только ее хуки
+        for name, route in routes.items():
+            response = route.handler({'warmup': True}, Context(request_id='warmup', function_name=name))
+            print(f'[gateway] warmup {name}: {response.get("body")}')
+    gateway = Gateway(routes, workers=args.workers, queue_timeout=args.queue_timeout,
+                      shutdown_timeout=args.shutdown_timeout)
+    await gateway.start(args.host, args.port)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    print(f'[gateway] listening on {args.host}:{args.port}, workers={args.workers}, routes: {", ".join(routes)}')
+    await stop.wait()
+    print('[gateway] shutting down')
+    await gateway.shutdown()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Локальный HTTP-шлюз для функций backend/')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=(os.cpu_count() or 2) * 8,
+                        help='размер пула потоков для обработчиков')
+    parser.add_argument('--default-limit', type=int, default=16,
+                        help='одновременных запросов на маршрут по умолчанию')
+    parser.add_argument('--route-limit', action='append', default=[], metavar='NAME=N',
+                        help='лимит одновременных запросов для маршрута')
+    parser.add_argument('--queue-timeout', type=float, default=5.0,
+                        help='сколько ждать свободного слота маршрута до ответа 503')
+    parser.add_argument('--shutdown-timeout', type=float, default=30.0)
+    parser.add_argument('--warmup', action='store_true',
+                        help='до приема запросов открыть соединения, подготовить запросы и заполнить кэши')
+    parser.add_argument('functions', nargs='*', help='какие функции поднять (по умолчанию все)')
+    asyncio.run(serve(parser.parse_args(argv)))
+
+
+if __name__ == '__main__':
+    main()
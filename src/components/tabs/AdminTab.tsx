@@ -101,7 +101,11 @@ export default function AdminTab({ mockRates }: AdminTabProps) {
     try {
       const response = await fetch(EXCHANGE_API, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: {
+          'Content-Type': 'application/json',
+          // Завершение заявки проводит расчет по кошелькам и требует ключ админки
+          'X-Admin-Key': localStorage.getItem('adminKey') || ''
+        },
         body: JSON.stringify({
           action: 'update_status',
           order_id: orderId,
@@ -123,15 +127,19 @@ export default function AdminTab({ mockRates }: AdminTabProps) {
   const getStatusBadge = (status: string) => {
     const variants: Record<string, any> = {
       pending: 'secondary',
-      processing: 'default',
+      awaiting_payment: 'default',
+      paid: 'default',
       completed: 'default',
+      expired: 'secondary',
       cancelled: 'destructive'
     };
     
     const labels: Record<string, string> = {
       pending: 'Ожидает',
-      processing: 'В обработке',
+      awaiting_payment: 'В обработке',
+      paid: 'Оплачен',
       completed: 'Выполнен',
+      expired: 'Истек',
       cancelled: 'Отменен'
     };
 
@@ -315,22 +323,13 @@ export default function AdminTab({ mockRates }: AdminTabProps) {
                   {order.status === 'pending' && (
                     <div className="flex gap-2">
                       <Button
-                        onClick={() => updateOrderStatus(order.id, 'processing')}
+                        onClick={() => updateOrderStatus(order.id, 'awaiting_payment')}
                         disabled={loading}
                         className="flex-1"
                       >
                         <Icon name="Clock" size={16} className="mr-2" />
                         В обработку
                       </Button>
-                      <Button
-                        variant="outline"
-                        onClick={() => updateOrderStatus(order.id, 'completed')}
-                        disabled={loading}
-                        className="flex-1"
-                      >
-                        <Icon name="Check" size={16} className="mr-2" />
-                        Выполнить
-                      </Button>
                       <Button
                         variant="destructive"
                         onClick={() => updateOrderStatus(order.id, 'cancelled')}
@@ -341,7 +340,7 @@ export default function AdminTab({ mockRates }: AdminTabProps) {
                     </div>
                   )}
 
-                  {order.status === 'processing' && (
+                  {(order.status === 'awaiting_payment' || order.status === 'paid') && (
                     <div className="flex gap-2">
                       <Button
                         onClick={() => updateOrderStatus(order.id, 'completed')}
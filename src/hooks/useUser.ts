@@ -24,14 +24,20 @@ export function useUser(telegramId: number = 123) {
     try {
       setData(prev => ({ ...prev, loading: true, error: null }));
 
-      const [wallets, orders, rates] = await Promise.all([
-        api.wallets.getAll(telegramId).catch(() => []),
-        api.exchange.getOrders(telegramId).catch(() => []),
-        api.rates.getAll().catch(() => [])
-      ]);
+      // Профиль, кошельки и курсы одним вызовом bootstrap (по initData внутри Telegram); он же выдает
+      // сессионный токен, поэтому остальные запросы идут после него
+      const bootstrap = await api.bootstrap.load(telegramId).catch(() => null);
+      const orders = await api.exchange.getOrders(telegramId).catch(() => []);
+
+      const [wallets, rates] = bootstrap
+        ? [bootstrap.wallets, bootstrap.rates]
+        : await Promise.all([
+            api.wallets.getAll(telegramId).catch(() => []),
+            api.rates.getAll().catch(() => [])
+          ]);
 
       setData({
-        user: null,
+        user: bootstrap ? bootstrap.user : null,
         wallets,
         orders,
         rates,
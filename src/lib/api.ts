@@ -1,4 +1,5 @@
 import funcUrls from '../../backend/func2url.json';
+import { telegramAuth } from '@/utils/telegram';
 
 const API_URLS = {
   auth: funcUrls.auth,
@@ -6,7 +7,20 @@ const API_URLS = {
   notifications: funcUrls.notifications,
   exchange: funcUrls.exchange,
   rates: funcUrls.rates,
-  cryptoBot: funcUrls['crypto-bot']
+  cryptoBot: funcUrls['crypto-bot'],
+  bootstrap: (funcUrls as Record<string, string>).bootstrap
+};
+
+// Сессионный токен из auth: остальные функции узнают пользователя по нему без запроса к БД
+let sessionToken: string | null = null;
+
+const authHeaders = (): Record<string, string> =>
+  sessionToken ? { 'X-Session-Token': sessionToken } : {};
+
+// Внутри Telegram пользователя подтверждает подписанный initData; telegram_id — только для локальной разработки
+const identityBody = (telegramId?: number): Record<string, unknown> => {
+  const initData = telegramAuth.getInitData();
+  return initData ? { init_data: initData } : { telegram_id: telegramId };
 };
 
 export interface User {
@@ -22,6 +36,8 @@ export interface User {
   is_blocked: boolean;
   created_at: string;
   updated_at: string;
+  session_token?: string;
+  session_expires_at?: number;
 }
 
 export interface Wallet {
@@ -92,20 +108,56 @@ export interface CryptoCurrency {
   decimals: number;
 }
 
+export interface BootstrapData {
+  user: User;
+  wallets: Wallet[];
+  rates: ExchangeRate[];
+  notifications: Notification[];
+  unread_count: number;
+  session_token?: string;
+  session_expires_at?: number;
+}
+
 export const api = {
+  bootstrap: {
+    load: async (telegramId: number): Promise<BootstrapData> => {
+      const response = await fetch(API_URLS.bootstrap, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', ...authHeaders() },
+        body: JSON.stringify(identityBody(telegramId))
+      });
+      if (!response.ok) {
+        throw new Error(`bootstrap failed: ${response.status}`);
+      }
+      const data: BootstrapData = await response.json();
+      if (data.session_token) {
+        sessionToken = data.session_token;
+      }
+      return data;
+    }
+  },
+
+
   auth: {
     register: async (data: {
-      telegram_id: number;
+      telegram_id?: number;
       username?: string;
       first_name?: string;
       referral_code?: string;
+      init_data?: string;
     }): Promise<User> => {
+      const { telegram_id, init_data, ...profile } = data;
+      const identity = init_data ? { init_data } : identityBody(telegram_id);
       const response = await fetch(API_URLS.auth, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(data)
+        body: JSON.stringify({ ...profile, ...identity })
       });
-      return response.json();
+      const user: User = await response.json();
+      if (user.session_token) {
+        sessionToken = user.session_token;
+      }
+      return user;
     }
   },
 
@@ -139,7 +191,7 @@ export const api = {
     }): Promise<CryptoInvoice> => {
       const response = await fetch(API_URLS.cryptoBot, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...authHeaders() },
         body: JSON.stringify(data)
       });
       const result = await response.json();
@@ -155,21 +207,21 @@ export const api = {
 
   wallets: {
     getAll: async (telegramId: number): Promise<Wallet[]> => {
-      const response = await fetch(`${API_URLS.wallets}?telegram_id=${telegramId}`);
+      const response = await fetch(`${API_URLS.wallets}?telegram_id=${telegramId}`, { headers: authHeaders() });
       return response.json();
     }
   },
 
   notifications: {
     getAll: async (telegramId: number): Promise<Notification[]> => {
-      const response = await fetch(`${API_URLS.notifications}?telegram_id=${telegramId}`);
+      const response = await fetch(`${API_URLS.notifications}?telegram_id=${telegramId}`, { headers: authHeaders() });
       return response.json();
     },
 
     markAsRead: async (notificationId: number): Promise<Notification> => {
       const response = await fetch(API_URLS.notifications, {
         method: 'PUT',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...authHeaders() },
         body: JSON.stringify({ notification_id: notificationId })
       });
       return response.json();
@@ -183,7 +235,7 @@ export const api = {
     }): Promise<Notification> => {
       const response = await fetch(API_URLS.notifications, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...authHeaders() },
         body: JSON.stringify(data)
       });
       return response.json();
@@ -192,7 +244,7 @@ export const api = {
 
   exchange: {
     getOrders: async (telegramId: number): Promise<ExchangeOrder[]> => {
-      const response = await fetch(`${API_URLS.exchange}?telegram_id=${telegramId}`);
+      const response = await fetch(`${API_URLS.exchange}?telegram_id=${telegramId}`, { headers: authHeaders() });
       return response.json();
     },
 
@@ -204,7 +256,7 @@ export const api = {
     }): Promise<ExchangeOrder> => {
       const response = await fetch(API_URLS.exchange, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...authHeaders() },
         body: JSON.stringify(data)
       });
       return response.json();
@@ -213,7 +265,7 @@ export const api = {
     updateStatus: async (orderId: number, status: string): Promise<ExchangeOrder> => {
       const response = await fetch(API_URLS.exchange, {
         method: 'PUT',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...authHeaders() },
         body: JSON.stringify({ order_id: orderId, status })
       });
       return response.json();